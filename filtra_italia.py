@@ -1,45 +1,73 @@
-import pandas as pd
+import csv
+import sys
 
-src = "unesco_od_italy.csv"
+from heritage.csvmap import MappedCSV
+
+src = sys.argv[1] if len(sys.argv) > 1 else "unesco_od_italy.csv"
 dst = "unesco_italia.csv"
 
-df = pd.read_csv(src, encoding="utf-8", sep=";")
-
-out = pd.DataFrame()
-out["unesco_id"] = df.get("id_number", df.get("id", ""))
-out["nome"] = df.get("site", df.get("name_en", ""))
-out["descrizione"] = df.get("short_description", df.get("short_description_en", ""))
-out["regione"] = df.get("region", df.get("region_en", ""))
-out["citta"] = df.get("location", df.get("location_en", ""))
-
-# coordinate
-if "latitude" in df.columns and "longitude" in df.columns:
-    out["lat"] = pd.to_numeric(df["latitude"].astype(str).str.replace(",", "."), errors="coerce")
-    out["long"] = pd.to_numeric(df["longitude"].astype(str).str.replace(",", "."), errors="coerce")
-elif "coordinates" in df.columns:
-    coords = df["coordinates"].astype(str).str.split(",", n=1, expand=True)
-    out["lat"] = pd.to_numeric(coords[0].str.replace(",", "."), errors="coerce")
-    out["long"] = pd.to_numeric(coords[1].str.replace(",", "."), errors="coerce")
-else:
-    out["lat"] = None
-    out["long"] = None
-
-out["categoria"] = df.get("category", "")
 
 def year4(x):
     s = str(x).strip()
     return int(s[:4]) if s[:4].isdigit() else None
-out["anno"] = df["date_inscribed"].map(year4) if "date_inscribed" in df.columns else None
 
-# accessibilità placeholder
-out["wheelchair"] = 0
-out["ausili_visivi"] = 0
-out["supporto_uditivo"] = 0
-out["note"] = ""
+
+def to_num(x):
+    try:
+        return float(str(x).strip().replace(",", "."))
+    except ValueError:
+        return None
+
 
 cols = ["unesco_id","nome","descrizione","regione","citta","lat","long",
         "categoria","anno","wheelchair","ausili_visivi","supporto_uditivo","note"]
-out = out[cols]
 
-out.to_csv(dst, index=False, encoding="utf-8")
-print(f"Creato {dst} con {len(out)} record.")
+with MappedCSV(src, delimiter=";") as f:
+    # per ogni campo la prima colonna presente nel file sorgente
+    sorgenti = {
+        "unesco_id": f.first_of("id_number", "id"),
+        "nome": f.first_of("site", "name_en"),
+        "descrizione": f.first_of("short_description", "short_description_en"),
+        "regione": f.first_of("region", "region_en"),
+        "citta": f.first_of("location", "location_en"),
+        "categoria": f.first_of("category"),
+        "anno": f.first_of("date_inscribed"),
+        "latitude": f.first_of("latitude"),
+        "longitude": f.first_of("longitude"),
+        "coordinates": f.first_of("coordinates"),
+    }
+    proiezione = [c for c in dict.fromkeys(sorgenti.values()) if c]
+
+    # sul dataset mondiale tiene solo l'Italia (anche siti transnazionali "Italy,Holy See");
+    # le righe di altri paesi vengono scartate sui byte grezzi, prima del parsing
+    filtri = {}
+    if "states_name_en" in f.header:
+        filtri = {"where": {"states_name_en": lambda v: "Italy" in v.split(",")}, "prefilter": b"Italy"}
+
+    n = 0
+    with open(dst, "w", newline="", encoding="utf-8") as out_f:
+        writer = csv.writer(out_f)
+        writer.writerow(cols)
+        for values in f.rows(proiezione, **filtri):
+            row = dict(zip(proiezione, values))
+            get = lambda campo: row.get(sorgenti[campo], "") if sorgenti[campo] else ""
+
+            # coordinate
+            if sorgenti["latitude"] and sorgenti["longitude"]:
+                lat, lng = to_num(get("latitude")), to_num(get("longitude"))
+            elif sorgenti["coordinates"]:
+                parti = get("coordinates").split(",", 1)
+                lat = to_num(parti[0])
+                lng = to_num(parti[1]) if len(parti) > 1 else None
+            else:
+                lat = lng = None
+
+            writer.writerow([
+                get("unesco_id"), get("nome"), get("descrizione"), get("regione"), get("citta"),
+                lat, lng, get("categoria"), year4(get("anno")) if sorgenti["anno"] else None,
+                # accessibilità placeholder
+                0, 0, 0, "",
+            ])
+            n += 1
+
+print(f"Creato {dst} con {n} record.")
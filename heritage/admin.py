@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Sito, Categoria, Accessibilita, Itinerario, Tappa, Booking
+from django.utils import timezone
+from .models import Sito, Categoria, Accessibilita, Itinerario, Tappa, Booking, Job, PostiPrenotati
+from .routing import reorder_itinerario
 @admin.register(Sito)
 class SitoAdmin(admin.ModelAdmin):
     list_display = ("nome", "citta", "regione", "categoria", "anno_iscrizione")
@@ -26,9 +28,39 @@ class TappaInline(admin.TabularInline):
 class ItinerarioAdmin(admin.ModelAdmin):
     list_display = ("nome",)
     inlines = [TappaInline]
+    actions = ["ottimizza_percorso"]
+
+    @admin.action(description="Ottimizza l'ordine delle tappe (percorso più breve)")
+    def ottimizza_percorso(self, request, queryset):
+        saved = 0.0
+        for itin in queryset:
+            before, after = reorder_itinerario(itin)
+            saved += before - after
+        self.message_user(request, f"Itinerari ottimizzati: {queryset.count()} | Km risparmiati: {saved:.1f}")
 
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
     list_display = ("itinerario", "nome", "email", "data", "numero_persone", "created_at")
     list_filter = ("data", "itinerario")
-    search_fields = ("nome", "email", "itinerario__nome")
\ No newline at end of file
+    search_fields = ("nome", "email", "itinerario__nome")
+
+
+@admin.register(PostiPrenotati)
+class PostiPrenotatiAdmin(admin.ModelAdmin):
+    list_display = ("itinerario", "data", "prenotati", "capienza")
+    list_filter = ("itinerario",)
+    date_hierarchy = "data"
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "nome", "stato", "priorita", "scheduled_at", "tentativi", "finished_at")
+    list_filter = ("stato", "nome")
+    search_fields = ("nome", "dedup_key")
+    actions = ["riprova"]
+
+    @admin.action(description="Rimetti in coda i lavori selezionati")
+    def riprova(self, request, queryset):
+        n = queryset.exclude(stato=Job.RUNNING).update(stato=Job.PENDING, tentativi=0, scheduled_at=timezone.now())
+        self.message_user(request, f"Lavori rimessi in coda: {n}")
+
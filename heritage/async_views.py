@@ -0,0 +1,131 @@
+"""Versioni async delle API di lettura, per il deploy ASGI (unesco_it/asgi.py).
+
+Le query passano dall'ORM async (``aiterator``, ``acount``, ``aget``) e la
+cache dalle sue API async; la serializzazione JSON, che occupa la CPU, gira
+in un pool di thread limitato (``HERITAGE_ASYNC_SERIALIZE_WORKERS``) così
+l'event loop resta libero e il numero di thread non cresce con i client.
+
+Payload, ETag e parametri sono gli stessi delle viste sync in views.py.
+Il guadagno c'è quando le richieste aspettano un DB o una cache remoti:
+ogni passaggio sync/async (middleware, ORM, cache locale) costa un cambio
+di thread, quindi con SQLite locale le viste sync restano più veloci
+(``manage.py benchmark --concurrency 1,8,32`` misura entrambe).
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from . import catalog, itinerari, profiling, search
+from .features import encode, feature_cache, render_collection
+from .models import Itinerario
+from .pagination import CursorError, akeyset_page, decode_cursor, parse_sort
+from .spatial import BBoxError
+from .versioning import acatalog_version
+from .views import (
+    COUNT_CACHE_TTL, _count_mode, _filter_params, _filter_signature, _page_ids, _paginate,
+    _query_digest, _sites_queryset,
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def serialize_pool():
+    """Pool condiviso (creato al primo uso) per il lavoro CPU delle viste async."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = getattr(settings, "HERITAGE_ASYNC_SERIALIZE_WORKERS", None) or min(4, os.cpu_count() or 1)
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="heritage-serialize")
+    return _pool
+
+
+async def offload(func, *args):
+    """Esegue `func` (senza DB) nel pool, con il contesto della richiesta (profilo compreso)."""
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(serialize_pool(), ctx.run, func, *args)
+
+
+def _serialize(func, *args):
+    with profiling.section("serialize"):
+        return func(*args)
+
+
+async def _acount(qs, request, mode):
+    if mode == "none":
+        return None
+    if mode == "estimate":
+        key = f"heritage:count:{await acatalog_version()}:{_filter_signature(request)}"
+        n = await cache.aget(key)
+        if n is None:
+            n = await qs.acount()
+            await cache.aset(key, n, COUNT_CACHE_TTL)
+        return n
+    return await qs.acount()
+
+
+async def _apage_ids(request, limit, offset):
+    params = _filter_params(request)
+    ranked = bool(params["q"]) and await sync_to_async(search.ranks)(params["q"])
+    sort = parse_sort(request.GET.get("sort") or ("rank" if ranked else "id"))
+    if catalog.enabled() and sort[0] == "id":
+        # catalogo in memoria: nessuna query da rendere async, solo lavoro CPU
+        return await sync_to_async(_page_ids)(request, limit, offset)
+    cursor = decode_cursor(request.GET.get("cursor"), sort)
+    # la costruzione del queryset può leggere lo schema (FTS, R*Tree) la prima volta
+    qs = await sync_to_async(_sites_queryset)(request, sort)
+    page, nxt, prv = await akeyset_page(qs, sort, cursor, limit, offset)
+    return page, await _acount(qs, request, _count_mode(request)), nxt, prv
+
+
+async def _sites_response(request):
+    limit, offset = _paginate(request)
+    try:
+        ids, total, nxt, prv = await _apage_ids(request, limit, offset)
+    except (BBoxError, CursorError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    entries = await feature_cache.aget_many(ids, partial(offload, _serialize))
+    body = await offload(_serialize, render_collection, entries, total, {"next": nxt, "prev": prv})
+    return HttpResponse(body, content_type="application/json")
+
+
+async def sites_geojson(request):
+    """Come views.sites_geojson: stessa pagina, stesso ETag."""
+    version = await acatalog_version()
+    feature_cache.sync(version)
+    etag = f'"{version}-{_query_digest(request)}"'
+    response = get_conditional_response(request, etag=etag) or await _sites_response(request)
+    response.headers.setdefault("ETag", etag)
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+async def itinerario_geojson(request, pk: int):
+    """Come views.itinerario_geojson, con la stessa chiave di cache."""
+    itin = await aget_object_or_404(Itinerario, pk=pk)
+    key = itinerari.cache_key(pk, await acatalog_version())
+    body = await cache.aget(key)
+    if body is None:
+        tappe = [t async for t in itinerari.tappe_qs(itin)]
+        body = await offload(_serialize, lambda: encode(itinerari.build(itin, tappe)))
+        await cache.aset(key, body, itinerari.CACHE_TTL)
+    return HttpResponse(body, content_type="application/json")
+
+
+async def itinerari_api(request):
+    """Come views.itinerari_api."""
+    limit, offset = _paginate(request)
+    qs = itinerari.list_queryset()
+    rows = [r async for r in qs[offset : offset + limit].aiterator()]
+    body = await offload(_serialize, itinerari.render_list, rows, await qs.acount(), limit, offset)
+    return HttpResponse(body, content_type="application/json")
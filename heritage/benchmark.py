@@ -0,0 +1,351 @@
+"""Benchmark riproducibile di API e comandi di import su dataset sintetici.
+
+``run_size`` lavora sul database corrente: il comando ``benchmark`` lo
+chiama dentro un database di test creato e distrutto per ogni dimensione,
+quindi il DB di sviluppo non viene toccato.
+
+Il dataset è generato con un seed fisso; le distribuzioni di accessibilità
+e categoria riprendono quelle del CSV di esempio (60 siti), con una quota
+di valori mancanti.
+
+Con ``concurrency`` le API di lettura sono misurate anche sotto carico
+concorrente, nella versione sync attraverso l'handler WSGI (un thread per
+client, come un server WSGI a thread) e nella versione async attraverso
+l'handler ASGI (un solo event loop, come un processo uvicorn).
+"""
+import asyncio
+import csv
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from pathlib import Path
+from urllib.parse import urlencode
+
+import django
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.handlers.asgi import ASGIHandler
+from django.test import Client
+from django.test.utils import override_settings
+
+from . import itinerari
+from .ingest import ACCESS_COLUMNS
+
+# P(True), P(False); il resto è "non noto"
+ACCESS_RATES = {
+    "wheelchair": (0.80, 0.12),
+    "ausili_visivi": (0.22, 0.70),
+    "supporto_uditivo": (0.11, 0.81),
+}
+NATURAL_RATE = 0.10
+REGIONI = [
+    "Lombardia", "Toscana", "Lazio", "Campania", "Sicilia", "Veneto", "Piemonte", "Emilia-Romagna",
+    "Puglia", "Liguria", "Sardegna", "Trentino-Alto Adige", "Umbria", "Marche", "Calabria", "Basilicata",
+]
+# bbox approssimativo dell'Italia
+LAT_RANGE = (36.6, 47.1)
+LON_RANGE = (6.6, 18.5)
+
+# cache locale e privata: cache.clear() non tocca la cache configurata (es. Redis condiviso)
+BENCHMARK_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "heritage-benchmark"},
+}
+
+SITE_HEADER = [
+    "unesco_id", "nome", "descrizione", "regione", "citta", "lat", "long", "categoria", "anno",
+    "wheelchair", "ausili_visivi", "supporto_uditivo", "note",
+]
+
+SITES_SCENARIOS = {
+    "all": {},
+    "wheelchair": {"wheelchair": "1"},
+    "acc_all": {"wheelchair": "1", "ausili_visivi": "1", "acc_mode": "all"},
+    "acc_any": {"ausili_visivi": "1", "supporto_uditivo": "1", "acc_mode": "any"},
+    "has_acc_data": {"has_acc_data": "1"},
+    "categoria": {"categoria": "naturale"},
+    "regione": {"regione": "Toscana"},
+    "bbox": {"bbox": "10.0,42.0,13.0,45.0", "zoom": "8"},
+    "q": {"q": "Lombardia"},
+    "limit_500": {"limit": "500"},
+}
+
+ID_BASE = 100000  # unesco_id numerici, come nel CSV reale
+N_ITINERARI = 50
+TAPPE_PER_ITINERARIO = 8
+
+
+def _flag(rng, rates):
+    x = rng.random()
+    return "1" if x < rates[0] else ("0" if x < rates[0] + rates[1] else "")
+
+
+def write_sites_csv(path, n, seed=0):
+    """CSV completo per import_sites con `n` siti sintetici."""
+    rng = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as fh:
+        w = csv.writer(fh)
+        w.writerow(SITE_HEADER)
+        for i in range(n):
+            regione = rng.choice(REGIONI)
+            w.writerow([
+                str(ID_BASE + i), f"Sito {i}", f"Descrizione sintetica del sito {i}, {regione}.", regione,
+                f"Comune {rng.randrange(max(1, n // 20))}",
+                round(rng.uniform(*LAT_RANGE), 5), round(rng.uniform(*LON_RANGE), 5),
+                "Natural" if rng.random() < NATURAL_RATE else "Cultural", rng.randrange(1979, 2024),
+                *(_flag(rng, ACCESS_RATES[c]) for c in ("wheelchair", "ausili_visivi", "supporto_uditivo")),
+                "",
+            ])
+
+
+def write_access_csv(path, n, seed=0, changed=0.1):
+    """CSV per import_access: stessi siti, una quota `changed` con accessibilità diversa."""
+    rng = random.Random(seed + 1)
+    with open(path, "w", newline="", encoding="utf-8") as fh:
+        w = csv.writer(fh)
+        w.writerow(ACCESS_COLUMNS)
+        for i in range(n):
+            flags = [_flag(rng, ACCESS_RATES[c]) for c in ("wheelchair", "ausili_visivi", "supporto_uditivo")]
+            if rng.random() < changed:
+                flags = [rng.choice(["1", "0"]) for _ in flags]
+            w.writerow([str(ID_BASE + i), f"Sito {i}", *flags])
+
+
+def timed_command(name, *args, **opts):
+    t0 = time.perf_counter()
+    call_command(name, *args, stdout=StringIO(), **opts)
+    return round(time.perf_counter() - t0, 4)
+
+
+def seed_itinerari(seed=0, n=N_ITINERARI, stops=TAPPE_PER_ITINERARIO):
+    """Itinerari sintetici su siti casuali (bulk, poi riepilogo in un passaggio)."""
+    from .models import Itinerario, Sito, Tappa
+
+    rng = random.Random(seed + 2)
+    ids = list(Sito.objects.values_list("id", flat=True))
+    itins = Itinerario.objects.bulk_create(Itinerario(nome=f"Itinerario {i:03d}") for i in range(n))
+    Tappa.objects.bulk_create(
+        Tappa(itinerario=it, sito_id=sid, ordine=o)
+        for it in itins
+        for o, sid in enumerate(rng.sample(ids, min(stops, len(ids))), start=1)
+    )
+    itinerari.refresh_rollup()
+    return [it.pk for it in itins]
+
+
+def percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def measure(client, url, params=None, repeat=30, warmup=3):
+    """Latenze (percentili), throughput sequenziale e query della richiesta `url`."""
+    t0 = time.perf_counter()
+    resp = client.get(url, params or {})
+    cold = time.perf_counter() - t0
+    for _ in range(max(0, warmup - 1)):
+        client.get(url, params or {})
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        resp = client.get(url, params or {})
+        samples.append(time.perf_counter() - t0)
+    profile = getattr(resp.wsgi_request, "profile", None)
+    return {
+        "status": resp.status_code,
+        "bytes": len(resp.content),
+        "queries": profile.count if profile else None,
+        "cold_ms": round(cold * 1000, 3),
+        **percentiles(samples),
+        "rps": round(len(samples) / sum(samples), 1),
+    }
+
+
+def _burst_result(results, wall):
+    """results: (secondi, status) per richiesta."""
+    samples = [dt for dt, _ in results]
+    errors = sum(1 for _, status in results if status != 200)
+    return {**percentiles(samples), "rps": round(len(samples) / wall, 1), "errors": errors}
+
+
+def wsgi_burst(url, params, concurrency, requests):
+    """`requests` richieste sulla vista sync, `concurrency` alla volta da thread diversi."""
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, "client"):
+            local.client = Client()
+        t0 = time.perf_counter()
+        status = local.client.get(url, params or {}).status_code
+        return time.perf_counter() - t0, status
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        t0 = time.perf_counter()
+        results = list(pool.map(one, range(requests)))
+        return _burst_result(results, time.perf_counter() - t0)
+
+
+async def asgi_get(app, url, params=None):
+    """GET attraverso l'applicazione ASGI; restituisce (status, body).
+
+    Non usa AsyncClient: il suo handler non apre un ThreadSensitiveContext per
+    richiesta, quindi tutte le query finirebbero in un unico thread.
+    """
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": url, "raw_path": url.encode(), "root_path": "",
+        "query_string": urlencode(params or {}).encode(), "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+    }
+    sent = False
+    status, body = None, []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()  # nessuna disconnessione del client
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(body)
+
+
+def asgi_burst(url, params, concurrency, requests):
+    """Come wsgi_burst, sulla vista async con un solo event loop."""
+    async def run():
+        app = ASGIHandler()
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with sem:
+                t0 = time.perf_counter()
+                status, _ = await asgi_get(app, url, params)
+                return time.perf_counter() - t0, status
+
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(one() for _ in range(requests)))
+        return _burst_result(results, time.perf_counter() - t0)
+
+    return asyncio.run(run())
+
+
+def concurrency_scenarios(itin_id):
+    """nome -> (url sync, url async, parametri)."""
+    return {
+        "sites_geojson": ("/api/sites.geojson", "/api/async/sites.geojson", {"limit": "100"}),
+        "sites_geojson:q": ("/api/sites.geojson", "/api/async/sites.geojson", SITES_SCENARIOS["q"]),
+        "itinerario_geojson": (f"/api/itinerario/{itin_id}.geojson", f"/api/async/itinerario/{itin_id}.geojson", None),
+        "itinerari_api": ("/api/itinerari", "/api/async/itinerari", {"limit": "20"}),
+    }
+
+
+def measure_concurrency(itin_id, levels, repeat=30):
+    """Per ogni scenario e livello di concorrenza: percentili e throughput WSGI e ASGI."""
+    out = {}
+    for name, (sync_url, async_url, params) in concurrency_scenarios(itin_id).items():
+        for c in levels:
+            requests = max(repeat, 4 * c)
+            # riscaldamento: cache delle feature, degli itinerari e dei conteggi
+            wsgi_burst(sync_url, params, 1, 2)
+            asgi_burst(async_url, params, 1, 2)
+            out[f"{name}:c{c}"] = {
+                "concurrency": c,
+                "requests": requests,
+                "wsgi": wsgi_burst(sync_url, params, c, requests),
+                "asgi": asgi_burst(async_url, params, c, requests),
+            }
+    return out
+
+
+@override_settings(CACHES=BENCHMARK_CACHES)
+def run_size(n, repeat=30, seed=0, workdir=None, concurrency=()):
+    """Popola il DB corrente con `n` siti e misura import e viste (con BENCHMARK_CACHES)."""
+    cache.clear()
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        sites_csv, access_csv = Path(tmp) / "sites.csv", Path(tmp) / "access.csv"
+        write_sites_csv(sites_csv, n, seed)
+        write_access_csv(access_csv, n, seed)
+        imports = {
+            "import_sites_s": timed_command("import_sites", str(sites_csv)),
+            "import_sites_noop_s": timed_command("import_sites", str(sites_csv)),
+            "import_access_s": timed_command("import_access", str(access_csv)),
+            "import_access_noop_s": timed_command("import_access", str(access_csv)),
+            "normalize_categories_s": timed_command("normalize_categories"),
+        }
+    itin_ids = seed_itinerari(seed)
+
+    client = Client()
+    endpoints = {}
+    # DEBUG=False: niente log delle query di Django, che falserebbe i tempi
+    with override_settings(DEBUG=False, HERITAGE_PROFILING=True, HERITAGE_QUERY_BUDGET_STRICT=False):
+        for name, params in SITES_SCENARIOS.items():
+            endpoints[f"sites_geojson:{name}"] = measure(client, "/api/sites.geojson", params, repeat)
+        endpoints["itinerario_geojson"] = measure(client, f"/api/itinerario/{itin_ids[0]}.geojson", None, repeat)
+        endpoints["itinerari_list"] = measure(client, "/itinerari/", None, repeat)
+        endpoints["itinerari_list:page2"] = measure(client, "/itinerari/", {"page": "2"}, repeat)
+    result = {"size": n, "imports": imports, "endpoints": endpoints}
+    if concurrency:
+        # senza profilo: sotto ASGI installarlo costa due passaggi di thread per richiesta
+        with override_settings(DEBUG=False, HERITAGE_PROFILING=False):
+            result["concurrency"] = measure_concurrency(itin_ids[0], concurrency, repeat)
+    return result
+
+
+def metadata(sizes, repeat, seed, concurrency=()):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "platform": platform.platform(),
+        "catalog_engine": getattr(settings, "HERITAGE_CATALOG_ENGINE", "orm"),
+        "sizes": list(sizes),
+        "repeat": repeat,
+        "seed": seed,
+        "concurrency": list(concurrency),
+    }
+
+
+def compare(old, new, metric="p50_ms"):
+    """Righe (size, nome, vecchio, nuovo, variazione %) per le misure presenti in entrambi i report."""
+    before = {
+        (r["size"], name): m[metric]
+        for r in old["results"] for name, m in r["endpoints"].items()
+    }
+    before.update({(r["size"], name): v for r in old["results"] for name, v in r["imports"].items()})
+    rows = []
+    for r in new["results"]:
+        current = {name: m[metric] for name, m in r["endpoints"].items()}
+        current.update(r["imports"])
+        for name, value in current.items():
+            prev = before.get((r["size"], name))
+            if prev:
+                rows.append((r["size"], name, prev, value, round((value - prev) / prev * 100, 1)))
+    return rows
@@ -0,0 +1,103 @@
+"""Capienza e disponibilità degli itinerari per data.
+
+I posti prenotati sono contati in ``PostiPrenotati`` (una riga per
+itinerario e data), aggiornata con un UPDATE condizionale::
+
+    UPDATE ... SET prenotati = prenotati + n WHERE id = ? AND prenotati + n <= capienza
+
+L'UPDATE è atomico e tocca una sola riga: due prenotazioni concorrenti non
+possono superare la capienza e nessuna delle due legge o blocca ``Booking``.
+Il calendario della disponibilità legge solo questa tabella.
+"""
+import datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+MAX_GIORNI = 366
+
+
+class CapacityError(ValueError):
+    """Posti insufficienti; `disponibili` è quanto resta per quella data."""
+
+    def __init__(self, disponibili):
+        super().__init__(f"Posti esauriti per questa data: ne restano {disponibili}.")
+        self.disponibili = disponibili
+
+
+def _counter(itinerario, data):
+    from .models import PostiPrenotati
+
+    try:
+        with transaction.atomic():
+            return PostiPrenotati.objects.get_or_create(
+                itinerario_id=itinerario.pk, data=data, defaults={"capienza": itinerario.capienza_giornaliera},
+            )[0]
+    except IntegrityError:
+        # creata nel frattempo da un'altra richiesta
+        return PostiPrenotati.objects.get(itinerario_id=itinerario.pk, data=data)
+
+
+def reserve(itinerario, data, n):
+    """Occupa `n` posti o solleva CapacityError; una sola UPDATE se il contatore esiste già."""
+    from .models import PostiPrenotati
+
+    qs = PostiPrenotati.objects.filter(itinerario_id=itinerario.pk, data=data)
+    if qs.filter(prenotati__lte=F("capienza") - n).update(prenotati=F("prenotati") + n):
+        return
+    counter = _counter(itinerario, data)
+    if qs.filter(pk=counter.pk, prenotati__lte=F("capienza") - n).update(prenotati=F("prenotati") + n):
+        return
+    counter.refresh_from_db(fields=["capienza", "prenotati"])
+    raise CapacityError(counter.disponibili)
+
+
+def adjust(itinerario_id, data, delta):
+    """Correzione senza controllo di capienza (modifiche/cancellazioni da admin o segnali)."""
+    from .models import Itinerario, PostiPrenotati
+
+    if delta == 0:
+        return
+    qs = PostiPrenotati.objects.filter(itinerario_id=itinerario_id, data=data)
+    if delta < 0:
+        # non scende sotto zero anche se il contatore è stato modificato a mano
+        qs.update(prenotati=Greatest(F("prenotati") + delta, 0))
+        return
+    if not qs.update(prenotati=F("prenotati") + delta):
+        itinerario = Itinerario.objects.only("id", "capienza_giornaliera").get(pk=itinerario_id)
+        _counter(itinerario, data)
+        qs.update(prenotati=F("prenotati") + delta)
+
+
+def update_capacity(itinerario):
+    """Allinea i contatori delle date future alla capienza attuale dell'itinerario.
+
+    Se la nuova capienza è inferiore ai posti già prenotati la data risulta piena.
+    """
+    from django.utils import timezone
+
+    from .models import PostiPrenotati
+
+    PostiPrenotati.objects.filter(itinerario_id=itinerario.pk, data__gte=timezone.localdate()).update(
+        capienza=Greatest(itinerario.capienza_giornaliera, F("prenotati"))
+    )
+
+
+def availability(itinerario, start, end):
+    """Un elemento per giorno in [start, end] con capienza, prenotati e disponibili."""
+    from .models import PostiPrenotati
+
+    rows = {
+        d: (cap, pren)
+        for d, cap, pren in PostiPrenotati.objects.filter(
+            itinerario_id=itinerario.pk, data__range=(start, end)
+        ).values_list("data", "capienza", "prenotati")
+    }
+    days = []
+    day = start
+    while day <= end:
+        cap, pren = rows.get(day, (itinerario.capienza_giornaliera, 0))
+        days.append({"data": day.isoformat(), "capienza": cap, "prenotati": pren, "disponibili": max(0, cap - pren)})
+        day += datetime.timedelta(days=1)
+    return days
@@ -0,0 +1,143 @@
+"""Catalogo colonnare in memoria dei Siti.
+
+Carica Sito, Categoria e Accessibilita in array NumPy (codici categorici,
+maschere tri-stato, coordinate float) e risponde ai filtri di
+/api/sites.geojson combinando maschere vettoriali, senza SQL.
+Si attiva con ``HERITAGE_CATALOG_ENGINE = "numpy"`` nei settings.
+"""
+import threading
+
+from django.conf import settings
+
+from .versioning import catalog_version
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPy è in requirements.txt
+    np = None
+
+# Codifica tri-stato dei flag di accessibilità
+NULL, FALSE, TRUE = -1, 0, 1
+ACC_FIELDS = ("sedia_a_rotelle", "ausili_visivi", "supporto_uditivo")
+
+
+def _tri(v):
+    return NULL if v is None else (TRUE if v else FALSE)
+
+
+def _categorical(values):
+    """Codici interi + mappa valore→codice (valori confrontati in minuscolo)."""
+    keys = [(v or "").lower() for v in values]
+    uniq = sorted(set(keys))
+    index = {k: i for i, k in enumerate(uniq)}
+    codes = np.fromiter((index[k] for k in keys), dtype=np.int32, count=len(keys))
+    return codes, index
+
+
+class SiteCatalog:
+    def __init__(self, rows):
+        """rows: tuple (id, nome, citta, regione, lat, lng, categoria, wc, av, su) ordinate per id."""
+        n = len(rows)
+        cols = list(zip(*rows)) if rows else [()] * 10
+        self.ids = np.fromiter(cols[0], dtype=np.int64, count=n)
+        self.lat = np.array([np.nan if v is None else v for v in cols[4]], dtype=np.float64)
+        self.lon = np.array([np.nan if v is None else v for v in cols[5]], dtype=np.float64)
+        self.citta, self._citta_index = _categorical(cols[2])
+        self.regione, self._regione_index = _categorical(cols[3])
+        self.categoria, self._categoria_index = _categorical(cols[6])
+        self.acc = {
+            field: np.fromiter((_tri(v) for v in col), dtype=np.int8, count=n)
+            for field, col in zip(ACC_FIELDS, cols[7:10])
+        }
+        # testo su cui cercare q (come icontains su nome/città/regione)
+        self.testo = np.array(
+            ["\x00".join((a or "", b or "", c or "")).lower() for a, b, c in zip(cols[1], cols[2], cols[3])],
+            dtype=str,
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _code_mask(self, codes, index, value):
+        code = index.get(value.lower())
+        if code is None:
+            return np.zeros(len(self), dtype=bool)
+        return codes == code
+
+    def mask(self, params):
+        """Maschera booleana dei siti che soddisfano i filtri."""
+        m = np.ones(len(self), dtype=bool)
+        if params.get("q_ids") is not None:
+            # risultati già calcolati dall'indice full-text
+            m &= np.isin(self.ids, np.asarray(params["q_ids"], dtype=np.int64))
+        elif params.get("q"):
+            m &= np.char.find(self.testo, params["q"].lower()) >= 0
+        if params.get("categoria"):
+            m &= self._code_mask(self.categoria, self._categoria_index, params["categoria"])
+        if params.get("regione"):
+            m &= self._code_mask(self.regione, self._regione_index, params["regione"])
+        if params.get("citta"):
+            m &= self._code_mask(self.citta, self._citta_index, params["citta"])
+
+        acc_masks = [
+            self.acc[field] == _tri(params[field])
+            for field in ACC_FIELDS
+            if params.get(field) is not None
+        ]
+        if acc_masks:
+            combine = np.logical_and if params.get("acc_mode") == "all" else np.logical_or
+            m &= combine.reduce(acc_masks)
+        if params.get("has_acc_data"):
+            m &= np.logical_or.reduce([self.acc[f] != NULL for f in ACC_FIELDS])
+
+        bbox = params.get("bbox")
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            lon_ok = (
+                (self.lon >= min_lon) & (self.lon <= max_lon)
+                if min_lon <= max_lon
+                else (self.lon >= min_lon) | (self.lon <= max_lon)
+            )
+            m &= lon_ok & (self.lat >= min_lat) & (self.lat <= max_lat)
+        return m
+
+    def filter_ids(self, params):
+        """Id (ordinati) dei siti che soddisfano i filtri."""
+        return self.ids[self.mask(params)]
+
+
+_lock = threading.Lock()
+_catalog = None
+_version = None
+
+
+def enabled() -> bool:
+    return np is not None and getattr(settings, "HERITAGE_CATALOG_ENGINE", "orm") == "numpy"
+
+
+def get_catalog():
+    """Catalogo caricato al primo utilizzo (una sola query) e ricaricato se il dataset cambia."""
+    global _catalog, _version
+    version = catalog_version()
+    with _lock:
+        if _catalog is None or _version != version:
+            from .models import Sito
+
+            rows = list(
+                Sito.objects.order_by("id").values_list(
+                    "id", "nome", "citta", "regione", "latitudine", "longitudine",
+                    "categoria__nome",
+                    "accessibilita__sedia_a_rotelle",
+                    "accessibilita__ausili_visivi",
+                    "accessibilita__supporto_uditivo",
+                )
+            )
+            _catalog = SiteCatalog(rows)
+            _version = version
+        return _catalog
+
+
+def invalidate():
+    global _catalog
+    with _lock:
+        _catalog = None
@@ -0,0 +1,220 @@
+"""Piramide di cluster per livello di zoom (griglia in Web Mercator).
+
+La piramide viene costruita una volta dai Siti e poi aggiornata in modo
+incrementale dai segnali di salvataggio/cancellazione: ogni richiesta
+all'endpoint dei cluster è una semplice lettura delle celle.
+"""
+import math
+import threading
+
+from .versioning import catalog_version
+
+MAX_ZOOM = 16  # oltre questo zoom ogni sito ha la sua cella
+CLUSTER_RADIUS_PX = 60
+
+
+def _mercator(lon, lat):
+    """Coordinate normalizzate [0, 1) in Web Mercator."""
+    lat = max(-85.05112878, min(85.05112878, lat))
+    x = (lon + 180.0) / 360.0
+    s = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)
+    return x, y
+
+
+def _cells_per_axis(zoom):
+    return max(1, (256 << zoom) // CLUSTER_RADIUS_PX)
+
+
+class _Cell:
+    __slots__ = ("count", "sum_lon", "sum_lat", "ids")
+
+    def __init__(self):
+        self.count = 0
+        self.sum_lon = 0.0
+        self.sum_lat = 0.0
+        self.ids = set()
+
+
+class ClusterPyramid:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._levels = None  # zoom -> {(cx, cy): _Cell}
+        self._sites = {}     # id -> (lon, lat, props, [chiave cella per zoom])
+        self.version = None  # versione del dataset da cui è stata costruita
+
+    @property
+    def is_built(self) -> bool:
+        return self._levels is not None
+
+    def build(self, rows, version=None):
+        """rows: iterabile di (id, lon, lat, props)."""
+        with self._lock:
+            self.version = version
+            self._levels = [dict() for _ in range(MAX_ZOOM + 1)]
+            self._sites = {}
+            for sid, lon, lat, props in rows:
+                self._add(sid, lon, lat, props)
+
+    def invalidate(self):
+        with self._lock:
+            self._levels = None
+            self._sites = {}
+            self.version = None
+
+    def advance(self, old, new):
+        """Dopo un aggiornamento incrementale: passa a `new` solo se era allineata a `old`."""
+        with self._lock:
+            if self._levels is None:
+                return
+            if self.version == old:
+                self.version = new
+            else:
+                self._levels = None
+                self._sites = {}
+                self.version = None
+
+    def upsert(self, sid, lon, lat, props):
+        """Aggiorna un sito (no-op se la piramide non è ancora costruita)."""
+        with self._lock:
+            if self._levels is None:
+                return
+            self._remove(sid)
+            if lon is not None and lat is not None:
+                self._add(sid, lon, lat, props)
+
+    def remove(self, sid):
+        with self._lock:
+            if self._levels is not None:
+                self._remove(sid)
+
+    def _add(self, sid, lon, lat, props):
+        x, y = _mercator(lon, lat)
+        keys = []
+        for zoom, level in enumerate(self._levels):
+            n = _cells_per_axis(zoom)
+            key = (min(n - 1, int(x * n)), min(n - 1, int(y * n)))
+            cell = level.get(key)
+            if cell is None:
+                cell = level[key] = _Cell()
+            cell.count += 1
+            cell.sum_lon += lon
+            cell.sum_lat += lat
+            cell.ids.add(sid)
+            keys.append(key)
+        self._sites[sid] = (lon, lat, props, keys)
+
+    def _remove(self, sid):
+        entry = self._sites.pop(sid, None)
+        if entry is None:
+            return
+        lon, lat, _, keys = entry
+        for level, key in zip(self._levels, keys):
+            cell = level[key]
+            cell.count -= 1
+            if cell.count == 0:
+                del level[key]
+            else:
+                cell.sum_lon -= lon
+                cell.sum_lat -= lat
+                cell.ids.discard(sid)
+
+    def query(self, zoom, bbox=None):
+        """Feature GeoJSON dei cluster visibili al livello di zoom; None se la piramide non è costruita."""
+        zoom = max(0, min(zoom, MAX_ZOOM))
+        with self._lock:
+            levels = self._levels
+            if levels is None:
+                # invalidata da un salvataggio in un altro thread dopo get_pyramid()
+                return None
+            level = levels[zoom]
+            if bbox is None:
+                cells = list(level.items())
+            else:
+                cells = self._cells_in_bbox(level, zoom, bbox)
+            return [self._feature(cell) for _, cell in cells]
+
+    def _cells_in_bbox(self, level, zoom, bbox):
+        n = _cells_per_axis(zoom)
+        min_lon, min_lat, max_lon, max_lat = bbox
+        _, y0 = _mercator(min_lon, max_lat)
+        _, y1 = _mercator(min_lon, min_lat)
+        cy0, cy1 = int(y0 * n), min(n - 1, int(y1 * n))
+        x_ranges = []
+        for lo, hi in ([(min_lon, max_lon)] if min_lon <= max_lon else [(min_lon, 180.0), (-180.0, max_lon)]):
+            x_ranges.append((int(_mercator(lo, 0)[0] * n), min(n - 1, int(_mercator(hi, 0)[0] * n))))
+
+        span = sum(hi - lo + 1 for lo, hi in x_ranges) * (cy1 - cy0 + 1)
+        if span <= len(level):
+            out = []
+            for lo, hi in x_ranges:
+                for cx in range(lo, hi + 1):
+                    for cy in range(cy0, cy1 + 1):
+                        cell = level.get((cx, cy))
+                        if cell is not None:
+                            out.append(((cx, cy), cell))
+            return out
+        return [
+            (key, cell) for key, cell in level.items()
+            if cy0 <= key[1] <= cy1 and any(lo <= key[0] <= hi for lo, hi in x_ranges)
+        ]
+
+    def _feature(self, cell):
+        if cell.count == 1:
+            (sid,) = cell.ids
+            lon, lat, props, _ = self._sites[sid]
+            properties = {"cluster": False, "id": sid, **props}
+        else:
+            lon = cell.sum_lon / cell.count
+            lat = cell.sum_lat / cell.count
+            properties = {"cluster": True, "point_count": cell.count}
+        return {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": properties,
+        }
+
+
+pyramid = ClusterPyramid()
+
+
+def site_props(sito):
+    """Proprietà mostrate nel popup dei punti non raggruppati."""
+    return {
+        "name": sito.nome,
+        "city": sito.citta,
+        "region": sito.regione,
+        "category": (sito.categoria.nome if sito.categoria_id else None),
+    }
+
+
+def _load(target, version):
+    from .models import Sito
+
+    qs = Sito.objects.select_related("categoria").filter(
+        latitudine__isnull=False, longitudine__isnull=False
+    )
+    target.build(
+        ((s.id, s.longitudine, s.latitudine, site_props(s)) for s in qs.iterator()),
+        version=version,
+    )
+
+
+def get_pyramid():
+    """Piramide costruita al primo utilizzo (e ricostruita se il dataset è cambiato)."""
+    version = catalog_version()
+    if not pyramid.is_built or pyramid.version != version:
+        _load(pyramid, version)
+    return pyramid
+
+
+def query(zoom, bbox=None, attempts=3):
+    """Cluster visibili, ricostruendo la piramide se viene invalidata durante la richiesta."""
+    for _ in range(attempts):
+        features = get_pyramid().query(zoom, bbox)
+        if features is not None:
+            return features
+    # invalidazioni continue (es. import in corso): piramide privata per questa richiesta
+    local = ClusterPyramid()
+    _load(local, catalog_version())
+    return local.query(zoom, bbox)
@@ -0,0 +1,172 @@
+"""Lettore CSV su file mappato in memoria, con proiezione delle colonne.
+
+Il file non viene mai caricato per intero: i record si trovano cercando i
+newline direttamente nella mappatura e di ogni riga si decodificano solo
+le colonne richieste. I filtri (es. ``states_name_en == "Italy"``) vengono
+prima verificati sui byte grezzi, così le righe scartate non sono mai
+decodificate né divise in campi. La memoria resta costante anche su file
+da centinaia di MB.
+
+Modulo senza dipendenze da Django: lo usano sia ``filtra_italia.py`` sia
+la pipeline di import (``heritage.ingest``).
+"""
+import csv
+import mmap
+import os
+
+
+def count_quotes(buf, start, end):
+    return buf[start:end].count(b'"')
+
+
+def record_end(buf, pos, quotes, size):
+    """Fine del record che contiene `pos` (posizione dopo il newline).
+
+    `quotes` è il numero di virgolette in buf[:pos]: un newline chiude un
+    record solo se le virgolette viste fin lì sono in numero pari.
+    """
+    while True:
+        nl = buf.find(b"\n", pos, size)
+        if nl == -1:
+            return size, quotes + count_quotes(buf, pos, size)
+        quotes += count_quotes(buf, pos, nl)
+        pos = nl + 1
+        if quotes % 2 == 0:
+            return pos, quotes
+
+
+class MappedCSV:
+    """CSV mappato in memoria; da usare come context manager."""
+
+    def __init__(self, path, delimiter=",", encoding="utf-8"):
+        self.path = path
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.header = []
+        self.data_start = 0
+        self.size = 0
+        self._file = self._mm = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        self.size = os.path.getsize(self.path)
+        if self.size == 0:
+            return self
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data_start, _ = record_end(self._mm, 0, 0, self.size)
+        raw = self._mm[: self.data_start].decode("utf-8-sig" if self.encoding == "utf-8" else self.encoding)
+        self.header = [h.strip() for h in next(csv.reader([raw.rstrip("\r\n")], delimiter=self.delimiter), [])]
+        return self
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+        self._file = self._mm = None
+
+    @property
+    def buffer(self):
+        return self._mm
+
+    def index(self, column):
+        try:
+            return self.header.index(column)
+        except ValueError:
+            raise KeyError(f"colonna non trovata: {column}") from None
+
+    def first_of(self, *candidates):
+        """Prima colonna esistente tra i nomi alternativi (None se nessuna)."""
+        return next((c for c in candidates if c in self.header), None)
+
+    def lines(self, start=None, end=None):
+        """Record grezzi (bytes, senza terminatore) tra gli offset start ed end."""
+        mm = self._mm
+        if mm is None:
+            return
+        pos = self.data_start if start is None else start
+        end = self.size if end is None else end
+        while pos < end:
+            nl = mm.find(b"\n", pos, end)
+            stop = end if nl == -1 else nl + 1
+            line = mm[pos:stop]
+            # newline dentro un campo tra virgolette: estende fino a fine record
+            if line.count(b'"') % 2:
+                stop, _ = record_end(mm, pos, 0, end)
+                line = mm[pos:stop]
+            pos = stop
+            line = line.rstrip(b"\r\n")
+            if line:
+                yield line
+
+    def rows(self, columns=None, where=None, prefilter=None, start=None, end=None):
+        """Tuple di stringhe con le sole `columns` (default: tutte).
+
+        `where`: {colonna: valore o funzione(valore) -> bool}; i valori
+        stringa vengono cercati anche come byte grezzi prima del parsing.
+        `prefilter`: byte (o lista di byte) che una riga deve contenere.
+        """
+        columns = list(columns or self.header)
+        idx = [self.index(c) for c in columns]
+        conds = [(self.index(c), v) for c, v in (where or {}).items()]
+        if prefilter is None:
+            needles = [v.encode(self.encoding) for _, v in conds if isinstance(v, str)]
+        else:
+            needles = [prefilter] if isinstance(prefilter, bytes) else list(prefilter)
+
+        needed = sorted(set(idx) | {i for i, _ in conds})
+        width = needed[-1] + 1 if needed else 0
+        delim = self.delimiter.encode(self.encoding)
+        enc = self.encoding
+
+        for line in self.lines(start, end):
+            if needles and not all(n in line for n in needles):
+                continue
+            if b'"' in line:
+                fields = next(csv.reader([line.decode(enc)], delimiter=self.delimiter), [])
+            else:
+                parts = line.split(delim)
+                fields = [parts[i].decode(enc) if i < len(parts) else "" for i in range(min(width, len(parts)))]
+            if len(fields) < width:
+                fields += [""] * (width - len(fields))
+            if any(not (v(fields[i]) if callable(v) else fields[i] == v) for i, v in conds):
+                continue
+            yield tuple(fields[i] for i in idx)
+
+    def records(self, columns=None, dtypes=None, **filters):
+        """Come rows(), ma come record array NumPy (una colonna per campo).
+
+        `dtypes`: {colonna: dtype}; le colonne senza dtype sono stringhe.
+        """
+        import numpy as np
+
+        columns = list(columns or self.header)
+        data = [[] for _ in columns]
+        for row in self.rows(columns, **filters):
+            for col, value in zip(data, row):
+                col.append(value)
+        dtypes = dtypes or {}
+        arrays = [_column_array(np, values, dtypes.get(c)) for c, values in zip(columns, data)]
+        return np.rec.fromarrays(arrays, names=columns)
+
+
+def _column_array(np, values, dtype):
+    if dtype is None:
+        return np.array(values, dtype=str)
+    kind = np.dtype(dtype).kind
+    if kind == "f":
+        # celle vuote o non numeriche → NaN
+        out = np.full(len(values), np.nan, dtype=dtype)
+        for i, v in enumerate(values):
+            try:
+                out[i] = float(v.replace(",", "."))
+            except ValueError:
+                pass
+        return out
+    return np.array(values, dtype=dtype)
@@ -0,0 +1,236 @@
+"""Conteggi per faccette (categoria, regione, accessibilità) da bitmap in memoria.
+
+Per ogni valore di ogni faccetta c'è un bitset NumPy (``np.packbits``) sulle
+posizioni dei siti ordinati per id; i conteggi sotto i filtri correnti sono
+AND/OR tra bitset e popcount, senza GROUP BY.
+
+I conteggi sono "disgiuntivi": il numero accanto a un valore è quanti
+risultati si otterrebbero scegliendolo, tenendo fermi gli altri filtri
+(compreso ``acc_mode`` any/all tra i flag di accessibilità).
+
+L'indice è caricato al primo uso e segue la versione del dataset; i
+salvataggi di singoli Sito lo aggiornano sul posto (``upsert``/``remove`` +
+``advance``), le modifiche di massa ne provocano il ricaricamento.
+"""
+import threading
+
+import numpy as np
+
+from .catalog import ACC_FIELDS, FALSE, NULL, TRUE, _tri
+from .versioning import catalog_version
+
+# nome del parametro della API / valore della select in home.html
+ACC_PARAMS = {"sedia_a_rotelle": "wheelchair", "ausili_visivi": "ausili_visivi", "supporto_uditivo": "supporto_uditivo"}
+TRI_KEYS = {TRUE: "1", FALSE: "0", NULL: "null"}
+
+if hasattr(np, "bitwise_count"):
+    def popcount(bits):
+        return int(np.bitwise_count(bits).sum(dtype=np.int64))
+else:  # NumPy < 2.0
+    _POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(bits):
+        return int(_POPCOUNT[bits].sum(dtype=np.int64))
+
+
+def _bits(mask):
+    return np.packbits(np.asarray(mask, dtype=bool))
+
+
+class FacetIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.ids = np.empty(0, dtype=np.int64)
+
+    # --- costruzione ------------------------------------------------------
+
+    def load(self, rows, categorie, accessibilita):
+        """rows: (id, citta, regione, lat, lon, categoria_id, accessibilita_id) ordinate per id."""
+        n = len(rows)
+        cols = list(zip(*rows)) if rows else [()] * 7
+        self.ids = np.fromiter(cols[0], dtype=np.int64, count=n)
+        self.citta = np.array([(c or "").lower() for c in cols[1]], dtype=object)
+        self.lat = np.array([np.nan if v is None else v for v in cols[3]], dtype=np.float64)
+        self.lon = np.array([np.nan if v is None else v for v in cols[4]], dtype=np.float64)
+        self.categorie = dict(categorie)        # id -> nome
+        self.accessibilita = dict(accessibilita)  # id -> (wc, av, su) tri-stato
+        self.alive = _bits(np.ones(n, dtype=bool))
+
+        self.values = {"categoria": {}, "regione": {}}
+        self.labels = {"categoria": {}, "regione": {}}
+        for dim, col in (("categoria", [self.categorie.get(c) for c in cols[5]]), ("regione", cols[2])):
+            keys = np.array([(v or "").lower() for v in col], dtype=object)
+            for label in sorted({v for v in col if v}):
+                self.values[dim][label.lower()] = _bits(keys == label.lower())
+                self.labels[dim][label.lower()] = label
+        flags = np.array([self.accessibilita.get(a, (NULL,) * 3) for a in cols[6]], dtype=np.int8).reshape(n, 3)
+        for j, field in enumerate(ACC_FIELDS):
+            self.values[field] = {tri: _bits(flags[:, j] == tri) for tri in TRI_KEYS}
+
+    # --- aggiornamento incrementale ---------------------------------------
+
+    def _set(self, bits, pos, on):
+        if on:
+            bits[pos >> 3] |= np.uint8(0x80 >> (pos & 7))
+        else:
+            bits[pos >> 3] &= np.uint8(~(0x80 >> (pos & 7)) & 0xFF)
+
+    def _all_bitmaps(self):
+        yield self.alive
+        for dim in self.values.values():
+            yield from dim.values()
+
+    def _clear(self, pos):
+        for bits in self._all_bitmaps():
+            self._set(bits, pos, False)
+
+    def upsert(self, sito):
+        """Aggiorna i bit del sito; se servirebbe un valore sconosciuto l'indice viene scartato."""
+        with self._lock:
+            if self.version is None:
+                return
+            cat = self.categorie.get(sito.categoria_id) if sito.categoria_id else None
+            acc = self.accessibilita.get(sito.accessibilita_id, None) if sito.accessibilita_id else (NULL,) * 3
+            if (sito.categoria_id and cat is None) or acc is None:
+                self.version = None
+                return
+            pos = int(np.searchsorted(self.ids, sito.pk))
+            if pos == len(self.ids) or self.ids[pos] != sito.pk:
+                if pos != len(self.ids):
+                    # id fuori ordine (es. snapshot): più semplice ricostruire
+                    self.version = None
+                    return
+                self._append(sito.pk)
+            else:
+                self._clear(pos)
+            self.citta[pos] = (sito.citta or "").lower()
+            self.lat[pos] = np.nan if sito.latitudine is None else sito.latitudine
+            self.lon[pos] = np.nan if sito.longitudine is None else sito.longitudine
+            self._set(self.alive, pos, True)
+            for dim, label in (("categoria", cat), ("regione", sito.regione)):
+                if label:
+                    bits = self.values[dim].setdefault(label.lower(), np.zeros_like(self.alive))
+                    self.labels[dim].setdefault(label.lower(), label)
+                    self._set(bits, pos, True)
+            for field, tri in zip(ACC_FIELDS, acc):
+                self._set(self.values[field][tri], pos, True)
+
+    def _append(self, pk):
+        n = len(self.ids)
+        self.ids = np.append(self.ids, np.int64(pk))
+        self.citta = np.append(self.citta, "")
+        self.lat = np.append(self.lat, np.nan)
+        self.lon = np.append(self.lon, np.nan)
+        if n % 8 == 0:
+            self.alive = np.append(self.alive, np.uint8(0))
+            for dim in self.values.values():
+                for key in dim:
+                    dim[key] = np.append(dim[key], np.uint8(0))
+
+    def remove(self, pk):
+        with self._lock:
+            if self.version is None:
+                return
+            pos = int(np.searchsorted(self.ids, pk))
+            if pos < len(self.ids) and self.ids[pos] == pk:
+                self._clear(pos)
+
+    def advance(self, old, new):
+        """Dopo un aggiornamento locale: passa a `new` solo se era allineato a `old`."""
+        with self._lock:
+            self.version = new if self.version == old else None
+
+    # --- interrogazione ---------------------------------------------------
+
+    def _positions(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        pos = np.searchsorted(self.ids, ids)
+        ok = pos < len(self.ids)
+        ok[ok] = self.ids[pos[ok]] == ids[ok]
+        mask = np.zeros(len(self.ids), dtype=bool)
+        mask[pos[ok]] = True
+        return _bits(mask)
+
+    def _selected(self, dim, value):
+        return self.values[dim].get(value.lower(), np.zeros_like(self.alive))
+
+    def counts(self, params):
+        """Totale e conteggi per faccetta sotto i filtri `params` (vedi views._filter_params)."""
+        base = self.alive.copy()
+        if params.get("q_ids") is not None:
+            base &= self._positions(params["q_ids"])
+        if params.get("citta"):
+            base &= _bits(self.citta == params["citta"].lower())
+        if params.get("bbox") is not None:
+            min_lon, min_lat, max_lon, max_lat = params["bbox"]
+            lon_ok = (
+                (self.lon >= min_lon) & (self.lon <= max_lon)
+                if min_lon <= max_lon
+                else (self.lon >= min_lon) | (self.lon <= max_lon)
+            )
+            base &= _bits(lon_ok & (self.lat >= min_lat) & (self.lat <= max_lat))
+        if params.get("has_acc_data"):
+            base &= ~(self.values[ACC_FIELDS[0]][NULL] & self.values[ACC_FIELDS[1]][NULL]
+                      & self.values[ACC_FIELDS[2]][NULL])
+
+        dims = {dim: self._selected(dim, params[dim]) for dim in ("categoria", "regione") if params.get(dim)}
+        acc = {f: self.values[f][_tri(params[f])] for f in ACC_FIELDS if params.get(f) is not None}
+        all_mode = params.get("acc_mode") == "all"
+
+        def combine(bitmaps):
+            if not bitmaps:
+                return None
+            out = bitmaps[0].copy()
+            for b in bitmaps[1:]:
+                out = out & b if all_mode else out | b
+            return out
+
+        def restrict(bits, skip_dim=None, acc_bitmaps=None):
+            out = bits.copy()
+            for dim, sel in dims.items():
+                if dim != skip_dim:
+                    out &= sel
+            combo = combine(list(acc.values()) if acc_bitmaps is None else acc_bitmaps)
+            if combo is not None:
+                out &= combo
+            return out
+
+        matching = restrict(base)
+        facets = {}
+        for dim in ("categoria", "regione"):
+            within = restrict(base, skip_dim=dim)
+            facets[dim] = {self.labels[dim][k]: popcount(within & bits) for k, bits in self.values[dim].items()}
+        for field in ACC_FIELDS:
+            others = [b for f, b in acc.items() if f != field]
+            facets[ACC_PARAMS[field]] = {
+                key: popcount(restrict(base, acc_bitmaps=others + [self.values[field][tri]]))
+                for tri, key in TRI_KEYS.items()
+            }
+        return {"count": popcount(matching), "facets": facets}
+
+
+facet_index = FacetIndex()
+
+
+def get_index():
+    """Indice caricato al primo uso (tre query) e ricaricato se il dataset cambia."""
+    version = catalog_version()
+    with facet_index._lock:
+        if facet_index.version == version:
+            return facet_index
+        from .models import Accessibilita, Categoria, Sito
+
+        rows = list(
+            Sito.objects.order_by("id").values_list(
+                "id", "citta", "regione", "latitudine", "longitudine", "categoria_id", "accessibilita_id",
+            )
+        )
+        categorie = Categoria.objects.values_list("id", "nome")
+        accessibilita = {
+            a: (_tri(wc), _tri(av), _tri(su))
+            for a, wc, av, su in Accessibilita.objects.values_list("id", *ACC_FIELDS)
+        }
+        facet_index.load(rows, categorie, accessibilita)
+        facet_index.version = version
+    return facet_index
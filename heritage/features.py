@@ -0,0 +1,162 @@
+"""Cache delle feature GeoJSON dei Siti, già codificate in bytes.
+
+Ogni sito viene serializzato una sola volta; la risposta della API è la
+concatenazione dei frammenti. La cache è invalidata per sito dai segnali e
+per intero quando cambia la versione del dataset (vedi versioning.py).
+"""
+import json
+import threading
+
+from .versioning import catalog_version
+
+
+def feature_dict(s):
+    """Feature GeoJSON di un Sito (richiede categoria/accessibilita già caricate)."""
+    acc = s.accessibilita
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [s.longitudine, s.latitudine]},
+        "properties": {
+            "id": s.id,
+            "unesco_id": s.unesco_id,
+            "name": s.nome,
+            "city": s.citta,
+            "region": s.regione,
+            "category": (s.categoria.nome if s.categoria_id else None),
+            "acc": {
+                "sedia_a_rotelle": (acc.sedia_a_rotelle if acc else None),
+                "ausili_visivi": (acc.ausili_visivi if acc else None),
+                "supporto_uditivo": (acc.supporto_uditivo if acc else None),
+                "has_data": bool(acc and acc.has_data),
+                "any_true": bool(acc and acc.any_true),
+            },
+        },
+    }
+
+
+def encode(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+class FeatureCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}  # id -> (bytes, lon, lat) oppure None se senza coordinate
+        self.version = None
+
+    def sync(self, version):
+        """Svuota la cache se il dataset è cambiato in un altro processo."""
+        with self._lock:
+            if self.version != version:
+                self._data.clear()
+                self.version = version
+
+    def advance(self, old, new):
+        """Dopo un'invalidazione locale: passa a `new` solo se era allineata a `old`."""
+        with self._lock:
+            if self.version == old:
+                self.version = new
+            else:
+                self._data.clear()
+                self.version = None
+
+    def discard(self, ids):
+        with self._lock:
+            for i in ids:
+                self._data.pop(i, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_many(self, ids):
+        """Frammenti per gli id richiesti (nell'ordine dato), caricando i mancanti dal DB."""
+        with self._lock:
+            found = {i: self._data[i] for i in ids if i in self._data}
+        missing = [i for i in ids if i not in found]
+        if missing:
+            found.update(self._store(self._missing_qs(missing)))
+        return [found[i] for i in ids if found.get(i) is not None]
+
+    async def aget_many(self, ids, offload):
+        """Come get_many, con i mancanti letti dall'ORM async.
+
+        La codifica dei mancanti gira in `offload(func, *args)` (es. il pool di
+        async_views), non nell'event loop.
+        """
+        with self._lock:
+            found = {i: self._data[i] for i in ids if i in self._data}
+        missing = [i for i in ids if i not in found]
+        if missing:
+            siti = [s async for s in self._missing_qs(missing)]
+            found.update(await offload(self._store, siti))
+        return [found[i] for i in ids if found.get(i) is not None]
+
+    def _missing_qs(self, ids):
+        from .models import Sito
+
+        return Sito.objects.select_related("categoria", "accessibilita").filter(id__in=ids)
+
+    def _store(self, siti):
+        loaded = {}
+        for s in siti:
+            if s.latitudine is None or s.longitudine is None:
+                loaded[s.id] = None
+            else:
+                loaded[s.id] = (encode(feature_dict(s)), s.longitudine, s.latitudine)
+        with self._lock:
+            self._data.update(loaded)
+        return loaded
+
+
+feature_cache = FeatureCache()
+
+
+def render_collection(entries, total, extra=None) -> bytes:
+    """FeatureCollection con count e bbox, assemblata dai frammenti in cache."""
+    head = {"type": "FeatureCollection"}
+    tail = {"count": total, **(extra or {})}
+    if entries:
+        lons = [e[1] for e in entries]
+        lats = [e[2] for e in entries]
+        tail["bbox"] = [min(lons), min(lats), max(lons), max(lats)]
+    return b"".join([
+        encode(head)[:-1],
+        b', "features": [',
+        b", ".join(e[0] for e in entries),
+        b"], ",
+        encode(tail)[1:],
+    ])
+
+
+def current_version():
+    """Versione del dataset, con la cache locale riallineata."""
+    v = catalog_version()
+    feature_cache.sync(v)
+    return v
+
+
+def stream_collection(rows, flush_every=500):
+    """Genera una FeatureCollection a pezzi, con count e bbox calcolati al volo in coda."""
+    yield b'{"type": "FeatureCollection", "features": ['
+    count = 0
+    min_lon = min_lat = float("inf")
+    max_lon = max_lat = float("-inf")
+    buf = []
+    for s in rows:
+        if s.latitudine is None or s.longitudine is None:
+            continue
+        buf.append(encode(feature_dict(s)))
+        count += 1
+        min_lon, max_lon = min(min_lon, s.longitudine), max(max_lon, s.longitudine)
+        min_lat, max_lat = min(min_lat, s.latitudine), max(max_lat, s.latitudine)
+        if len(buf) >= flush_every:
+            yield (b", " if count > len(buf) else b"") + b", ".join(buf)
+            buf = []
+    if buf:
+        yield (b", " if count > len(buf) else b"") + b", ".join(buf)
+
+    tail = {"count": count}
+    if count:
+        tail["bbox"] = [min_lon, min_lat, max_lon, max_lat]
+    yield b"], " + encode(tail)[1:]
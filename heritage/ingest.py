@@ -0,0 +1,303 @@
+"""Pipeline di ingestione CSV condivisa dai comandi di import.
+
+Il file viene diviso in intervalli di byte che terminano sempre a fine
+record (anche con campi tra virgolette su più righe); ogni intervallo è
+letto con ``csvmap`` (mmap, solo le colonne richieste) e normalizzato in
+un ProcessPoolExecutor, mentre un unico writer
+nel processo principale applica i record in transazioni a lotti.
+
+Le funzioni di normalizzazione stanno qui, a livello di modulo e senza
+dipendenze dal DB, così i worker possono importarle anche con "spawn".
+"""
+import hashlib
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from django.db import transaction
+
+from .csvmap import MappedCSV, count_quotes, record_end
+
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+DEFAULT_BATCH_SIZE = 500
+
+
+class Reject(Exception):
+    """Riga scartata; il messaggio è il motivo usato nelle statistiche."""
+
+
+class IngestError(ValueError):
+    """CSV non importabile (es. colonne obbligatorie mancanti)."""
+
+
+# --- normalizzazione -------------------------------------------------------
+
+def to_float(val):
+    if val is None:
+        return None
+    s = str(val).strip().replace(",", ".")
+    if s.lower() in ("", "nan"):
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def to_bool(val):
+    s = str(val or "").strip().lower()
+    if s in {"1", "true", "t", "yes", "y", "si", "s", "on"}:
+        return True
+    if s in {"0", "false", "f", "no", "n", "off"}:
+        return False
+    return None
+
+
+def to_year(val):
+    """Anno a 4 cifre da valori come '1980' o '1980-05-01'."""
+    s = str(val or "").strip()
+    return int(s[:4]) if s[:4].isdigit() and len(s[:4]) == 4 else None
+
+
+def clean_text(val):
+    s = (val or "").strip()
+    return "" if s.lower() == "nan" else s
+
+
+# colonne lette da ciascun normalizzatore (proiezione del lettore mmap)
+SITE_COLUMNS = [
+    "unesco_id", "nome", "descrizione", "regione", "citta", "lat", "long", "latitudine", "longitudine",
+    "categoria", "anno", "wheelchair", "ausili_visivi", "supporto_uditivo", "note",
+]
+ACCESS_COLUMNS = ["unesco_id", "nome", "wheelchair", "ausili_visivi", "supporto_uditivo"]
+COORDS_COLUMNS = ["unesco_id", "lat", "long", "citta", "regione"]
+
+
+def normalize_site_row(row):
+    """Riga del CSV completo (import_sites)."""
+    unesco_id = (row.get("unesco_id") or "").strip()
+    if not unesco_id:
+        raise Reject("unesco_id mancante")
+    lat = to_float(row.get("lat") or row.get("latitudine"))
+    lng = to_float(row.get("long") or row.get("longitudine"))
+    if lat is None or lng is None:
+        raise Reject("coord non valide")
+
+    w = to_bool(row.get("wheelchair"))
+    v = to_bool(row.get("ausili_visivi"))
+    h = to_bool(row.get("supporto_uditivo"))
+    note = (row.get("note") or "").strip()
+    return {
+        "unesco_id": unesco_id,
+        "nome": (row.get("nome") or "").strip(),
+        "descrizione": row.get("descrizione", ""),
+        "regione": row.get("regione", ""),
+        "citta": row.get("citta", ""),
+        "latitudine": lat,
+        "longitudine": lng,
+        "categoria": (row.get("categoria") or "").strip(),
+        "anno_iscrizione": to_year(row.get("anno")),
+        "acc": (w, v, h) if any(x is not None for x in (w, v, h)) or note else None,
+        "note": note,
+    }
+
+
+def normalize_legacy_row(row):
+    """Riga di siti_unesco.csv (script import_csv.py): le coordinate sono facoltative."""
+    unesco_id = (row.get("unesco_id") or "").strip()
+    if not unesco_id:
+        raise Reject("unesco_id mancante")
+    lat, lng = to_float(row.get("lat")), to_float(row.get("long"))
+    # stessi limiti dei CheckConstraint di Sito: una riga fuori range farebbe fallire il lotto
+    if (lat is not None and not -90 <= lat <= 90) or (lng is not None and not -180 <= lng <= 180):
+        raise Reject("coord fuori intervallo")
+    return {
+        "unesco_id": unesco_id,
+        "nome": (row.get("nome") or "").strip(),
+        "descrizione": (row.get("descrizione") or "").strip(),
+        "regione": (row.get("regione") or "").strip(),
+        "citta": (row.get("citta") or "").strip(),
+        "latitudine": lat,
+        "longitudine": lng,
+        "categoria": (row.get("categoria") or "").strip(),
+        "anno_iscrizione": to_year(row.get("anno")),
+        "sedia_a_rotelle": to_bool(row.get("wheelchair")),
+        "ausili_visivi": to_bool(row.get("ausili_visivi")),
+        "supporto_uditivo": to_bool(row.get("supporto_uditivo")),
+        "note": (row.get("note") or "").strip(),
+    }
+
+
+def row_digest(*values):
+    """Hash compatto del contenuto normalizzato di una riga."""
+    return hashlib.blake2b(repr(values).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def file_checksum(path, block=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(block):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def normalize_access_row(row, match_on="unesco_id"):
+    """Riga per import_access: chiave di abbinamento, tre flag e hash del contenuto."""
+    key = (row.get("unesco_id") if match_on == "unesco_id" else row.get("nome")) or ""
+    key = key.strip()
+    if not key:
+        raise Reject("chiave mancante")
+    if match_on == "unesco_id":
+        try:
+            key = str(int(key))
+        except ValueError:
+            raise Reject("unesco_id non valido")
+    flags = (to_bool(row.get("wheelchair")), to_bool(row.get("ausili_visivi")), to_bool(row.get("supporto_uditivo")))
+    return {
+        "key": key,
+        "sedia_a_rotelle": flags[0],
+        "ausili_visivi": flags[1],
+        "supporto_uditivo": flags[2],
+        "digest": row_digest(*flags),
+    }
+
+
+def normalize_access_row_by_name(row):
+    return normalize_access_row(row, match_on="nome")
+
+
+def normalize_coords_row(row):
+    """Riga per update_coords_from_csv: solo i campi valorizzati."""
+    try:
+        unesco_id = str(int(row["unesco_id"]))
+    except (KeyError, TypeError, ValueError):
+        raise Reject("unesco_id non valido")
+    fields = {}
+    lat, lng = to_float(row.get("lat")), to_float(row.get("long"))
+    if lat is not None:
+        fields["latitudine"] = lat
+    if lng is not None:
+        fields["longitudine"] = lng
+    if clean_text(row.get("citta")):
+        fields["citta"] = row["citta"]
+    if clean_text(row.get("regione")):
+        fields["regione"] = row["regione"]
+    if not fields:
+        raise Reject("nessun campo da aggiornare")
+    return {"unesco_id": unesco_id, "fields": fields}
+
+
+# --- suddivisione del file ------------------------------------------------
+
+def split_ranges(path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Restituisce (intestazione, [(inizio, fine), ...]) allineati ai record."""
+    with MappedCSV(path) as src:
+        mm, size = src.buffer, src.size
+        ranges = []
+        start, quotes = src.data_start, 0
+        while start < size:
+            target = min(size, start + max(1, chunk_bytes))
+            if target >= size:
+                end = size
+            else:
+                quotes += count_quotes(mm, start, target)
+                end, quotes = record_end(mm, target, quotes, size)
+            ranges.append((start, end))
+            start = end
+        return src.header, ranges
+
+
+def parse_range(task):
+    """Worker: legge e normalizza un intervallo di byte. Eseguito anche in altri processi."""
+    path, start, end, columns, normalize = task
+    records, rejected = [], Counter()
+    rows = 0
+    with MappedCSV(path) as src:
+        for values in src.rows(columns, start=start, end=end):
+            rows += 1
+            try:
+                records.append(normalize(dict(zip(columns, values))))
+            except Reject as e:
+                rejected[str(e)] += 1
+    return records, rows, rejected
+
+
+# --- esecuzione -----------------------------------------------------------
+
+@dataclass
+class IngestStats:
+    rows: int = 0
+    records: int = 0
+    rejected: Counter = field(default_factory=Counter)
+    batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        scartate = sum(self.rejected.values())
+        dettaglio = ", ".join(f"{k}: {v}" for k, v in sorted(self.rejected.items()))
+        return (
+            f"Righe lette: {self.rows} | Valide: {self.records} | Scartate: {scartate}"
+            + (f" ({dettaglio})" if dettaglio else "")
+            + f" | Lotti: {self.batches} | {self.seconds:.2f}s | {self.rows_per_second:,.0f} righe/s"
+        )
+
+
+class Pipeline:
+    """Parsing parallelo a chunk + writer unico con transazioni a lotti."""
+
+    def __init__(self, path, normalize, required=(), columns=None, workers=None,
+                 chunk_bytes=DEFAULT_CHUNK_BYTES, batch_size=DEFAULT_BATCH_SIZE):
+        """`columns`: colonne passate al normalizzatore (quelle assenti vengono ignorate)."""
+        self.path = path
+        self.normalize = normalize
+        self.required = set(required)
+        self.columns = columns
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.chunk_bytes = chunk_bytes
+        self.batch_size = max(1, batch_size)
+        self.header = None
+
+    def _chunks(self, columns, ranges):
+        tasks = [(self.path, s, e, columns, self.normalize) for s, e in ranges]
+        if self.workers <= 1 or len(tasks) <= 1:
+            yield from map(parse_range, tasks)
+            return
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks))) as pool:
+            # map conserva l'ordine dei chunk: l'ultimo valore di una chiave vince
+            yield from pool.map(parse_range, tasks)
+
+    def run(self, write):
+        """Chiama write(batch) dentro una transazione per ogni lotto di record."""
+        started = time.perf_counter()
+        header, ranges = split_ranges(self.path, self.chunk_bytes)
+        missing = self.required - set(header)
+        if missing:
+            raise IngestError(f"CSV colonne mancanti: {', '.join(sorted(missing))}")
+        self.header = header
+        columns = [c for c in self.columns if c in header] if self.columns else header
+
+        stats = IngestStats()
+        batch = []
+        for records, rows, rejected in self._chunks(columns, ranges):
+            stats.rows += rows
+            stats.records += len(records)
+            stats.rejected.update(rejected)
+            batch.extend(records)
+            while len(batch) >= self.batch_size:
+                self._flush(write, batch[: self.batch_size], stats)
+                batch = batch[self.batch_size :]
+        if batch:
+            self._flush(write, batch, stats)
+        stats.seconds = time.perf_counter() - started
+        return stats
+
+    def _flush(self, write, batch, stats):
+        with transaction.atomic():
+            write(batch)
+        stats.batches += 1
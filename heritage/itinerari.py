@@ -0,0 +1,191 @@
+"""Itinerari: GeoJSON con tracciato e distanze, riepilogo denormalizzato delle tappe.
+
+Il payload (già codificato in bytes) è salvato nella cache di Django con
+una chiave che include la versione del dataset, quindi modifiche a siti e
+accessibilità lo invalidano da sole; le modifiche alle Tappa lo eliminano
+esplicitamente (segnali e ``routing.reorder_itinerario``).
+
+Il riepilogo (numero di tappe, copertura accessibilità, bbox, lunghezza)
+è salvato sui campi di Itinerario, così la lista degli itinerari è una
+sola query; lo aggiornano i segnali di Tappa/Sito/Accessibilita e il
+comando ``rebuild_itinerari_rollup``.
+"""
+import numpy as np
+from django.core.cache import cache
+
+from .features import encode
+from .routing import EARTH_RADIUS_KM
+from .versioning import catalog_version
+
+CACHE_TTL = 24 * 3600
+
+
+def cache_key(pk, version=None):
+    return f"heritage:itinerario:{pk}:{catalog_version() if version is None else version}"
+
+
+def invalidate(pk):
+    cache.delete(cache_key(pk))
+
+
+def leg_distances(lat, lon):
+    """Distanze haversine (km) tra punti consecutivi."""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    dlat, dlon = np.diff(lat), np.diff(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _acc(acc):
+    if acc is None:
+        return None
+    return {
+        "sedia_a_rotelle": acc.sedia_a_rotelle,
+        "ausili_visivi": acc.ausili_visivi,
+        "supporto_uditivo": acc.supporto_uditivo,
+        "note": acc.note or "",
+        "has_data": acc.has_data,
+        "any_true": acc.any_true,
+        "all_true": acc.all_true,
+    }
+
+
+def tappe_qs(itin):
+    return itin.tappe.select_related("sito__categoria", "sito__accessibilita")
+
+
+def build(itin, tappe=None):
+    """FeatureCollection: un Point per tappa + LineString del percorso con le distanze.
+
+    `tappe` già caricate (es. con l'ORM async) evitano la query.
+    """
+    tappe = [
+        t for t in (tappe_qs(itin) if tappe is None else tappe)
+        if t.sito.latitudine is not None and t.sito.longitudine is not None
+    ]
+    legs = leg_distances([t.sito.latitudine for t in tappe], [t.sito.longitudine for t in tappe]).tolist() if tappe else []
+    total = round(sum(legs), 3)
+
+    features = []
+    for i, tappa in enumerate(tappe):
+        sito = tappa.sito
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [sito.longitudine, sito.latitudine]},
+            "properties": {
+                "id": sito.id,
+                "name": sito.nome,
+                "city": sito.citta,
+                "region": sito.regione,
+                "order": tappa.ordine,
+                "category": (sito.categoria.nome if sito.categoria else None),
+                "accessibilita": _acc(sito.accessibilita),
+                "leg_km": round(legs[i - 1], 3) if i else None,
+            },
+        })
+    if len(tappe) > 1:
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "LineString",
+                "coordinates": [[t.sito.longitudine, t.sito.latitudine] for t in tappe],
+            },
+            "properties": {
+                "kind": "route",
+                "legs_km": [round(d, 3) for d in legs],
+                "total_km": total,
+            },
+        })
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "properties": {"id": itin.id, "name": itin.nome, "stops": len(tappe), "total_km": total},
+    }
+
+
+def geojson_bytes(itin):
+    key = cache_key(itin.pk)
+    body = cache.get(key)
+    if body is None:
+        body = encode(build(itin))
+        cache.set(key, body, CACHE_TTL)
+    return body
+
+
+ROLLUP_FIELDS = [
+    "n_tappe", "n_sedia_a_rotelle", "n_ausili_visivi", "n_supporto_uditivo",
+    "min_lat", "max_lat", "min_lon", "max_lon", "lunghezza_km",
+]
+LIST_FIELDS = ["id", "nome", "descrizione", *ROLLUP_FIELDS]
+
+
+def list_queryset():
+    """Righe della lista JSON (/api/itinerari): solo colonne di Itinerario."""
+    from .models import Itinerario
+
+    return Itinerario.objects.order_by("nome", "id").values(*LIST_FIELDS)
+
+
+def render_list(rows, total, limit, offset):
+    return encode({"count": total, "limit": limit, "offset": offset, "results": rows})
+
+
+def compute_rollup(stops):
+    """stops: [(lat, lon, sedia, visivi, uditivo)] nell'ordine delle tappe."""
+    located = [(la, lo) for la, lo, *_ in stops if la is not None and lo is not None]
+    lat = [p[0] for p in located]
+    lon = [p[1] for p in located]
+    return {
+        "n_tappe": len(stops),
+        "n_sedia_a_rotelle": sum(1 for s in stops if s[2] is True),
+        "n_ausili_visivi": sum(1 for s in stops if s[3] is True),
+        "n_supporto_uditivo": sum(1 for s in stops if s[4] is True),
+        "min_lat": min(lat, default=None),
+        "max_lat": max(lat, default=None),
+        "min_lon": min(lon, default=None),
+        "max_lon": max(lon, default=None),
+        "lunghezza_km": round(float(leg_distances(lat, lon).sum()), 3) if located else 0.0,
+    }
+
+
+def refresh_rollup(pks=None):
+    """Ricalcola il riepilogo degli itinerari indicati (tutti se pks è None)."""
+    from .models import Itinerario, Tappa
+
+    itins = Itinerario.objects.all() if pks is None else Itinerario.objects.filter(pk__in=set(pks))
+    itins = list(itins.only("id", *ROLLUP_FIELDS))
+    if not itins:
+        return 0
+    stops = {it.pk: [] for it in itins}
+    rows = (
+        Tappa.objects.filter(itinerario_id__in=stops).order_by("itinerario_id", "ordine")
+        .values_list(
+            "itinerario_id", "sito__latitudine", "sito__longitudine", "sito__accessibilita__sedia_a_rotelle",
+            "sito__accessibilita__ausili_visivi", "sito__accessibilita__supporto_uditivo",
+        )
+    )
+    for itin_id, *stop in rows:
+        stops[itin_id].append(stop)
+
+    changed = []
+    for it in itins:
+        values = compute_rollup(stops[it.pk])
+        if any(getattr(it, k) != v for k, v in values.items()):
+            for k, v in values.items():
+                setattr(it, k, v)
+            changed.append(it)
+    Itinerario.objects.bulk_update(changed, ROLLUP_FIELDS)
+    return len(changed)
+
+
+def itinerari_di(sito_ids=None, accessibilita_id=None):
+    """Id degli itinerari che passano per i siti (o per i siti con quell'accessibilità)."""
+    from .models import Tappa
+
+    qs = Tappa.objects.all()
+    if sito_ids is not None:
+        qs = qs.filter(sito_id__in=sito_ids)
+    if accessibilita_id is not None:
+        qs = qs.filter(sito__accessibilita_id=accessibilita_id)
+    return set(qs.values_list("itinerario_id", flat=True))
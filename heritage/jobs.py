@@ -0,0 +1,191 @@
+"""Coda di lavori in background sul database (nessun broker esterno).
+
+Le viste accodano con ``enqueue`` e rispondono subito; ``manage.py
+run_workers`` preleva i lavori e li esegue in un pool di thread.
+
+- priorità: ``priorita`` più alta prima, poi ``scheduled_at``;
+- ``scheduled_at`` nel futuro rimanda l'esecuzione;
+- ``dedup_key``: un solo lavoro attivo (in attesa o in esecuzione) per
+  chiave, garantito da un indice unico parziale;
+- errori: nuovo tentativo con attesa esponenziale fino a ``max_tentativi``;
+- durante l'esecuzione ``locked_at`` è aggiornato ogni ``HEARTBEAT`` secondi:
+  solo i lavori senza heartbeat da ``STALE_AFTER`` (worker terminato) tornano
+  in coda, o falliscono se hanno esaurito i tentativi.
+
+Il prelievo è un UPDATE condizionale (``WHERE stato = 'pending'``) per
+ogni lavoro: più worker, anche in processi diversi, non eseguono mai lo
+stesso lavoro due volte. Con ``HERITAGE_JOBS_EAGER = True`` i lavori
+vengono eseguiti subito nel processo che li accoda (sviluppo e test).
+"""
+import datetime
+import logging
+import os
+import socket
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger("heritage.jobs")
+
+RETRY_DELAY = 30        # secondi prima del secondo tentativo (poi raddoppia)
+HEARTBEAT = 60          # secondi tra due aggiornamenti di locked_at di un lavoro in esecuzione
+STALE_AFTER = 15 * 60   # lavori "running" senza heartbeat da più tempo sono considerati orfani
+
+TASKS = {}
+
+
+class UnknownTask(LookupError):
+    pass
+
+
+def task(name, max_tentativi=3):
+    """Registra una funzione come lavoro accodabile con il nome `name`."""
+    def register(func):
+        TASKS[name] = (func, max_tentativi)
+        return func
+    return register
+
+
+def eager():
+    return getattr(settings, "HERITAGE_JOBS_EAGER", False)
+
+
+def enqueue(name, /, priorita=0, dedup_key=None, run_at=None, **kwargs):
+    """Accoda il lavoro `name` con argomenti `kwargs`; con una `dedup_key` già attiva restituisce quello esistente."""
+    from .models import Job
+
+    if name not in TASKS:
+        raise UnknownTask(name)
+    job = Job(
+        nome=name, kwargs=kwargs, priorita=priorita, dedup_key=dedup_key,
+        scheduled_at=run_at or timezone.now(), max_tentativi=TASKS[name][1],
+    )
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        if dedup_key is None:
+            raise
+        return Job.objects.get(dedup_key=dedup_key, stato__in=[Job.PENDING, Job.RUNNING])
+    if eager() and run_at is None:
+        if claim_job(job.pk, "eager"):
+            job.refresh_from_db()
+            execute(job)
+            job.refresh_from_db()
+    return job
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def claim_job(pk, worker):
+    """Prende in carico un lavoro in attesa; False se un altro worker è arrivato prima."""
+    from .models import Job
+
+    return bool(
+        Job.objects.filter(pk=pk, stato=Job.PENDING).update(
+            stato=Job.RUNNING, locked_by=worker[:100], locked_at=timezone.now(), tentativi=F("tentativi") + 1,
+        )
+    )
+
+
+def claim(worker, limit=10):
+    """Lavori pronti (per priorità) presi in carico da `worker`."""
+    from .models import Job
+
+    candidates = list(
+        Job.objects.filter(stato=Job.PENDING, scheduled_at__lte=timezone.now())
+        .order_by("-priorita", "scheduled_at", "id").values_list("pk", flat=True)[:limit]
+    )
+    claimed = [pk for pk in candidates if claim_job(pk, worker)]
+    return list(Job.objects.filter(pk__in=claimed).order_by("-priorita", "scheduled_at", "id"))
+
+
+class Heartbeat(threading.Thread):
+    """Aggiorna locked_at finché il lavoro è in esecuzione, così requeue_stale non lo considera orfano."""
+
+    def __init__(self, pk, interval=HEARTBEAT):
+        super().__init__(name=f"heritage-heartbeat-{pk}", daemon=True)
+        self.pk = pk
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        from .models import Job
+
+        try:
+            while not self.stopped.wait(self.interval):
+                Job.objects.filter(pk=self.pk, stato=Job.RUNNING).update(locked_at=timezone.now())
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def execute(job):
+    """Esegue un lavoro già preso in carico e ne registra l'esito; True se riuscito."""
+    from .models import Job
+
+    func = TASKS.get(job.nome, (None,))[0]
+    heartbeat = Heartbeat(job.pk)
+    heartbeat.start()
+    try:
+        if func is None:
+            raise UnknownTask(job.nome)
+        func(**job.kwargs)
+    except Exception:
+        heartbeat.stop()
+        error = traceback.format_exc(limit=5)
+        if job.tentativi < job.max_tentativi and func is not None:
+            delay = RETRY_DELAY * 2 ** (job.tentativi - 1)
+            fields = {"stato": Job.PENDING, "scheduled_at": timezone.now() + datetime.timedelta(seconds=delay)}
+        else:
+            fields = {"stato": Job.FAILED, "finished_at": timezone.now()}
+        Job.objects.filter(pk=job.pk).update(ultimo_errore=error, locked_by="", locked_at=None, **fields)
+        logger.warning("Lavoro %s (%s) fallito al tentativo %s", job.pk, job.nome, job.tentativi, exc_info=True)
+        return False
+    heartbeat.stop()
+    Job.objects.filter(pk=job.pk).update(stato=Job.DONE, finished_at=timezone.now(), locked_by="", locked_at=None)
+    return True
+
+
+def requeue_stale(older_than=STALE_AFTER):
+    """Rimette in coda i lavori rimasti "running" senza heartbeat (worker terminato a metà).
+
+    Quelli che hanno già esaurito i tentativi falliscono invece di ripartire.
+    """
+    from .models import Job
+
+    limit = timezone.now() - datetime.timedelta(seconds=older_than)
+    stale = Job.objects.filter(stato=Job.RUNNING, locked_at__lt=limit)
+    stale.filter(tentativi__gte=F("max_tentativi")).update(
+        stato=Job.FAILED, finished_at=timezone.now(), locked_by="", locked_at=None,
+        ultimo_errore="Worker interrotto durante l'esecuzione",
+    )
+    return stale.update(stato=Job.PENDING, locked_by="", locked_at=None)
+
+
+def run_pending(limit=100, worker=None):
+    """Esegue nel thread corrente i lavori pronti; restituisce (riusciti, falliti)."""
+    ok = ko = 0
+    for job in claim(worker or worker_id(), limit):
+        if execute(job):
+            ok += 1
+        else:
+            ko += 1
+    return ok, ko
+
+
+def run_in_thread(job):
+    """Esecuzione dentro un thread del pool: ogni thread ha la sua connessione, chiusa a fine lavoro."""
+    try:
+        return execute(job)
+    finally:
+        connection.close()
@@ -0,0 +1,67 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from heritage import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark di /api/sites.geojson, itinerari e comandi di import su dataset sintetici "
+        "(ogni dimensione in un database di test usa e getta); risultati in JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,100000", help="Numero di siti, separati da virgola")
+        parser.add_argument("--repeat", type=int, default=30, help="Richieste misurate per scenario")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="File JSON dei risultati (default: stdout)")
+        parser.add_argument(
+            "--concurrency", default="",
+            help="Livelli di concorrenza (es. 1,8,32): confronta le API sync (WSGI) e async (ASGI)",
+        )
+        parser.add_argument("--compare", help="Report JSON precedente con cui confrontare le p50")
+
+    def handle(self, *args, **opts):
+        try:
+            sizes = [int(s) for s in opts["sizes"].split(",") if s.strip()]
+        except ValueError:
+            raise CommandError("--sizes deve essere una lista di interi, es. 1000,10000")
+        if not sizes or min(sizes) < 10:
+            raise CommandError("ogni dimensione deve essere almeno 10")
+        try:
+            levels = [int(c) for c in opts["concurrency"].split(",") if c.strip()]
+        except ValueError:
+            raise CommandError("--concurrency deve essere una lista di interi, es. 1,8,32")
+        if levels and min(levels) < 1:
+            raise CommandError("ogni livello di concorrenza deve essere almeno 1")
+
+        report = {"meta": benchmark.metadata(sizes, opts["repeat"], opts["seed"], levels), "results": []}
+        for n in sizes:
+            self.stderr.write(f"Benchmark con {n} siti...")
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                report["results"].append(benchmark.run_size(n, opts["repeat"], opts["seed"], concurrency=levels))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        body = json.dumps(report, indent=2)
+        if opts["output"]:
+            with open(opts["output"], "w", encoding="utf-8") as fh:
+                fh.write(body + "\n")
+            self.stderr.write(self.style.SUCCESS(f"Risultati scritti in {opts['output']}"))
+        else:
+            self.stdout.write(body)
+
+        if opts["compare"]:
+            with open(opts["compare"], encoding="utf-8") as fh:
+                old = json.load(fh)
+            for size, name, prev, value, delta in benchmark.compare(old, report):
+                self.stderr.write(f"{size:>7} {name:<32} {prev:>10.3f} -> {value:>10.3f} ({delta:+.1f}%)")
+
+        for result in report["results"]:
+            for name, m in result.get("concurrency", {}).items():
+                self.stderr.write(
+                    f"{result['size']:>7} {name:<28} WSGI {m['wsgi']['rps']:>8.1f} req/s p99 {m['wsgi']['p99_ms']:>8.1f} ms"
+                    f" | ASGI {m['asgi']['rps']:>8.1f} req/s p99 {m['asgi']['p99_ms']:>8.1f} ms"
+                )
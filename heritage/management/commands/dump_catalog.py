@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from heritage import snapshot
+
+
+class Command(BaseCommand):
+    help = "Esporta Categoria, Accessibilita, Sito, Itinerario e Tappa in uno snapshot colonnare .npz"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=str, help="File di destinazione (es. catalog.npz)")
+
+    def handle(self, *args, **opts):
+        counts = snapshot.dump(opts["path"])
+        dettaglio = " | ".join(f"{k}: {v}" for k, v in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Snapshot scritto in {opts['path']}. {dettaglio}"))
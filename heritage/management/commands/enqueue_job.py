@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from heritage import jobs
+
+
+class Command(BaseCommand):
+    help = "Accoda un lavoro registrato (es. nearby.rebuild, comando) per run_workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("nome", help=f"Uno tra: {', '.join(sorted(jobs.TASKS)) or '(nessuno)'}")
+        parser.add_argument("--kwargs", default="{}", help='Argomenti JSON, es. \'{"nome": "rebuild_nearby"}\'')
+        parser.add_argument("--priority", type=int, default=0)
+        parser.add_argument("--dedup-key", default=None)
+        parser.add_argument("--at", default=None, help="Esecuzione non prima di (ISO 8601)")
+
+    def handle(self, *args, **opts):
+        try:
+            kwargs = json.loads(opts["kwargs"])
+        except json.JSONDecodeError as e:
+            raise CommandError(f"--kwargs non è JSON valido: {e}")
+        run_at = parse_datetime(opts["at"]) if opts["at"] else None
+        if opts["at"] and run_at is None:
+            raise CommandError("--at deve essere una data/ora ISO 8601")
+        try:
+            job = jobs.enqueue(
+                opts["nome"], priorita=opts["priority"], dedup_key=opts["dedup_key"], run_at=run_at, **kwargs
+            )
+        except jobs.UnknownTask:
+            raise CommandError(f"Lavoro sconosciuto: {opts['nome']}")
+        self.stdout.write(self.style.SUCCESS(f"Lavoro {job.pk} ({job.nome}) in stato {job.stato}"))
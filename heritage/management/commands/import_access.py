@@ -1,20 +1,18 @@
-import csv
 from pathlib import Path
 from django.core.management.base import BaseCommand, CommandError
-from heritage.models import Sito, Accessibilita
+from heritage import itinerari
+from heritage.ingest import (
+    ACCESS_COLUMNS, DEFAULT_CHUNK_BYTES, IngestError, Pipeline, file_checksum,
+    normalize_access_row, normalize_access_row_by_name,
+)
+from heritage.models import Sito, Accessibilita, ImportState, ImportRowDigest
+from heritage.versioning import bump_catalog_version
 
-
-def to_bool_or_none(x: str | None):
-    s = (x or "").strip().lower()
-    if s in {"1", "true", "t", "yes", "y", "si", "s", "on"}:
-        return True
-    if s in {"0", "false", "f", "no", "n", "off"}:
-        return False
-    return None
+ACC_FIELDS = ["sedia_a_rotelle", "ausili_visivi", "supporto_uditivo"]
 
 
 class Command(BaseCommand):
-    help = "Importa/aggiorna i dati di accessibilità dal CSV"
+    help = "Importa/aggiorna i dati di accessibilità dal CSV (solo le righe cambiate dall'ultimo import)"
 
     def add_arguments(self, parser):
         parser.add_argument("csv_path", type=str, help="Percorso al CSV (es. unesco_italia_access_complete.csv)")
@@ -22,55 +20,116 @@ class Command(BaseCommand):
             "--match-on", choices=["unesco_id", "nome"], default="unesco_id",
             help="Campo su cui abbinare i siti (default: unesco_id)"
         )
+        parser.add_argument("--force", action="store_true", help="Ignora checksum e hash salvati e rielabora tutto")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=None, help="Processi per il parsing (default: CPU)")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_BYTES, help="Byte per chunk")
 
     def handle(self, *args, **opts):
         path = Path(opts["csv_path"])
         if not path.exists():
             raise CommandError(f"CSV non trovato: {path}")
 
-        match_on = opts.get("match_on", "unesco_id")
+        self.match_on = opts.get("match_on", "unesco_id")
+        self.created = self.updated = self.unchanged = 0
+        self.missing = []
 
-        created = updated = skipped = 0
-        missing = []
+        # file identico all'ultimo import: nessuna lettura delle righe
+        stat = path.stat()
+        self.state, _ = ImportState.objects.get_or_create(
+            sorgente=f"import_access:{self.match_on}", path=str(path.resolve())
+        )
+        same_stat = (self.state.size, self.state.mtime) == (stat.st_size, stat.st_mtime)
+        if not opts["force"] and self.state.checksum and same_stat:
+            self.stdout.write(self.style.SUCCESS("File invariato dall'ultimo import: niente da fare."))
+            return
+        checksum = file_checksum(path)
+        if not opts["force"] and checksum == self.state.checksum:
+            self.save_state(checksum, stat)
+            self.stdout.write(self.style.SUCCESS("Contenuto invariato dall'ultimo import: niente da fare."))
+            return
 
-        with path.open("r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                key = row.get("unesco_id") if match_on == "unesco_id" else row.get("nome")
-                if not key:
-                    skipped += 1
-                    continue
+        self.digests = {} if opts["force"] else dict(self.state.righe.values_list("chiave", "digest"))
 
-                try:
-                    sito = (
-                        Sito.objects.get(unesco_id=int(key))
-                        if match_on == "unesco_id"
-                        else Sito.objects.get(nome=key)
-                    )
-                except Sito.DoesNotExist:
-                    missing.append(key)
-                    continue
-
-                vals = dict(
-                    sedia_a_rotelle=to_bool_or_none(row.get("wheelchair")),
-                    ausili_visivi=to_bool_or_none(row.get("ausili_visivi")),
-                    supporto_uditivo=to_bool_or_none(row.get("supporto_uditivo")),
-                )
-
-                # Se il sito ha già un record di accessibilità → aggiorna
-                if sito.accessibilita:
-                    for k, v in vals.items():
-                        setattr(sito.accessibilita, k, v)
-                    sito.accessibilita.save()
-                    updated += 1
-                else:
-                    acc = Accessibilita.objects.create(**vals)
-                    sito.accessibilita = acc
-                    sito.save()
-                    created += 1
+        normalize = normalize_access_row if self.match_on == "unesco_id" else normalize_access_row_by_name
+        pipeline = Pipeline(
+            str(path), normalize, columns=ACCESS_COLUMNS, workers=opts["workers"],
+            chunk_bytes=opts["chunk_size"], batch_size=opts["batch_size"],
+        )
+        try:
+            stats = pipeline.run(self.write)
+        except IngestError as e:
+            raise CommandError(str(e))
+        finally:
+            # bulk_update/bulk_create non inviano segnali: invalida a mano cache e indici,
+            # anche se un lotto fallisce (i lotti precedenti sono già committati)
+            if self.created or self.updated:
+                bump_catalog_version()
+                itinerari.refresh_rollup()
+        self.save_state(checksum, stat)
 
+        skipped = sum(stats.rejected.values())
         self.stdout.write(self.style.SUCCESS(
-            f"Create: {created} | Aggiornate: {updated} | Saltate: {skipped} | Siti non trovati: {len(missing)}"
+            f"Create: {self.created} | Aggiornate: {self.updated} | Invariate: {self.unchanged} | "
+            f"Saltate: {skipped} | Siti non trovati: {len(self.missing)}"
         ))
-        if missing:
-            self.stdout.write("Non trovati (prime 10): " + ", ".join(map(str, missing[:10])))
+        if self.missing:
+            self.stdout.write("Non trovati (prime 10): " + ", ".join(map(str, self.missing[:10])))
+        self.stdout.write(stats.summary())
+
+    def save_state(self, checksum, stat):
+        self.state.checksum = checksum
+        self.state.size = stat.st_size
+        self.state.mtime = stat.st_mtime
+        self.state.save(update_fields=["checksum", "size", "mtime", "updated_at"])
+
+    def write(self, batch):
+        """Un lotto: solo le righe con hash diverso dall'ultimo import, scritte in blocco."""
+        changed = [r for r in batch if self.digests.get(r["key"]) != r["digest"]]
+        self.unchanged += len(batch) - len(changed)
+        if not changed:
+            return
+
+        field = "unesco_id" if self.match_on == "unesco_id" else "nome"
+        siti = {
+            getattr(s, field): s
+            for s in Sito.objects.filter(**{f"{field}__in": {r["key"] for r in changed}})
+            .select_related("accessibilita")
+        }
+
+        to_update, to_create, seen = {}, {}, {}
+        for rec in changed:
+            sito = siti.get(rec["key"])
+            if sito is None:
+                self.missing.append(rec["key"])
+                continue
+            seen[rec["key"]] = rec["digest"]
+            vals = {k: rec[k] for k in ACC_FIELDS}
+            # Se il sito ha già un record di accessibilità → aggiorna solo se diverso
+            if sito.accessibilita:
+                if all(getattr(sito.accessibilita, k) == v for k, v in vals.items()):
+                    self.unchanged += 1
+                    continue
+                for k, v in vals.items():
+                    setattr(sito.accessibilita, k, v)
+                to_update[sito.accessibilita.pk] = sito.accessibilita
+                self.updated += 1
+            else:
+                to_create[sito.pk] = (sito, Accessibilita(**vals))
+                self.created += 1
+
+        Accessibilita.objects.bulk_update(to_update.values(), ACC_FIELDS)
+        if to_create:
+            Accessibilita.objects.bulk_create([acc for _, acc in to_create.values()])
+            for sito, acc in to_create.values():
+                sito.accessibilita = acc
+            Sito.objects.bulk_update([sito for sito, _ in to_create.values()], ["accessibilita"])
+
+        # i siti non trovati restano senza hash: verranno ritentati al prossimo import
+        ImportRowDigest.objects.bulk_create(
+            [ImportRowDigest(stato=self.state, chiave=k, digest=d) for k, d in seen.items()],
+            update_conflicts=True,
+            unique_fields=["stato", "chiave"],
+            update_fields=["digest"],
+        )
+        self.digests.update(seen)
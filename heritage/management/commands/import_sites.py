@@ -1,7 +1,23 @@
-import csv
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
+from heritage import itinerari, nearby
+from heritage.ingest import DEFAULT_CHUNK_BYTES, SITE_COLUMNS, IngestError, Pipeline, normalize_site_row
 from heritage.models import Sito, Categoria, Accessibilita
+from heritage.versioning import bump_catalog_version
+
+REQUIRED = {
+    "unesco_id", "nome", "descrizione", "regione", "citta", "lat", "long",
+    "categoria", "anno", "wheelchair", "ausili_visivi", "supporto_uditivo", "note"
+}
+
+# campi del Sito aggiornati dall'import (oltre alla chiave unesco_id)
+SITO_FIELDS = [
+    "nome", "descrizione", "regione", "citta", "latitudine", "longitudine",
+    "categoria_id", "accessibilita_id", "anno_iscrizione",
+]
+UPSERT_FIELDS = [f.removesuffix("_id") for f in SITO_FIELDS]
+
+NEW = object()  # segnaposto per righe non ancora create (dry-run)
 
 
 class Command(BaseCommand):
@@ -13,112 +29,155 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("csv_path", type=str)
+        parser.add_argument("--dry-run", action="store_true", help="Mostra le differenze senza scrivere nel DB")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=None, help="Processi per il parsing (default: CPU)")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_BYTES, help="Byte per chunk")
 
     def handle(self, *args, **opts):
         path = opts["csv_path"]
-
-        def to_float(val):
-            if val is None:
-                return None
-            s = str(val).strip().replace(",", ".")
-            try:
-                return float(s)
-            except ValueError:
-                return None
-
-        def to_bool(val):
-            s = str(val or "").strip().lower()
-            if s in {"1", "true", "t", "yes", "y", "si", "s", "on"}:
-                return True
-            if s in {"0", "false", "f", "no", "n", "off"}:
-                return False
-            return None  
-
+        self.batch_size = max(1, opts["batch_size"])
+        self.dry_run = opts["dry_run"]
+        self.categorie = None
+        self.acc_existing = None
+        self.acc_ids = {}
+        self.created, self.updated, self.unchanged = [], [], 0
+
+        pipeline = Pipeline(
+            path, normalize_site_row, columns=SITE_COLUMNS, required=REQUIRED, workers=opts["workers"],
+            chunk_bytes=opts["chunk_size"], batch_size=self.batch_size,
+        )
         try:
-            with open(path, newline="", encoding="utf-8") as f:
-                r = csv.DictReader(f)
-
-                required = {
-                    "unesco_id", "nome", "descrizione", "regione", "citta", "lat", "long",
-                    "categoria", "anno", "wheelchair", "ausili_visivi", "supporto_uditivo", "note"
-                }
-                header = {c.strip() for c in (r.fieldnames or [])}
-                if not required.issubset(header):
-                    missing = ", ".join(sorted(required - header))
-                    raise CommandError(f"CSV colonne mancanti: {missing}")
-
-                created = updated = skipped_invalid_coords = skipped_missing_id = 0
-
+            if self.dry_run:
                 with transaction.atomic():
-                    for i, row in enumerate(r, start=1):
-                        unesco_id = (row.get("unesco_id") or "").strip()
-                        if not unesco_id:
-                            skipped_missing_id += 1
-                            continue
-
-                        categoria = None
-                        cat_name = (row.get("categoria") or "").strip()
-                        if cat_name:
-                            categoria, _ = Categoria.objects.get_or_create(nome=cat_name)
-
-                        w = to_bool(row.get("wheelchair"))
-                        v = to_bool(row.get("ausili_visivi"))
-                        h = to_bool(row.get("supporto_uditivo"))
-                        note = (row.get("note") or "").strip()
-
-                        any_bool_set = any(x is not None for x in (w, v, h))
-                        acc = None
-                        if any_bool_set or note:
-                            acc, _ = Accessibilita.objects.get_or_create(
-                                sedia_a_rotelle=w,
-                                ausili_visivi=v,
-                                supporto_uditivo=h,
-                                defaults={"note": note},
-                            )
-                            if note and acc.note != note:
-                                acc.note = note
-                                acc.save(update_fields=["note"])
-
-                        lat = to_float(row.get("lat") or row.get("latitudine"))
-                        lng = to_float(row.get("long") or row.get("longitudine"))
-                        if lat is None or lng is None:
-                            skipped_invalid_coords += 1
-                            continue
-
-                        anno_str = str(row.get("anno", "")).strip()
-                        anno_val = int(anno_str) if anno_str.isdigit() else None
-
-                        obj, is_new = Sito.objects.update_or_create(
-                            unesco_id=unesco_id,
-                            defaults={
-                                "nome": (row.get("nome") or "").strip(),
-                                "descrizione": row.get("descrizione", ""),
-                                "regione": row.get("regione", ""),
-                                "citta": row.get("citta", ""),
-                                "latitudine": lat,
-                                "longitudine": lng,
-                                "categoria": categoria,
-                                "accessibilita": acc,
-                                "anno_iscrizione": anno_val,
-                            },
-                        )
-                        if is_new:
-                            created += 1
-                        else:
-                            updated += 1
-
-                        if i % 100 == 0:
-                            self.stdout.write(
-                                f"[{i}] Creati: {created} | Aggiornati: {updated} | "
-                                f"Scartati (coord non valide): {skipped_invalid_coords} | "
-                                f"Scartati (unesco_id mancante): {skipped_missing_id}"
-                            )
-
-                self.stdout.write(self.style.SUCCESS(
-                    f"FATTO. Creati: {created} | Aggiornati: {updated} | "
-                    f"Scartati (coord non valide): {skipped_invalid_coords} | "
-                    f"Scartati (unesco_id mancante): {skipped_missing_id}"
-                ))
-
+                    stats = pipeline.run(self.write)
+                    transaction.set_rollback(True)
+            else:
+                stats = pipeline.run(self.write)
         except FileNotFoundError:
             raise CommandError(f"File non trovato: {path}")
+        except IngestError as e:
+            raise CommandError(str(e))
+        finally:
+            # bulk_create non invia segnali: invalida a mano cache e indici in memoria,
+            # anche se un lotto fallisce (i lotti precedenti sono già committati)
+            if not self.dry_run and (self.created or self.updated):
+                bump_catalog_version()
+                nearby.rebuild()
+                itinerari.refresh_rollup()
+
+        if self.dry_run:
+            self.report_diff()
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"FATTO. Creati: {len(self.created)} | Aggiornati: {len(self.updated)} | Invariati: {self.unchanged} | "
+            f"Scartati (coord non valide): {stats.rejected['coord non valide']} | "
+            f"Scartati (unesco_id mancante): {stats.rejected['unesco_id mancante']}"
+        ))
+        self.stdout.write(stats.summary())
+
+    def write(self, batch):
+        """Applica un lotto di record normalizzati (un'unica transazione per lotto)."""
+        records = list({r["unesco_id"]: r for r in batch}.values())
+        categorie = self.resolve_categorie(records, self.dry_run)
+        acc_ids = self.resolve_accessibilita(records, self.dry_run)
+        created, updated, unchanged = self.diff_siti(records, categorie, acc_ids)
+        self.created += [(r["unesco_id"], r["nome"]) for r, _ in created]
+        self.updated += [(r["unesco_id"], r["nome"]) for r, _ in updated]
+        self.unchanged += len(unchanged)
+        if self.dry_run:
+            return
+
+        objs = [self.build_sito(rec, values) for rec, values in created + updated]
+        if objs:
+            Sito.objects.bulk_create(
+                objs, update_conflicts=True, unique_fields=["unesco_id"], update_fields=UPSERT_FIELDS,
+            )
+
+    def resolve_categorie(self, records, dry_run):
+        """nome → id, creando in blocco le categorie mancanti."""
+        if self.categorie is None:
+            self.categorie = dict(Categoria.objects.values_list("nome", "id"))
+        missing = sorted({r["categoria"] for r in records if r["categoria"]} - self.categorie.keys())
+        if dry_run:
+            self.categorie.update({n: NEW for n in missing})
+        elif missing:
+            Categoria.objects.bulk_create([Categoria(nome=n) for n in missing], ignore_conflicts=True)
+            self.categorie.update(Categoria.objects.filter(nome__in=missing).values_list("nome", "id"))
+        return self.categorie
+
+    def resolve_accessibilita(self, records, dry_run):
+        """(sedia, visivi, uditivo) → id, come il vecchio get_or_create per combinazione."""
+        if self.acc_existing is None:
+            self.acc_existing = {}
+            for acc in Accessibilita.objects.order_by("-id"):
+                self.acc_existing[(acc.sedia_a_rotelle, acc.ausili_visivi, acc.supporto_uditivo)] = acc
+            self.acc_ids = {k: acc.id for k, acc in self.acc_existing.items()}
+        existing = self.acc_existing
+
+        notes = {}
+        for r in records:
+            if r["acc"] is not None:
+                notes.setdefault(r["acc"], "")
+                if r["note"]:
+                    notes[r["acc"]] = r["note"]
+
+        to_create = [
+            Accessibilita(sedia_a_rotelle=k[0], ausili_visivi=k[1], supporto_uditivo=k[2], note=note)
+            for k, note in notes.items() if k not in self.acc_ids
+        ]
+        to_update = []
+        for k, note in notes.items():
+            acc = existing.get(k)
+            if acc is not None and note and acc.note != note:
+                acc.note = note
+                to_update.append(acc)
+
+        if not dry_run:
+            Accessibilita.objects.bulk_create(to_create, batch_size=self.batch_size)
+            Accessibilita.objects.bulk_update(to_update, ["note"], batch_size=self.batch_size)
+        for a in to_create:
+            key = (a.sedia_a_rotelle, a.ausili_visivi, a.supporto_uditivo)
+            existing[key] = a
+            self.acc_ids[key] = NEW if dry_run else a.id
+        return self.acc_ids
+
+    def diff_siti(self, records, categorie, acc_ids):
+        """Divide i record in creati / aggiornati / invariati rispetto al DB."""
+        current = {
+            row[0]: row[1:]
+            for row in Sito.objects.filter(unesco_id__in=[r["unesco_id"] for r in records])
+            .values_list("unesco_id", *SITO_FIELDS)
+            .iterator(chunk_size=2000)
+        }
+        created, updated, unchanged = [], [], []
+        for rec in records:
+            values = (
+                rec["nome"], rec["descrizione"], rec["regione"], rec["citta"],
+                rec["latitudine"], rec["longitudine"],
+                categorie.get(rec["categoria"]) if rec["categoria"] else None,
+                acc_ids.get(rec["acc"]) if rec["acc"] is not None else None,
+                rec["anno_iscrizione"],
+            )
+            old = current.get(rec["unesco_id"])
+            if old is None:
+                created.append((rec, values))
+            elif tuple(old) != values:
+                updated.append((rec, values))
+            else:
+                unchanged.append((rec, values))
+        return created, updated, unchanged
+
+    def build_sito(self, rec, values):
+        fields = dict(zip(SITO_FIELDS, values))
+        return Sito(unesco_id=rec["unesco_id"], **fields)
+
+    def report_diff(self):
+        self.stdout.write(self.style.WARNING("DRY-RUN: nessuna modifica salvata."))
+        for label, rows in (("+", self.created), ("~", self.updated)):
+            for unesco_id, nome in rows[:20]:
+                self.stdout.write(f"  {label} {unesco_id}: {nome}")
+        self.stdout.write(
+            f"Da creare: {len(self.created)} | Da aggiornare: {len(self.updated)} | Invariati: {self.unchanged}"
+        )
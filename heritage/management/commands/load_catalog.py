@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from heritage import snapshot
+
+
+class Command(BaseCommand):
+    help = "Carica uno snapshot creato da dump_catalog in un'unica transazione"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=str, help="Snapshot .npz")
+        parser.add_argument(
+            "--replace", action="store_true",
+            help="Cancella prima i dati esistenti del catalogo",
+        )
+        parser.add_argument(
+            "--drop-bookings", action="store_true",
+            help="Con --replace: cancella anche prenotazioni e booking degli itinerari (non sono nello snapshot)",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **opts):
+        try:
+            counts = snapshot.load(
+                opts["path"], replace=opts["replace"], drop_bookings=opts["drop_bookings"],
+                batch_size=max(1, opts["batch_size"]),
+            )
+        except FileNotFoundError:
+            raise CommandError(f"File non trovato: {opts['path']}")
+        except snapshot.SnapshotError as e:
+            raise CommandError(str(e))
+        dettaglio = " | ".join(f"{k}: {v}" for k, v in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Snapshot caricato. {dettaglio}"))
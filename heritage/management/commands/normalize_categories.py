@@ -1,7 +1,8 @@
 # heritage/management/commands/normalize_categories.py
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db.models import Case, Count, Value, When
 from heritage.models import Categoria, Sito
+from heritage.versioning import batch, bump_catalog_version
 
 CANONICAL = {
     "culturale": "Culturale",
@@ -15,39 +16,65 @@ CANONICAL = {
     "naturali": "Naturale",
 }
 
+CANONICI = ("Culturale", "Naturale")
+
+
 class Command(BaseCommand):
     help = "Normalizza le categorie a due soli valori canonici: Culturale, Naturale. Unisce duplicati e riassegna i Sito."
 
-    def handle(self, *args, **opts):
-        with transaction.atomic():
-            cat_cult, _ = Categoria.objects.get_or_create(nome="Culturale", defaults={"descrizione": ""})
-            cat_nat,  _ = Categoria.objects.get_or_create(nome="Naturale", defaults={"descrizione": ""})
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Mostra la mappatura senza scrivere nel DB")
+        parser.add_argument(
+            "--unknown", choices=[*CANONICI, "keep"], default="Culturale",
+            help="Destinazione delle categorie non riconosciute (keep = lasciale invariate)",
+        )
 
-            reassigned = 0
-            deleted = 0
-            report = []
+    def handle(self, *args, **opts):
+        dry_run = opts["dry_run"]
+        with batch():
+            if not dry_run:
+                Categoria.objects.bulk_create(
+                    [Categoria(nome=n, descrizione="") for n in CANONICI], ignore_conflicts=True
+                )
 
-            for cat in Categoria.objects.all().order_by("nome"):
-                name = (cat.nome or "").strip()
-                key = name.lower()
+            # una sola lettura: tutte le categorie con il numero di siti
+            categorie = list(Categoria.objects.annotate(n_siti=Count("sito")).order_by("nome"))
+            canonici = {c.nome: c for c in categorie if c.nome in CANONICI}
 
-                if cat.id in (cat_cult.id, cat_nat.id):
+            mapping, report, unknown = {}, [], []
+            for cat in categorie:
+                if cat.nome in CANONICI:
                     continue
-
-                target_name = CANONICAL.get(key)
+                name = (cat.nome or "").strip()
+                target_name = CANONICAL.get(name.lower())
                 if not target_name:
-                
-                    target_name = "Culturale"
+                    unknown.append(f'"{name}" ({cat.n_siti} siti)')
+                    if opts["unknown"] == "keep":
+                        continue
+                    target_name = opts["unknown"]
+                target = canonici.get(target_name)
+                mapping[cat.id] = target.id if target else None
+                report.append(f'"{name}" -> "{target_name}" ({cat.n_siti} siti)')
+
+            reassigned = sum(c.n_siti for c in categorie if c.id in mapping)
+            deleted = len(mapping)
 
-                target_cat = cat_cult if target_name == "Culturale" else cat_nat
-                count = Sito.objects.filter(categoria=cat).update(categoria=target_cat)
-                reassigned += count
-                report.append(f'"{name}" -> "{target_cat.nome}" ({count} siti)')
+            if dry_run:
+                self.stdout.write(self.style.WARNING("DRY-RUN: nessuna modifica salvata."))
+            elif mapping:
+                # un solo UPDATE ... CASE per tutti i siti da riassegnare
+                reassigned = Sito.objects.filter(categoria_id__in=mapping).update(
+                    categoria_id=Case(*[When(categoria_id=src, then=Value(dst)) for src, dst in mapping.items()])
+                )
+                # ora sono orfane: eliminazione in blocco
+                Categoria.objects.filter(id__in=mapping).delete()
 
-                if not Sito.objects.filter(categoria=cat).exists():
-                    cat.delete()
-                    deleted += 1
+                # qs.update() non invia segnali: invalida a mano cache e indici in memoria
+                # (dentro batch() i segnali delle categorie eliminate hanno già incrementato una volta)
+                bump_catalog_version()
 
-            self.stdout.write(self.style.SUCCESS("Normalizzazione completata."))
-            self.stdout.write("\n".join(report))
-            self.stdout.write(self.style.SUCCESS(f"Riassegnati: {reassigned} | Categorie eliminate: {deleted}"))
+        self.stdout.write(self.style.SUCCESS("Normalizzazione completata." if not dry_run else "Mappatura calcolata."))
+        self.stdout.write("\n".join(report))
+        if unknown:
+            self.stdout.write(self.style.WARNING("Categorie non riconosciute: " + ", ".join(unknown)))
+        self.stdout.write(self.style.SUCCESS(f"Riassegnati: {reassigned} | Categorie eliminate: {deleted}"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from heritage.models import Itinerario
+from heritage.routing import reorder_itinerario
+
+
+class Command(BaseCommand):
+    help = "Riordina le tappe degli itinerari minimizzando la distanza percorsa (TSP a percorso aperto)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("ids", nargs="*", type=int, help="Id degli itinerari (default: tutti)")
+        parser.add_argument("--fix-start", action="store_true", help="Mantiene la prima tappa attuale come partenza")
+        parser.add_argument("--dry-run", action="store_true", help="Calcola senza salvare")
+
+    def handle(self, *args, **opts):
+        qs = Itinerario.objects.order_by("id")
+        if opts["ids"]:
+            qs = qs.filter(id__in=opts["ids"])
+            missing = set(opts["ids"]) - set(qs.values_list("id", flat=True))
+            if missing:
+                raise CommandError(f"Itinerari non trovati: {', '.join(map(str, sorted(missing)))}")
+
+        for itin in qs:
+            before, after = reorder_itinerario(itin, fix_start=opts["fix_start"], dry_run=opts["dry_run"])
+            self.stdout.write(f"{itin.nome}: {before:.1f} km -> {after:.1f} km")
+        if opts["dry_run"]:
+            self.stdout.write(self.style.WARNING("DRY-RUN: nessuna modifica salvata."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Ottimizzazione completata."))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from heritage import itinerari
+
+
+class Command(BaseCommand):
+    help = "Ricalcola il riepilogo denormalizzato (tappe, accessibilità, bbox, lunghezza) di tutti gli itinerari"
+
+    def handle(self, *args, **opts):
+        aggiornati = itinerari.refresh_rollup()
+        self.stdout.write(self.style.SUCCESS(f"Riepiloghi aggiornati: {aggiornati}"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from heritage import nearby
+
+
+class Command(BaseCommand):
+    help = "Ricalcola la tabella dei siti più vicini (SitoVicino)"
+
+    def handle(self, *args, **opts):
+        righe = nearby.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Tabella vicini ricalcolata: {righe} righe"))
@@ -0,0 +1,62 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from heritage import jobs
+
+
+class Command(BaseCommand):
+    help = "Esegue i lavori della coda (heritage.jobs) in un pool di thread"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Thread del pool")
+        parser.add_argument("--poll", type=float, default=1.0, help="Secondi di attesa quando la coda è vuota")
+        parser.add_argument("--once", action="store_true", help="Svuota i lavori pronti ed esce")
+
+    def handle(self, *args, **opts):
+        workers = max(1, opts["workers"])
+        worker = jobs.worker_id()
+        if workers == 1:
+            return self.run_inline(worker, opts)
+        ok = ko = 0
+        last_requeue = 0.0
+        running = set()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="heritage-job") as pool:
+            try:
+                while True:
+                    if time.monotonic() - last_requeue > 60:
+                        jobs.requeue_stale()
+                        last_requeue = time.monotonic()
+                    free = workers - len(running)
+                    claimed = jobs.claim(worker, free) if free else []
+                    running |= {pool.submit(jobs.run_in_thread, job) for job in claimed}
+                    if not running:
+                        if opts["once"]:
+                            break
+                        time.sleep(opts["poll"])
+                        continue
+                    done, running = wait(running, timeout=opts["poll"], return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        if fut.result():
+                            ok += 1
+                        else:
+                            ko += 1
+            except KeyboardInterrupt:
+                self.stderr.write("Interruzione: attendo la fine dei lavori in corso...")
+        self.stdout.write(self.style.SUCCESS(f"Lavori completati: {ok} | Falliti o da ripetere: {ko}"))
+
+    def run_inline(self, worker, opts):
+        """Un solo worker: lavori eseguiti nel thread principale, senza pool."""
+        ok = ko = 0
+        try:
+            while True:
+                jobs.requeue_stale()
+                done = jobs.run_pending(limit=10, worker=worker)
+                ok, ko = ok + done[0], ko + done[1]
+                if done == (0, 0):
+                    if opts["once"]:
+                        break
+                    time.sleep(opts["poll"])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Lavori completati: {ok} | Falliti o da ripetere: {ko}"))
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from heritage.models import Itinerario, Tappa, Sito
+from heritage.routing import reorder_itinerario
 
 def pick(name_part):
     return Sito.objects.filter(nome__icontains=name_part).order_by("id").first()
@@ -7,6 +8,9 @@ def pick(name_part):
 class Command(BaseCommand):
     help = "Crea itinerari demo (Nord Italia / Centro Italia / Sud & Isole)."
 
+    def add_arguments(self, parser):
+        parser.add_argument("--optimize", action="store_true", help="Riordina le tappe sul percorso più breve")
+
     def handle(self, *args, **opts):
         data = [
             ("Città d’arte del Nord", "Percorso tra alcune città d’arte del Nord Italia",
@@ -24,5 +28,7 @@ class Command(BaseCommand):
                 s = pick(key)
                 if s:
                     Tappa.objects.create(itinerario=itin, sito=s, ordine=ordine)
+            if opts["optimize"]:
+                reorder_itinerario(itin)
 
         self.stdout.write(self.style.SUCCESS(f"Seed itinerari completato. Itinerari: {len(data)}"))
@@ -1,43 +1,54 @@
-import csv
 from django.core.management.base import BaseCommand, CommandError
+from heritage import itinerari, nearby
+from heritage.ingest import COORDS_COLUMNS, DEFAULT_CHUNK_BYTES, IngestError, Pipeline, normalize_coords_row
 from heritage.models import Sito
+from heritage.versioning import bump_catalog_version
+
+COORD_FIELDS = ["latitudine", "longitudine", "citta", "regione"]
 
 class Command(BaseCommand):
     help = "Aggiorna lat/long/città/regione dei Sito dal CSV (matching per unesco_id)"
 
     def add_arguments(self, parser):
         parser.add_argument("csv_path", type=str)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=None, help="Processi per il parsing (default: CPU)")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_BYTES, help="Byte per chunk")
 
     def handle(self, *args, **opts):
         path = opts["csv_path"]
-        updated = 0
+        self.updated = 0
+        pipeline = Pipeline(
+            path, normalize_coords_row, columns=COORDS_COLUMNS, workers=opts["workers"],
+            chunk_bytes=opts["chunk_size"], batch_size=opts["batch_size"],
+        )
         try:
-            with open(path, newline="", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    try:
-                        unesco_id = int(row["unesco_id"])
-                    except Exception:
-                        continue
-                    lat = row.get("lat")
-                    lng = row.get("long")
-                    citta = row.get("citta")
-                    regione = row.get("regione")
-
-                    qs = Sito.objects.filter(unesco_id=unesco_id)
-                    if not qs.exists():
-                        continue
-
-                    fields = {}
-                    if lat not in (None, "", "NaN"): fields["latitudine"] = float(lat)
-                    if lng not in (None, "", "NaN"): fields["longitudine"] = float(lng)
-                    if citta and str(citta).strip().lower() != "nan": fields["citta"] = citta
-                    if regione and str(regione).strip().lower() != "nan": fields["regione"] = regione
-
-                    if fields:
-                        qs.update(**fields)
-                        updated += 1
-        except FileNotFoundError as e:
+            stats = pipeline.run(self.write)
+        except (FileNotFoundError, IngestError) as e:
             raise CommandError(str(e))
+        finally:
+            # bulk_update non invia segnali: invalida a mano cache e indici in memoria,
+            # anche se un lotto fallisce (i lotti precedenti sono già committati)
+            if self.updated:
+                bump_catalog_version()
+                nearby.rebuild()
+                itinerari.refresh_rollup()
+
+        self.stdout.write(self.style.SUCCESS(f"Aggiornati {self.updated} record da {path}"))
+        self.stdout.write(stats.summary())
 
-        self.stdout.write(self.style.SUCCESS(f"Aggiornati {updated} record da {path}"))
+    def write(self, batch):
+        siti = {
+            s.unesco_id: s
+            for s in Sito.objects.filter(unesco_id__in={r["unesco_id"] for r in batch}).only("unesco_id", *COORD_FIELDS)
+        }
+        changed = {}
+        for rec in batch:
+            sito = siti.get(rec["unesco_id"])
+            if sito is None:
+                continue
+            for k, v in rec["fields"].items():
+                setattr(sito, k, v)
+            changed[sito.pk] = sito
+            self.updated += 1
+        Sito.objects.bulk_update(changed.values(), COORD_FIELDS)
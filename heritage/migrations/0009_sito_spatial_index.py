@@ -0,0 +1,72 @@
+from django.db import migrations, models
+
+RTREE = "heritage_sito_rtree"
+
+RTREE_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE} USING rtree(id, min_lon, max_lon, min_lat, max_lat)",
+    f"""
+    INSERT INTO {RTREE} (id, min_lon, max_lon, min_lat, max_lat)
+    SELECT id, longitudine, longitudine, latitudine, latitudine FROM heritage_sito
+    WHERE latitudine IS NOT NULL AND longitudine IS NOT NULL
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {RTREE}_ai AFTER INSERT ON heritage_sito
+    WHEN new.latitudine IS NOT NULL AND new.longitudine IS NOT NULL
+    BEGIN
+        INSERT INTO {RTREE} (id, min_lon, max_lon, min_lat, max_lat)
+        VALUES (new.id, new.longitudine, new.longitudine, new.latitudine, new.latitudine);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {RTREE}_au AFTER UPDATE OF latitudine, longitudine ON heritage_sito
+    BEGIN
+        DELETE FROM {RTREE} WHERE id = old.id;
+        INSERT INTO {RTREE} (id, min_lon, max_lon, min_lat, max_lat)
+        SELECT new.id, new.longitudine, new.longitudine, new.latitudine, new.latitudine
+        WHERE new.latitudine IS NOT NULL AND new.longitudine IS NOT NULL;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {RTREE}_ad AFTER DELETE ON heritage_sito
+    BEGIN
+        DELETE FROM {RTREE} WHERE id = old.id;
+    END
+    """,
+]
+
+DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {RTREE}_ai",
+    f"DROP TRIGGER IF EXISTS {RTREE}_au",
+    f"DROP TRIGGER IF EXISTS {RTREE}_ad",
+    f"DROP TABLE IF EXISTS {RTREE}",
+]
+
+
+def create_rtree(apps, schema_editor):
+    # R*Tree solo su SQLite: sugli altri DB basta l'indice (latitudine, longitudine)
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for sql in RTREE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_rtree(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0008_booking'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sito',
+            index=models.Index(fields=['latitudine', 'longitudine'], name='heritage_si_latitud_841340_idx'),
+        ),
+        migrations.RunPython(create_rtree, drop_rtree),
+    ]
@@ -0,0 +1,79 @@
+from django.db import migrations
+
+FTS = "heritage_sito_fts"
+
+SQLITE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS} USING fts5(
+        nome, citta, regione, descrizione,
+        content='heritage_sito', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )
+    """,
+    f"INSERT INTO {FTS}({FTS}) VALUES('rebuild')",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS}_ai AFTER INSERT ON heritage_sito BEGIN
+        INSERT INTO {FTS}(rowid, nome, citta, regione, descrizione)
+        VALUES (new.id, new.nome, new.citta, new.regione, new.descrizione);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS}_ad AFTER DELETE ON heritage_sito BEGIN
+        INSERT INTO {FTS}({FTS}, rowid, nome, citta, regione, descrizione)
+        VALUES ('delete', old.id, old.nome, old.citta, old.regione, old.descrizione);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS}_au AFTER UPDATE OF nome, citta, regione, descrizione ON heritage_sito BEGIN
+        INSERT INTO {FTS}({FTS}, rowid, nome, citta, regione, descrizione)
+        VALUES ('delete', old.id, old.nome, old.citta, old.regione, old.descrizione);
+        INSERT INTO {FTS}(rowid, nome, citta, regione, descrizione)
+        VALUES (new.id, new.nome, new.citta, new.regione, new.descrizione);
+    END
+    """,
+]
+
+SQLITE_DROP = [
+    f"DROP TRIGGER IF EXISTS {FTS}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS}_au",
+    f"DROP TABLE IF EXISTS {FTS}",
+]
+
+# Stessa espressione di search.PG_DOCUMENT, altrimenti l'indice non viene usato
+PG_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(nome, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(citta, '') || ' ' || coalesce(regione, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(descrizione, '')), 'C')"
+)
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for sql in SQLITE_SQL:
+            schema_editor.execute(sql)
+    elif vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS heritage_sito_fts_gin ON heritage_sito USING gin (({PG_DOCUMENT}))"
+        )
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for sql in SQLITE_DROP:
+            schema_editor.execute(sql)
+    elif vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS heritage_sito_fts_gin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0009_sito_spatial_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0010_sito_fulltext_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sorgente', models.CharField(max_length=100)),
+                ('path', models.CharField(max_length=500)),
+                ('checksum', models.CharField(blank=True, max_length=64)),
+                ('mtime', models.FloatField(blank=True, null=True)),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('sorgente', 'path'), name='importstate_unique_sorgente_path')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportRowDigest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chiave', models.CharField(max_length=200)),
+                ('digest', models.CharField(max_length=32)),
+                ('stato', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='righe', to='heritage.importstate')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('stato', 'chiave'), name='importrowdigest_unique_stato_chiave')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0011_import_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SitoVicino',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distanza_km', models.FloatField()),
+                ('rango', models.PositiveSmallIntegerField()),
+                ('sito', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vicini', to='heritage.sito')),
+                ('vicino', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='heritage.sito')),
+            ],
+            options={
+                'ordering': ['sito', 'rango'],
+                'indexes': [models.Index(fields=['sito', 'distanza_km'], name='heritage_si_sito_id_518b80_idx')],
+                'constraints': [models.UniqueConstraint(fields=('sito', 'rango'), name='sitovicino_unique_sito_rango')],
+            },
+        ),
+    ]
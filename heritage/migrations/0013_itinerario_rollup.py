@@ -0,0 +1,93 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:06
+
+import math
+
+from django.db import migrations, models
+
+
+def backfill_rollup(apps, schema_editor):
+    """Riepilogo iniziale degli itinerari esistenti (stessa logica di itinerari.compute_rollup)."""
+    Itinerario = apps.get_model("heritage", "Itinerario")
+    Tappa = apps.get_model("heritage", "Tappa")
+    for itin in Itinerario.objects.all():
+        stops = list(
+            Tappa.objects.filter(itinerario=itin).order_by("ordine").values_list(
+                "sito__latitudine", "sito__longitudine", "sito__accessibilita__sedia_a_rotelle",
+                "sito__accessibilita__ausili_visivi", "sito__accessibilita__supporto_uditivo",
+            )
+        )
+        pts = [(la, lo) for la, lo, *_ in stops if la is not None and lo is not None]
+        km = 0.0
+        for (la1, lo1), (la2, lo2) in zip(pts, pts[1:]):
+            p1, p2 = math.radians(la1), math.radians(la2)
+            a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lo2 - lo1) / 2) ** 2
+            km += 2 * 6371.0088 * math.asin(math.sqrt(min(1.0, a)))
+        itin.n_tappe = len(stops)
+        itin.n_sedia_a_rotelle = sum(1 for s in stops if s[2] is True)
+        itin.n_ausili_visivi = sum(1 for s in stops if s[3] is True)
+        itin.n_supporto_uditivo = sum(1 for s in stops if s[4] is True)
+        if pts:
+            itin.min_lat, itin.max_lat = min(p[0] for p in pts), max(p[0] for p in pts)
+            itin.min_lon, itin.max_lon = min(p[1] for p in pts), max(p[1] for p in pts)
+        itin.lunghezza_km = round(km, 3)
+        itin.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0012_sito_vicino'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itinerario',
+            name='lunghezza_km',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='itinerario',
+            name='max_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='itinerario',
+            name='max_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='itinerario',
+            name='min_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='itinerario',
+            name='min_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='itinerario',
+            name='n_ausili_visivi',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='itinerario',
+            name='n_sedia_a_rotelle',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='itinerario',
+            name='n_supporto_uditivo',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='itinerario',
+            name='n_tappe',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='itinerario',
+            index=models.Index(fields=['nome'], name='heritage_it_nome_052a75_idx'),
+        ),
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_posti(apps, schema_editor):
+    """Contatori iniziali dalle prenotazioni esistenti (la capienza non scende sotto i posti già presi)."""
+    Booking = apps.get_model("heritage", "Booking")
+    PostiPrenotati = apps.get_model("heritage", "PostiPrenotati")
+    Itinerario = apps.get_model("heritage", "Itinerario")
+    capienza = dict(Itinerario.objects.values_list("id", "capienza_giornaliera"))
+    rows = Booking.objects.values("itinerario_id", "data").annotate(n=models.Sum("numero_persone"))
+    PostiPrenotati.objects.bulk_create(
+        PostiPrenotati(
+            itinerario_id=r["itinerario_id"], data=r["data"], prenotati=r["n"],
+            capienza=max(capienza[r["itinerario_id"]], r["n"]),
+        )
+        for r in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0013_itinerario_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itinerario',
+            name='capienza_giornaliera',
+            field=models.PositiveIntegerField(default=30),
+        ),
+        migrations.CreateModel(
+            name='PostiPrenotati',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('capienza', models.PositiveIntegerField()),
+                ('prenotati', models.PositiveIntegerField(default=0)),
+                ('itinerario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='posti', to='heritage.itinerario')),
+            ],
+            options={
+                'ordering': ['itinerario', 'data'],
+                'constraints': [models.UniqueConstraint(fields=('itinerario', 'data'), name='postiprenotati_unique_itin_data')],
+            },
+        ),
+        migrations.RunPython(backfill_posti, migrations.RunPython.noop),
+    ]
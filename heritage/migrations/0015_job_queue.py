@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0014_posti_prenotati'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=100)),
+                ('kwargs', models.JSONField(blank=True, default=dict)),
+                ('priorita', models.SmallIntegerField(default=0, help_text='Valori più alti vengono eseguiti prima')),
+                ('stato', models.CharField(choices=[('pending', 'In attesa'), ('running', 'In esecuzione'), ('done', 'Completato'), ('failed', 'Fallito')], default='pending', max_length=10)),
+                ('dedup_key', models.CharField(blank=True, max_length=200, null=True)),
+                ('scheduled_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tentativi', models.PositiveSmallIntegerField(default=0)),
+                ('max_tentativi', models.PositiveSmallIntegerField(default=3)),
+                ('ultimo_errore', models.TextField(blank=True)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-priorita', 'scheduled_at', 'id'],
+                'indexes': [models.Index(fields=['stato', '-priorita', 'scheduled_at'], name='heritage_jo_stato_ac0d30_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('stato__in', ['pending', 'running'])), fields=('dedup_key',), name='job_unique_active_dedup_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:32
+
+import time
+
+from django.db import migrations, models
+
+
+def crea_contatore(apps, schema_editor):
+    # stessa origine di versioning._seed(): nessuna collisione con ETag già emessi
+    apps.get_model("heritage", "CatalogVersion").objects.create(pk=1, valore=time.time_ns() // 1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heritage', '0015_job_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valore', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(crea_contatore, migrations.RunPython.noop),
+    ]
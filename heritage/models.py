@@ -93,6 +93,7 @@ class Sito(models.Model):
             models.Index(fields=["regione"]),
             models.Index(fields=["citta"]),
             models.Index(fields=["categoria"]),
+            models.Index(fields=["latitudine", "longitudine"]),
         ]
         constraints = [
             models.CheckConstraint(
@@ -108,14 +109,96 @@ class Sito(models.Model):
     def __str__(self):
         return f"{self.nome} ({self.citta})" if self.citta else self.nome
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # coordinate lette dal DB: i segnali aggiornano i vicini solo se cambiano;
+        # None = non lette (.only()/.defer()), posizione precedente sconosciuta
+        loaded = "latitudine" in instance.__dict__ and "longitudine" in instance.__dict__
+        instance._coords_db = (instance.latitudine, instance.longitudine) if loaded else None
+        return instance
+
+    @property
+    def coords_changed(self):
+        old = getattr(self, "_coords_db", (None, None))
+        return old is None or old != (self.latitudine, self.longitudine)
+
+
+class SitoVicino(models.Model):
+    """Uno dei K siti più vicini a `sito` (tabella kNN precalcolata, vedi heritage.nearby)."""
+    sito = models.ForeignKey(Sito, on_delete=models.CASCADE, related_name="vicini")
+    vicino = models.ForeignKey(Sito, on_delete=models.CASCADE, related_name="+")
+    distanza_km = models.FloatField()
+    rango = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ["sito", "rango"]
+        constraints = [
+            models.UniqueConstraint(fields=["sito", "rango"], name="sitovicino_unique_sito_rango"),
+        ]
+        indexes = [models.Index(fields=["sito", "distanza_km"])]
+
+    def __str__(self):
+        return f"{self.sito_id} → {self.vicino_id} ({self.distanza_km:.1f} km)"
+
 
 class Itinerario(models.Model):
     nome = models.CharField(max_length=200)
     descrizione = models.TextField(blank=True)
 
+    # riepilogo denormalizzato delle tappe (heritage.itinerari.refresh_rollup)
+    n_tappe = models.PositiveIntegerField(default=0)
+    n_sedia_a_rotelle = models.PositiveIntegerField(default=0)
+    n_ausili_visivi = models.PositiveIntegerField(default=0)
+    n_supporto_uditivo = models.PositiveIntegerField(default=0)
+    min_lat = models.FloatField(null=True, blank=True)
+    max_lat = models.FloatField(null=True, blank=True)
+    min_lon = models.FloatField(null=True, blank=True)
+    max_lon = models.FloatField(null=True, blank=True)
+    lunghezza_km = models.FloatField(default=0)
+
+    # posti prenotabili per ogni data (copiati in PostiPrenotati alla prima prenotazione)
+    capienza_giornaliera = models.PositiveIntegerField(default=30)
+
+    class Meta:
+        indexes = [models.Index(fields=["nome"])]
+
     def __str__(self):
         return self.nome
 
+    def _perc(self, n):
+        return round(100 * n / self.n_tappe) if self.n_tappe else 0
+
+    @property
+    def has_wheelchair(self):
+        return self.n_sedia_a_rotelle > 0
+
+    @property
+    def has_visivi(self):
+        return self.n_ausili_visivi > 0
+
+    @property
+    def has_uditivo(self):
+        return self.n_supporto_uditivo > 0
+
+    @property
+    def perc_sedia_a_rotelle(self):
+        return self._perc(self.n_sedia_a_rotelle)
+
+    @property
+    def perc_ausili_visivi(self):
+        return self._perc(self.n_ausili_visivi)
+
+    @property
+    def perc_supporto_uditivo(self):
+        return self._perc(self.n_supporto_uditivo)
+
+    @property
+    def bbox(self):
+        if self.min_lat is None:
+            return None
+        return (self.min_lon, self.min_lat, self.max_lon, self.max_lat)
+
 
 class Tappa(models.Model):
     itinerario = models.ForeignKey(Itinerario, on_delete=models.CASCADE, related_name="tappe")
@@ -159,4 +242,106 @@ class Booking(models.Model):
         indexes = [models.Index(fields=["itinerario"]), models.Index(fields=["data"])]
 
     def __str__(self):
-        return f"{self.nome} → {self.itinerario.nome} il {self.data}"
\ No newline at end of file
+        return f"{self.nome} → {self.itinerario.nome} il {self.data}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # posti già conteggiati in PostiPrenotati: i segnali correggono solo le differenze
+        d = instance.__dict__
+        instance._posti_db = (d.get("itinerario_id"), d.get("data"), d.get("numero_persone"))
+        return instance
+
+
+class PostiPrenotati(models.Model):
+    """Posti prenotati per itinerario e data (contatore aggiornato con UPDATE condizionali, vedi heritage.capacity)."""
+    itinerario = models.ForeignKey(Itinerario, on_delete=models.CASCADE, related_name="posti")
+    data = models.DateField()
+    capienza = models.PositiveIntegerField()
+    prenotati = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["itinerario", "data"]
+        constraints = [
+            models.UniqueConstraint(fields=["itinerario", "data"], name="postiprenotati_unique_itin_data"),
+        ]
+
+    def __str__(self):
+        return f"{self.itinerario_id} il {self.data}: {self.prenotati}/{self.capienza}"
+
+    @property
+    def disponibili(self):
+        return max(0, self.capienza - self.prenotati)
+
+
+class ImportState(models.Model):
+    """Ultimo import riuscito di un file sorgente (per saltare i file invariati)."""
+    sorgente = models.CharField(max_length=100)
+    path = models.CharField(max_length=500)
+    checksum = models.CharField(max_length=64, blank=True)
+    mtime = models.FloatField(null=True, blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["sorgente", "path"], name="importstate_unique_sorgente_path"),
+        ]
+
+    def __str__(self):
+        return f"{self.sorgente}: {self.path}"
+
+
+class ImportRowDigest(models.Model):
+    """Hash del contenuto normalizzato di una riga sorgente, per chiave."""
+    stato = models.ForeignKey(ImportState, on_delete=models.CASCADE, related_name="righe")
+    chiave = models.CharField(max_length=200)
+    digest = models.CharField(max_length=32)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["stato", "chiave"], name="importrowdigest_unique_stato_chiave"),
+        ]
+
+
+class Job(models.Model):
+    """Lavoro in coda eseguito da ``manage.py run_workers`` (vedi heritage.jobs)."""
+    PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+    STATI = [(PENDING, "In attesa"), (RUNNING, "In esecuzione"), (DONE, "Completato"), (FAILED, "Fallito")]
+
+    nome = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priorita = models.SmallIntegerField(default=0, help_text="Valori più alti vengono eseguiti prima")
+    stato = models.CharField(max_length=10, choices=STATI, default=PENDING)
+    dedup_key = models.CharField(max_length=200, null=True, blank=True)
+    scheduled_at = models.DateTimeField(default=timezone.now)
+    tentativi = models.PositiveSmallIntegerField(default=0)
+    max_tentativi = models.PositiveSmallIntegerField(default=3)
+    ultimo_errore = models.TextField(blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-priorita", "scheduled_at", "id"]
+        indexes = [models.Index(fields=["stato", "-priorita", "scheduled_at"])]
+        constraints = [
+            # un solo lavoro attivo per chiave; quelli conclusi non bloccano nuovi inserimenti
+            models.UniqueConstraint(
+                fields=["dedup_key"], condition=models.Q(stato__in=["pending", "running"]),
+                name="job_unique_active_dedup_key",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.nome} [{self.stato}]"
+
+
+
+class CatalogVersion(models.Model):
+    """Versione del dataset dei Siti (una sola riga, vedi heritage/versioning.py)."""
+    valore = models.BigIntegerField()
+
+    def __str__(self):
+        return str(self.valore)
@@ -0,0 +1,198 @@
+"""Tabella persistente dei siti più vicini (kNN) per ogni Sito.
+
+Le distanze vengono calcolate una volta sola e salvate in ``SitoVicino``;
+l'endpoint ``/api/sites/<id>/nearby`` legge solo quella tabella.
+
+- catalogo piccolo: righe della matrice haversine in NumPy;
+- catalogo grande: KD-tree sui vettori unitari della sfera (la distanza
+  euclidea tra vettori unitari è monotona rispetto a quella sul cerchio
+  massimo, quindi i vicini coincidono).
+
+Quando le coordinate di un sito cambiano si ricalcolano solo le righe
+interessate: il sito stesso, chi lo aveva tra i vicini e chi ora lo avrebbe.
+"""
+import heapq
+
+import numpy as np
+from django.db import transaction
+
+from .routing import EARTH_RADIUS_KM
+
+K_MAX = 20             # vicini salvati per sito
+MATRIX_LIMIT = 3000    # oltre questo numero di siti si usa il KD-tree
+LEAF_SIZE = 32
+ROW_BLOCK = 512        # righe della matrice calcolate per volta (memoria costante)
+
+
+def unit_vectors(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0.0, 1.0))
+
+
+class KDTree:
+    """KD-tree minimale su punti 3D (foglie elaborate in NumPy)."""
+
+    def __init__(self, points, leaf_size=LEAF_SIZE):
+        self.points = points
+        self.leaf_size = leaf_size
+        self.index = np.arange(len(points))
+        # nodo: (inizio, fine, asse, soglia, figlio sinistro, figlio destro)
+        self.nodes = []
+        self._build(0, len(points))
+
+    def _build(self, start, end):
+        node = len(self.nodes)
+        self.nodes.append(None)
+        idx = self.index[start:end]
+        if end - start <= self.leaf_size:
+            self.nodes[node] = (start, end, -1, 0.0, -1, -1)
+            return node
+        pts = self.points[idx]
+        axis = int(np.argmax(pts.max(axis=0) - pts.min(axis=0)))
+        mid = (end - start) // 2
+        part = np.argpartition(pts[:, axis], mid)
+        self.index[start:end] = idx[part]
+        split = float(self.points[self.index[start + mid], axis])
+        left = self._build(start, start + mid)
+        right = self._build(start + mid, end)
+        self.nodes[node] = (start, end, axis, split, left, right)
+        return node
+
+    def query(self, point, k):
+        """(indici, distanze euclidee) dei k punti più vicini, in ordine crescente."""
+        best = []  # max-heap su -distanza
+        stack = [(0, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if len(best) == k and bound >= -best[0][0]:
+                continue
+            start, end, axis, split, left, right = self.nodes[node]
+            if axis < 0:
+                idx = self.index[start:end]
+                dist = np.sqrt(((self.points[idx] - point) ** 2).sum(axis=1))
+                for d, i in zip(dist.tolist(), idx.tolist()):
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, i))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, i))
+                continue
+            diff = point[axis] - split
+            near, far = (left, right) if diff < 0 else (right, left)
+            stack.append((far, max(bound, abs(diff))))
+            stack.append((near, bound))
+        best.sort(key=lambda x: -x[0])
+        return np.array([i for _, i in best], dtype=np.intp), np.array([-d for d, _ in best])
+
+
+def knn(lat, lon, rows, k=K_MAX):
+    """Per ogni indice in `rows`: (indici dei vicini, distanze km), escluso il punto stesso."""
+    n = len(lat)
+    k = min(k, n - 1)
+    if k <= 0:
+        return [(np.array([], dtype=np.intp), np.array([])) for _ in rows]
+    rows = np.asarray(rows, dtype=np.intp)
+    out = []
+    if n <= MATRIX_LIMIT:
+        for b in range(0, len(rows), ROW_BLOCK):
+            block = rows[b:b + ROW_BLOCK]
+            dist = _haversine_rows(lat, lon, block)
+            dist[np.arange(len(block)), block] = np.inf
+            part = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            for r, cand in enumerate(part):
+                order = cand[np.argsort(dist[r, cand], kind="stable")]
+                out.append((order, dist[r, order]))
+        return out
+
+    pts = unit_vectors(lat, lon)
+    tree = KDTree(pts)
+    for r in rows.tolist():
+        idx, chord = tree.query(pts[r], k + 1)
+        keep = idx != r
+        idx, chord = idx[keep][:k], chord[keep][:k]
+        out.append((idx, chord_to_km(chord)))
+    return out
+
+
+def _haversine_rows(lat, lon, rows):
+    """Righe della matrice haversine (len(rows) × n) senza costruire quella intera."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    la1, lo1 = np.radians(lat[rows])[:, None], np.radians(lon[rows])[:, None]
+    la2, lo2 = np.radians(lat)[None, :], np.radians(lon)[None, :]
+    a = np.sin((la2 - la1) / 2) ** 2 + np.cos(la1) * np.cos(la2) * np.sin((lo2 - lo1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _coordinates():
+    from .models import Sito
+
+    rows = list(
+        Sito.objects.filter(latitudine__isnull=False, longitudine__isnull=False)
+        .order_by("id").values_list("id", "latitudine", "longitudine")
+    )
+    ids = np.array([r[0] for r in rows], dtype=np.int64)
+    lat = np.array([r[1] for r in rows], dtype=np.float64)
+    lon = np.array([r[2] for r in rows], dtype=np.float64)
+    return ids, lat, lon
+
+
+def _write(ids, lat, lon, rows):
+    from .models import SitoVicino
+
+    objs = []
+    for r, (nbr, dist) in zip(rows, knn(lat, lon, rows)):
+        objs += [
+            SitoVicino(sito_id=int(ids[r]), vicino_id=int(ids[j]), distanza_km=float(d), rango=rank)
+            for rank, (j, d) in enumerate(zip(nbr.tolist(), dist.tolist()), start=1)
+        ]
+    SitoVicino.objects.bulk_create(objs, batch_size=2000)
+    return len(objs)
+
+
+def rebuild():
+    """Ricalcola l'intera tabella; restituisce il numero di righe scritte."""
+    from .models import SitoVicino
+
+    ids, lat, lon = _coordinates()
+    with transaction.atomic():
+        SitoVicino.objects.all().delete()
+        return _write(ids, lat, lon, np.arange(len(ids)))
+
+
+def update_for(changed_ids, extra_ids=()):
+    """Aggiornamento incrementale dopo modifica, creazione o eliminazione di siti.
+
+    `extra_ids`: siti da ricalcolare comunque (es. chi aveva tra i vicini un sito eliminato).
+    """
+    from django.db.models import Max
+
+    from .models import SitoVicino
+
+    changed = set(changed_ids)
+    ids, lat, lon = _coordinates()
+    pos = {pk: i for i, pk in enumerate(ids.tolist())}
+
+    affected = set(extra_ids) | changed
+    affected |= set(SitoVicino.objects.filter(vicino_id__in=changed).values_list("sito_id", flat=True))
+
+    # chi ora avrebbe un sito modificato tra i vicini: distanza < k-esimo vicino attuale
+    rows = [pos[pk] for pk in changed if pk in pos]
+    if rows and len(ids) > 1:
+        kth = np.full(len(ids), np.inf)
+        full = min(K_MAX, len(ids) - 1)
+        stored = SitoVicino.objects.values("sito_id").annotate(m=Max("distanza_km"), n=Max("rango"))
+        for row in stored:
+            i = pos.get(row["sito_id"])
+            if i is not None and row["n"] >= full:
+                kth[i] = row["m"]
+        closest = _haversine_rows(lat, lon, np.array(rows)).min(axis=0)
+        affected |= set(ids[closest < kth].tolist())
+
+    with transaction.atomic():
+        SitoVicino.objects.filter(sito_id__in=affected).delete()
+        return _write(ids, lat, lon, [pos[pk] for pk in affected if pk in pos])
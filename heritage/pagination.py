@@ -0,0 +1,130 @@
+"""Paginazione a cursore (keyset) per la API dei siti.
+
+Il cursore è opaco per il client: codifica ordinamento, valore della chiave
+e id dell'ultima (o prima) riga della pagina. La pagina successiva è un
+range lookup sull'indice invece di un OFFSET che scarta righe.
+"""
+import base64
+import json
+
+from django.db.models import Q
+
+# ordinamenti ammessi: campi non nulli, con id come spareggio
+# ("rank" è la rilevanza annotata da search.apply_search)
+SORT_FIELDS = {"id": "id", "nome": "nome", "citta": "citta", "regione": "regione", "rank": "search_rank"}
+
+NEXT, PREV = "n", "p"
+
+
+class CursorError(ValueError):
+    pass
+
+
+def parse_sort(value):
+    """'nome' / '-nome' → ('nome', desc). Default: id crescente."""
+    s = (value or "id").strip()
+    desc = s.startswith("-")
+    field = SORT_FIELDS.get(s.lstrip("-"))
+    if field is None:
+        raise CursorError(f"sort non valido (ammessi: {', '.join(SORT_FIELDS)})")
+    return field, desc
+
+
+def _sort_key(sort):
+    field, desc = sort
+    return ("-" if desc else "") + field
+
+
+def encode_cursor(sort, value, pk, direction):
+    raw = json.dumps({"s": _sort_key(sort), "v": value, "id": pk, "d": direction}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token, sort):
+    """Restituisce (valore, id, direzione) oppure None se il cursore è assente."""
+    token = (token or "").strip()
+    if not token:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        value, pk, direction = data["v"], int(data["id"]), data["d"]
+        key = data["s"]
+    except (ValueError, KeyError, TypeError):
+        raise CursorError("cursor non valido")
+    if key != _sort_key(sort):
+        raise CursorError("il cursor appartiene a un ordinamento diverso")
+    if direction not in (NEXT, PREV):
+        raise CursorError("cursor non valido")
+    return value, pk, direction
+
+
+def _links(sort, rows, has_next, has_prev):
+    """rows: lista di (id, valore_ordinamento) nell'ordine della pagina."""
+    nxt = encode_cursor(sort, rows[-1][1], rows[-1][0], NEXT) if rows and has_next else None
+    prv = encode_cursor(sort, rows[0][1], rows[0][0], PREV) if rows and has_prev else None
+    return nxt, prv
+
+
+def _keyset_query(qs, sort, cursor, limit, offset):
+    """Queryset (id, campo) della pagina, con una riga in più per sapere se ce n'è un'altra."""
+    field, desc = sort
+    backwards = cursor is not None and cursor[2] == PREV
+    ascending = desc == backwards
+    prefix = "" if ascending else "-"
+    order = [prefix + field] + ([prefix + "id"] if field != "id" else [])
+
+    if cursor is not None:
+        value, pk, _ = cursor
+        op = "gt" if ascending else "lt"
+        if field == "id":
+            qs = qs.filter(**{f"id__{op}": pk})
+        else:
+            qs = qs.filter(Q(**{f"{field}__{op}": value}) | Q(**{field: value, f"id__{op}": pk}))
+        offset = 0
+    return qs.order_by(*order).values_list("id", field)[offset : offset + limit + 1], offset
+
+
+def _keyset_result(rows, sort, cursor, limit, offset):
+    backwards = cursor is not None and cursor[2] == PREV
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+        has_next, has_prev = True, more
+    else:
+        has_next, has_prev = more, cursor is not None or offset > 0
+    return [r[0] for r in rows], *_links(sort, rows, has_next, has_prev)
+
+
+def keyset_page(qs, sort, cursor, limit, offset=0):
+    """Pagina del queryset: ([id], next, prev). Senza cursore usa l'offset legacy."""
+    page, offset = _keyset_query(qs, sort, cursor, limit, offset)
+    return _keyset_result(list(page), sort, cursor, limit, offset)
+
+
+async def akeyset_page(qs, sort, cursor, limit, offset=0):
+    """Versione async di keyset_page (ORM async, nessun thread bloccato)."""
+    page, offset = _keyset_query(qs, sort, cursor, limit, offset)
+    return _keyset_result([r async for r in page], sort, cursor, limit, offset)
+
+
+def keyset_array(ids, sort, cursor, limit, offset=0):
+    """Come keyset_page, ma su un array NumPy di id ordinato (solo sort per id)."""
+    import numpy as np
+
+    _, desc = sort
+    keys = -ids[::-1] if desc else ids
+    if cursor is None:
+        start, end = offset, offset + limit
+    else:
+        k = -cursor[1] if desc else cursor[1]
+        if cursor[2] == NEXT:
+            start = int(np.searchsorted(keys, k, side="right"))
+            end = start + limit
+        else:
+            end = int(np.searchsorted(keys, k, side="left"))
+            start = max(0, end - limit)
+    page = keys[start:end]
+    page = (-page if desc else page).tolist()
+    rows = [(pk, pk) for pk in page]
+    return page, *_links(sort, rows, end < len(keys), start > 0)
@@ -0,0 +1,230 @@
+"""Profilo SQL per richiesta: numero di query, tempo SQL, duplicati, serializzazione.
+
+``ProfilingMiddleware`` registra ogni query tramite ``connection.execute_wrapper``
+e, se ``HERITAGE_PROFILING`` è attivo, aggiunge l'header ``Server-Timing``
+(visibile negli strumenti di sviluppo del browser) e, con
+``HERITAGE_PROFILING_LOG``, una riga JSON sul logger ``heritage.profiling``.
+
+Le viste misurano la serializzazione con ``with profiling.section("serialize")``.
+
+I budget di query per vista (``QUERY_BUDGETS``, sovrascrivibili con
+``HERITAGE_QUERY_BUDGETS``) producono un warning nel log; con
+``HERITAGE_QUERY_BUDGET_STRICT`` (usato nei test) sollevano ``QueryBudgetExceeded``.
+Le query il cui risultato resta in cache tra le richieste (introspezione
+dello schema, versione del dataset alla scadenza della chiave), dentro
+``profiling.once()``, sono registrate a parte e non contano nel budget.
+"""
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger("heritage.profiling")
+
+# massimo di query per url_name (comprese sessione/utente per le viste autenticate)
+QUERY_BUDGETS = {
+    "sites_geojson": 3,
+    "sites_nearby": 2,
+    "sites_tile": 1,
+    "itinerario_availability": 2,
+    "itinerario_geojson": 2,
+    "itinerari_list": 4,
+    "itinerario_dettaglio": 7,
+    "itinerari_api": 2,
+    "async_sites_geojson": 3,
+    "async_itinerario_geojson": 2,
+    "async_itinerari_api": 2,
+}
+
+_current = ContextVar("heritage_profile", default=None)
+_once = ContextVar("heritage_profile_once", default=False)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Profile:
+    def __init__(self):
+        self.queries = []          # (sql, params, secondi)
+        self.once = []             # come queries, con risultato in cache tra le richieste
+        self.sections = Counter()  # nome -> secondi
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.view = None
+
+    def __call__(self, execute, sql, params, many, context):
+        t0 = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            (self.once if _once.get() else self.queries).append((sql, params, time.perf_counter() - t0))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def sql_time(self):
+        return sum(q[2] for q in self.queries)
+
+    @property
+    def duplicates(self):
+        """Query ripetute identiche (stesso SQL e stessi parametri)."""
+        seen = Counter((sql, repr(params)) for sql, params, _ in self.queries)
+        return sum(n - 1 for n in seen.values())
+
+    @property
+    def similar(self):
+        """Query con lo stesso SQL ma parametri diversi (tipico N+1)."""
+        seen = Counter(sql for sql, _, _ in self.queries)
+        return sum(n - 1 for n in seen.values())
+
+    def server_timing(self):
+        parts = [
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.count} query, {self.duplicates} duplicate"',
+        ]
+        parts += [f"{name};dur={sec * 1000:.1f}" for name, sec in self.sections.items()]
+        parts.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(parts)
+
+    def as_dict(self):
+        return {
+            "view": self.view,
+            "queries": self.count,
+            "duplicates": self.duplicates,
+            "similar": self.similar,
+            "once": len(self.once),
+            "sql_ms": round(self.sql_time * 1000, 2),
+            "sections_ms": {k: round(v * 1000, 2) for k, v in self.sections.items()},
+            "total_ms": round(self.total * 1000, 2),
+        }
+
+
+@contextmanager
+def section(name):
+    """Misura un blocco (es. la serializzazione) nel profilo della richiesta corrente."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[name] += time.perf_counter() - t0
+
+
+@contextmanager
+def once():
+    """Query il cui risultato resta in cache tra le richieste: fuori dal budget."""
+    token = _once.set(True)
+    try:
+        yield
+    finally:
+        _once.reset(token)
+
+
+def budget_for(view):
+    budgets = {**QUERY_BUDGETS, **getattr(settings, "HERITAGE_QUERY_BUDGETS", {})}
+    return budgets.get(view)
+
+
+def _install(profile):
+    connection.execute_wrappers.append(profile)
+
+
+def _uninstall(profile):
+    connection.execute_wrappers.remove(profile)
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, "HERITAGE_PROFILING", False):
+            return self.get_response(request)
+
+        profile = Profile()
+        token = _current.set(profile)
+        try:
+            with connection.execute_wrapper(profile):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if not getattr(settings, "HERITAGE_PROFILING", False):
+            return await self.get_response(request)
+
+        profile = Profile()
+        token = _current.set(profile)
+        # l'ORM async usa la connessione del thread della richiesta (sync_to_async
+        # thread_sensitive): il wrapper va installato lì, non nell'event loop
+        await sync_to_async(_install)(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_uninstall)(profile)
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        profile.total = time.perf_counter() - profile.started
+        match = getattr(request, "resolver_match", None)
+        profile.view = match.url_name if match else None
+        request.profile = profile
+
+        response["Server-Timing"] = profile.server_timing()
+        if getattr(settings, "HERITAGE_PROFILING_LOG", False):
+            logger.info(json.dumps({"path": request.path, "status": response.status_code, **profile.as_dict()}))
+        self.check_budget(profile)
+        return response
+
+    def check_budget(self, profile):
+        budget = budget_for(profile.view)
+        if budget is None or profile.count <= budget:
+            return
+        msg = f"{profile.view}: {profile.count} query (budget {budget})"
+        if getattr(settings, "HERITAGE_QUERY_BUDGET_STRICT", False):
+            raise QueryBudgetExceeded(msg)
+        logger.warning(msg)
+
+
+class QueryBudgetMixin:
+    """Mixin per TestCase: richieste profilate che falliscono oltre il budget della vista."""
+
+    def profiled_get(self, url, budget=None, **kwargs):
+        from django.test.utils import override_settings
+
+        with override_settings(HERITAGE_PROFILING=True, HERITAGE_QUERY_BUDGET_STRICT=True):
+            response = self.client.get(url, **kwargs)
+        return response, self._check(url, response.wsgi_request.profile, budget)
+
+    async def aprofiled_get(self, url, budget=None, **kwargs):
+        """Come profiled_get, attraverso l'handler ASGI (self.async_client)."""
+        from django.test.utils import override_settings
+
+        with override_settings(HERITAGE_PROFILING=True, HERITAGE_QUERY_BUDGET_STRICT=True):
+            response = await self.async_client.get(url, **kwargs)
+        return response, self._check(url, response.asgi_request.profile, budget)
+
+    def _check(self, url, profile, budget):
+        if budget is not None and profile.count > budget:
+            raise QueryBudgetExceeded(f"{url}: {profile.count} query (budget {budget})")
+        return profile
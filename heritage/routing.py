@@ -0,0 +1,156 @@
+"""Ottimizzazione dell'ordine delle tappe di un itinerario (TSP a percorso aperto).
+
+Matrice delle distanze haversine calcolata in NumPy, soluzione iniziale
+nearest neighbour e miglioramento con 2-opt e Or-opt (spostamento di
+segmenti da 1 a 3 tappe). Ogni mossa valuta tutte le posizioni candidate
+in un'unica operazione vettoriale.
+
+Il percorso è aperto (non si torna al punto di partenza): si aggiunge un
+nodo fittizio a distanza zero da tutti e si risolve il giro chiuso.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import F
+
+EARTH_RADIUS_KM = 6371.0088
+EPS = 1e-9
+MAX_ROUNDS = 1000
+
+
+def haversine_matrix(lat, lon):
+    """Matrice n×n delle distanze in km tra i punti (gradi decimali)."""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def path_length(dist, order):
+    order = np.asarray(order, dtype=np.intp)
+    return float(dist[order[:-1], order[1:]].sum()) if len(order) > 1 else 0.0
+
+
+def _nearest_neighbour(d):
+    m = len(d)
+    tour = [0]
+    free = np.ones(m, dtype=bool)
+    free[0] = False
+    for _ in range(m - 1):
+        row = np.where(free, d[tour[-1]], np.inf)
+        nxt = int(np.argmin(row))
+        tour.append(nxt)
+        free[nxt] = False
+    return np.array(tour, dtype=np.intp)
+
+
+def _two_opt(d, t):
+    """Una passata di 2-opt (first improvement per i); True se ha migliorato."""
+    m = len(t)
+    improved = False
+    for i in range(1, m - 1):
+        a, b = t[i - 1], t[i]
+        c = t[i + 1:]
+        e = np.append(t[i + 2:], t[0])
+        delta = d[a, c] + d[b, e] - d[a, b] - d[c, e]
+        k = int(np.argmin(delta))
+        if delta[k] < -EPS:
+            j = i + 1 + k
+            t[i:j + 1] = t[i:j + 1][::-1].copy()
+            improved = True
+    return improved
+
+
+def _or_opt(d, t):
+    """Sposta segmenti di 1-3 nodi nel punto più conveniente; True se ha migliorato."""
+    m = len(t)
+    improved = False
+    for length in (1, 2, 3):
+        i = 1
+        while i + length <= m and m - length >= 2:
+            seg = t[i:i + length]
+            p, nx = t[i - 1], t[(i + length) % m]
+            gain = d[p, seg[0]] + d[seg[-1], nx] - d[p, nx]
+            rest = np.concatenate([t[:i], t[i + length:]])
+            u, v = rest, np.roll(rest, -1)
+            fwd = d[u, seg[0]] + d[seg[-1], v] - d[u, v]
+            rev = d[u, seg[-1]] + d[seg[0], v] - d[u, v]
+            cost = np.minimum(fwd, rev)
+            k = int(np.argmin(cost))
+            if cost[k] < gain - EPS:
+                piece = seg if fwd[k] <= rev[k] else seg[::-1]
+                t[:] = np.concatenate([rest[:k + 1], piece, rest[k + 1:]])
+                # il nodo fittizio torna in testa
+                t[:] = np.roll(t, -int(np.flatnonzero(t == 0)[0]))
+                improved = True
+            else:
+                i += 1
+    return improved
+
+
+def solve(dist, start=None):
+    """Ordine di visita (indici) che minimizza la lunghezza del percorso aperto.
+
+    `start`: indice della tappa da cui partire obbligatoriamente (opzionale).
+    """
+    n = len(dist)
+    if n <= 2:
+        return list(range(n)) if start in (None, 0) else [start] + [i for i in range(n) if i != start]
+    # nodo fittizio 0: il giro chiuso passante per 0 equivale al percorso aperto
+    d = np.zeros((n + 1, n + 1))
+    d[1:, 1:] = dist
+    if start is not None:
+        # arco fittizio→start con costo molto negativo: ogni buon giro lo contiene
+        big = float(dist.max()) * n + 1.0
+        d[0, start + 1] = d[start + 1, 0] = -big
+    t = _nearest_neighbour(d)
+    for _ in range(MAX_ROUNDS):
+        if not (_two_opt(d, t) | _or_opt(d, t)):
+            break
+    order = [int(x) - 1 for x in t[1:]]
+    if start is not None and order[0] != start:
+        order.reverse()
+    return order
+
+
+def optimize_tappe(tappe, fix_start=False):
+    """Nuovo ordine per una lista di Tappa: (tappe riordinate, km prima, km dopo).
+
+    Le tappe senza coordinate restano in coda, nell'ordine attuale.
+    """
+    located = [t for t in tappe if t.sito.latitudine is not None and t.sito.longitudine is not None]
+    others = [t for t in tappe if t not in located]
+    if not located:
+        return list(tappe), 0.0, 0.0
+    dist = haversine_matrix([t.sito.latitudine for t in located], [t.sito.longitudine for t in located])
+    order = solve(dist, start=0 if fix_start else None)
+    before = path_length(dist, range(len(located)))
+    after = path_length(dist, order)
+    if after > before - EPS:
+        # l'ordine attuale è già buono quanto quello calcolato
+        return list(tappe), before, before
+    return [located[i] for i in order] + others, before, after
+
+
+def reorder_itinerario(itinerario, fix_start=False, dry_run=False):
+    """Riscrive Tappa.ordine (1..n) in modo atomico; restituisce (km prima, km dopo)."""
+    from .itinerari import invalidate, refresh_rollup
+    from .models import Tappa
+
+    with transaction.atomic():
+        tappe = list(Tappa.objects.select_for_update().filter(itinerario=itinerario).select_related("sito"))
+        ordered, before, after = optimize_tappe(tappe, fix_start=fix_start)
+        if dry_run or [t.pk for t in ordered] == [t.pk for t in tappe]:
+            return before, after
+
+        # vincolo unique (itinerario, ordine): prima tutti fuori intervallo, poi i valori finali
+        offset = max(t.ordine for t in tappe) + len(tappe) + 1
+        Tappa.objects.filter(itinerario=itinerario).update(ordine=F("ordine") + offset)
+        for ordine, tappa in enumerate(ordered, start=1):
+            tappa.ordine = ordine
+        Tappa.objects.bulk_update(ordered, ["ordine"])
+    # update/bulk_update non inviano segnali
+    invalidate(itinerario.pk)
+    refresh_rollup([itinerario.pk])
+    return before, after
@@ -0,0 +1,166 @@
+"""Ricerca full-text sui Siti (nome, città, regione, descrizione).
+
+Su SQLite usa la tabella FTS5 ``heritage_sito_fts`` (tokenizer porter +
+rimozione accenti, tenuta allineata da trigger, migrazione 0010); su
+PostgreSQL un indice GIN su ``to_tsvector``. Il ranking (bm25 / ts_rank)
+viene calcolato dall'indice. Altrove si ricade su ``icontains``.
+
+I nomi UNESCO nel CSV sono in inglese mentre gli utenti scrivono in
+italiano: ogni parola della query viene ridotta a una radice approssimata
+e, se nota, affiancata dalla traduzione inglese (es. "chiese" → chiese* OR chies* OR church*).
+"""
+import re
+import unicodedata
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from . import profiling
+
+FTS_TABLE = "heritage_sito_fts"
+# pesi bm25 per colonna: nome, citta, regione, descrizione
+FTS_WEIGHTS = (10.0, 4.0, 4.0, 1.0)
+
+PG_CONFIG = "english"
+PG_DOCUMENT = (
+    f"setweight(to_tsvector('{PG_CONFIG}', coalesce(heritage_sito.nome, '')), 'A') || "
+    f"setweight(to_tsvector('{PG_CONFIG}', coalesce(heritage_sito.citta, '') || ' ' || "
+    "coalesce(heritage_sito.regione, '')), 'B') || "
+    f"setweight(to_tsvector('{PG_CONFIG}', coalesce(heritage_sito.descrizione, '')), 'C')"
+)
+
+# Italiano → inglese per i termini più frequenti nei nomi dei siti
+TRADUZIONI = {
+    "roma": "rome", "venezia": "venice", "firenze": "florence", "napoli": "naples",
+    "milano": "milan", "torino": "turin", "genova": "genoa", "padova": "padua",
+    "mantova": "mantua", "siracusa": "syracuse", "sicilia": "sicily", "sardegna": "sardinia",
+    "toscana": "tuscany", "piemonte": "piedmont", "lombardia": "lombardy", "puglia": "apulia",
+    "chiesa": "church", "chiese": "church", "cattedrale": "cathedral", "duomo": "cathedral",
+    "basilica": "basilica", "convento": "convent", "monastero": "monastery",
+    "centro": "centre", "storico": "historic", "storica": "historic",
+    "citta": "city", "castello": "castle", "palazzo": "palace", "palazzi": "palace",
+    "reggia": "palace", "residenze": "residence", "giardino": "garden", "giardini": "garden",
+    "parco": "park", "isola": "island", "isole": "island", "lago": "lake", "laguna": "lagoon",
+    "monte": "mount", "monti": "mount", "montagna": "mountain", "dolomiti": "dolomites",
+    "vulcano": "volcano", "grotte": "cave", "foresta": "forest", "foreste": "forest",
+    "faggete": "beech", "vigneti": "vineyard", "paesaggio": "landscape", "costiera": "coast",
+    "necropoli": "necropolis", "area": "area", "archeologica": "archaeological",
+    "archeologico": "archaeological", "affreschi": "fresco", "mura": "walls",
+    "difesa": "defence", "ferrovia": "railway", "terme": "spa", "etruschi": "etruscan",
+    "romana": "roman", "romano": "roman", "barocco": "baroque", "portici": "porticoes",
+    "orto": "garden", "botanico": "botanical", "ultima": "last", "cena": "supper",
+}
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_VOCALI_FINALI = re.compile(r"[aeiou]+$")
+
+
+def normalize(text):
+    """Minuscolo e senza accenti."""
+    s = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in s if not unicodedata.combining(c)).lower()
+
+
+def stem_it(word):
+    """Radice italiana approssimata: toglie le vocali finali (chiese → chies)."""
+    if len(word) < 5:
+        return word
+    return _VOCALI_FINALI.sub("", word) or word
+
+
+def terms(q):
+    """Per ogni parola della query, l'insieme delle alternative da cercare."""
+    out = []
+    for word in _WORD.findall(normalize(q)):
+        if len(word) < 2:
+            continue
+        # la parola intera serve per i termini inglesi (stemmati da porter)
+        alts = {word, stem_it(word)}
+        if word in TRADUZIONI:
+            alts.add(TRADUZIONI[word])
+        out.append(sorted(alts))
+    return out
+
+
+def fts5_expression(q):
+    """Espressione MATCH per FTS5 (prefix query, alternative in OR, parole in AND)."""
+    groups = []
+    for alts in terms(q):
+        group = " OR ".join(f'"{a}"*' for a in alts)
+        groups.append(f"({group})" if len(alts) > 1 else group)
+    return " AND ".join(groups) or None
+
+
+def tsquery_expression(q):
+    """Stessa logica per to_tsquery di PostgreSQL."""
+    groups = []
+    for alts in terms(q):
+        groups.append("(" + " | ".join(f"{a}:*" for a in alts) + ")")
+    return " & ".join(groups) or None
+
+
+_backend_cache = {}
+
+
+def backend(using="default"):
+    """'sqlite' / 'postgresql' se l'indice full-text è disponibile, altrimenti None."""
+    if using not in _backend_cache:
+        conn = connections[using]
+        found = None
+        if conn.vendor == "sqlite":
+            with profiling.once(), conn.cursor() as cur:
+                if FTS_TABLE in conn.introspection.table_names(cur):
+                    found = "sqlite"
+        elif conn.vendor == "postgresql":
+            found = "postgresql"
+        _backend_cache[using] = found
+    return _backend_cache[using]
+
+
+def ranks(q, using="default"):
+    """True se apply_search userà l'indice (e annoterà search_rank) per questa query."""
+    # senza termini utili (parole di una lettera, solo punteggiatura) si ripiega su icontains
+    return backend(using) is not None and bool(terms(q))
+
+
+def apply_search(qs, q, using="default"):
+    """Filtra per q; se c'è un indice annota `search_rank` (più basso = più rilevante).
+
+    Restituisce (queryset, ranked).
+    """
+    kind = backend(using)
+    if kind == "sqlite":
+        expr = fts5_expression(q)
+        if expr:
+            weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+            rank = RawSQL(
+                f"(SELECT bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = heritage_sito.id)",
+                (expr,),
+                output_field=FloatField(),
+            )
+            matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (expr,))
+            return qs.filter(id__in=matches).annotate(search_rank=rank), True
+    elif kind == "postgresql":
+        expr = tsquery_expression(q)
+        if expr:
+            match = RawSQL(
+                f"({PG_DOCUMENT}) @@ to_tsquery('{PG_CONFIG}', %s)", (expr,), output_field=BooleanField()
+            )
+            rank = RawSQL(
+                f"-ts_rank({PG_DOCUMENT}, to_tsquery('{PG_CONFIG}', %s))", (expr,), output_field=FloatField()
+            )
+            return qs.filter(match).annotate(search_rank=rank), True
+
+    return qs.filter(
+        Q(nome__icontains=q) | Q(citta__icontains=q) | Q(regione__icontains=q) | Q(descrizione__icontains=q)
+    ), False
+
+
+def matching_ids(q, using="default"):
+    """Id dei siti che corrispondono a q (per il catalogo in memoria)."""
+    from .models import Sito
+
+    qs, _ = apply_search(Sito.objects.all(), q, using)
+    return list(qs.values_list("id", flat=True))
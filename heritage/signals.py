@@ -0,0 +1,122 @@
+"""Segnali che mantengono allineati gli indici in memoria con il database."""
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import capacity, catalog, clusters, itinerari, nearby, tiles
+from .facets import facet_index
+from .features import feature_cache
+from .models import Accessibilita, Booking, Categoria, Itinerario, Sito, SitoVicino, Tappa
+from .versioning import bump_catalog_version
+
+
+@receiver(post_save, sender=Sito)
+def sito_salvato(sender, instance, **kwargs):
+    old, new = bump_catalog_version()
+    clusters.pyramid.upsert(
+        instance.pk, instance.longitudine, instance.latitudine, clusters.site_props(instance)
+    )
+    clusters.pyramid.advance(old, new)
+    feature_cache.discard([instance.pk])
+    feature_cache.advance(old, new)
+    facet_index.upsert(instance)
+    facet_index.advance(old, new)
+    catalog.invalidate()
+    coords_db = getattr(instance, "_coords_db", (None, None))
+    fields = kwargs.get("update_fields")
+    # con coordinate differite save() scrive solo i campi caricati (update_fields)
+    moved = (fields is None or bool({"latitudine", "longitudine"} & set(fields))) and instance.coords_changed
+    if coords_db is not None:
+        tiles.invalidate_point(coords_db[1], coords_db[0])
+        if moved:
+            tiles.invalidate_point(instance.longitudine, instance.latitudine)
+        tiles.advance(old, new)
+    elif not moved:
+        # coordinate non salvate: quelle del DB sono ancora valide
+        tiles.invalidate_point(instance.longitudine, instance.latitudine)
+        tiles.advance(old, new)
+    # altrimenti la posizione precedente è sconosciuta: nuova generazione di tessere (niente advance)
+    if moved:
+        nearby.update_for([instance.pk])
+    if "latitudine" in instance.__dict__ and "longitudine" in instance.__dict__:
+        instance._coords_db = (instance.latitudine, instance.longitudine)
+    if not kwargs.get("created"):
+        itinerari.refresh_rollup(itinerari.itinerari_di(sito_ids=[instance.pk]))
+
+
+@receiver(pre_delete, sender=Sito)
+def sito_in_eliminazione(sender, instance, **kwargs):
+    # dopo il CASCADE non si saprebbe più chi lo aveva tra i vicini
+    instance._vicino_di = list(SitoVicino.objects.filter(vicino=instance).values_list("sito_id", flat=True))
+
+
+@receiver(post_delete, sender=Sito)
+def sito_eliminato(sender, instance, **kwargs):
+    old, new = bump_catalog_version()
+    clusters.pyramid.remove(instance.pk)
+    clusters.pyramid.advance(old, new)
+    feature_cache.discard([instance.pk])
+    feature_cache.advance(old, new)
+    facet_index.remove(instance.pk)
+    facet_index.advance(old, new)
+    catalog.invalidate()
+    tiles.invalidate_point(instance.longitudine, instance.latitudine)
+    tiles.advance(old, new)
+    if getattr(instance, "_vicino_di", None):
+        nearby.update_for([], extra_ids=instance._vicino_di)
+
+
+@receiver([post_save, post_delete], sender=Categoria)
+def categoria_modificata(sender, instance, **kwargs):
+    bump_catalog_version()
+    clusters.pyramid.invalidate()
+    feature_cache.clear()
+    catalog.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Accessibilita)
+def accessibilita_modificata(sender, instance, **kwargs):
+    old, new = bump_catalog_version()
+    if instance.pk is not None:
+        feature_cache.discard(list(instance.siti.values_list("id", flat=True)))
+    if kwargs["signal"] is post_delete:
+        # i siti sono già stati scollegati (SET_NULL): non si sa più quali itinerari toccava
+        itinerari.refresh_rollup()
+    else:
+        itinerari.refresh_rollup(itinerari.itinerari_di(accessibilita_id=instance.pk))
+    feature_cache.advance(old, new)
+    catalog.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Itinerario)
+def itinerario_modificato(sender, instance, **kwargs):
+    # il GeoJSON in cache contiene nome e dati dell'itinerario
+    itinerari.invalidate(instance.pk)
+    if kwargs["signal"] is post_save and not kwargs.get("created"):
+        capacity.update_capacity(instance)
+
+
+@receiver([post_save, post_delete], sender=Tappa)
+def tappa_modificata(sender, instance, **kwargs):
+    itinerari.invalidate(instance.itinerario_id)
+    itinerari.refresh_rollup([instance.itinerario_id])
+
+
+@receiver(post_save, sender=Booking)
+def booking_salvata(sender, instance, **kwargs):
+    # BookingCreateView ha già occupato i posti (capacity.reserve); qui solo le
+    # prenotazioni create o modificate altrove (admin, shell)
+    current = (instance.itinerario_id, instance.data, instance.numero_persone)
+    previous = getattr(instance, "_posti_db", None)
+    if previous == current:
+        return
+    if previous is not None:
+        capacity.adjust(previous[0], previous[1], -previous[2])
+    capacity.adjust(*current[:2], current[2])
+    instance._posti_db = current
+
+
+@receiver(post_delete, sender=Booking)
+def booking_eliminata(sender, instance, **kwargs):
+    previous = getattr(instance, "_posti_db", None)
+    if previous is not None:
+        capacity.adjust(previous[0], previous[1], -previous[2])
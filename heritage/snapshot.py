@@ -0,0 +1,144 @@
+"""Snapshot colonnare del catalogo in un file NumPy ``.npz``.
+
+Ogni campo di ogni modello diventa un array ``"<Modello>.<campo>"``; i
+campi nulli hanno un array booleano ``"<Modello>.<campo>.null"`` a parte,
+così il file si legge senza pickle. Gli id vengono conservati: il
+caricamento ricrea le stesse relazioni con un bulk_create per modello,
+dentro un'unica transazione.
+
+Con ``replace`` le tabelle vengono svuotate con un DELETE ciascuna, senza
+segnali: indici, vicini e rollup si ricalcolano una sola volta alla fine.
+Le prenotazioni non fanno parte dello snapshot e non si possono
+ripristinare: se ce ne sono il caricamento si rifiuta, a meno di
+``drop_bookings``.
+"""
+import numpy as np
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from . import itinerari, nearby
+from .models import (
+    Accessibilita, Booking, Categoria, Itinerario, PostiPrenotati, PrenotazioneItinerario, Sito, SitoVicino, Tappa,
+)
+from .versioning import bump_catalog_version
+
+FORMAT_VERSION = 1
+
+# in ordine di dipendenza (il caricamento procede in quest'ordine)
+MODELS = [Categoria, Accessibilita, Sito, Itinerario, Tappa]
+# dipendono dal catalogo ma non sono nello snapshot
+DERIVED = [SitoVicino]
+BOOKINGS = [PostiPrenotati, PrenotazioneItinerario, Booking]
+
+INT_TYPES = {
+    "AutoField", "BigAutoField", "SmallAutoField", "IntegerField", "BigIntegerField",
+    "SmallIntegerField", "PositiveIntegerField", "PositiveSmallIntegerField",
+    "PositiveBigIntegerField", "ForeignKey", "OneToOneField",
+}
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _text(v):
+    if v is None:
+        return ""
+    return v.isoformat() if hasattr(v, "isoformat") else str(v)
+
+
+def _column(field, values):
+    """(array valori, maschera dei nulli o None) per un campo."""
+    kind = field.get_internal_type()
+    nulls = np.array([v is None for v in values], dtype=bool)
+    if kind in INT_TYPES:
+        arr = np.array([0 if v is None else v for v in values], dtype=np.int64)
+    elif kind == "FloatField":
+        arr = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    elif kind == "BooleanField":
+        arr = np.array([bool(v) for v in values], dtype=bool)
+    else:
+        # testo, date, decimali...: rappresentazione testuale
+        arr = np.array([_text(v) for v in values], dtype=str)
+    return arr, (nulls if nulls.any() else None)
+
+
+def dump(path):
+    """Scrive il catalogo in `path`; restituisce {modello: righe}."""
+    arrays = {"__format__": np.array(FORMAT_VERSION)}
+    counts = {}
+    for model in MODELS:
+        label = model.__name__
+        fields = model._meta.concrete_fields
+        rows = list(model.objects.order_by("pk").values_list(*[f.attname for f in fields]))
+        counts[label] = len(rows)
+        arrays[f"{label}.__rows__"] = np.array(len(rows))
+        columns = list(zip(*rows)) if rows else [() for _ in fields]
+        for field, values in zip(fields, columns):
+            arr, nulls = _column(field, values)
+            arrays[f"{label}.{field.attname}"] = arr
+            if nulls is not None:
+                arrays[f"{label}.{field.attname}.null"] = nulls
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    return counts
+
+
+def _objects(model, data):
+    label = model.__name__
+    n = int(data[f"{label}.__rows__"])
+    fields = [f for f in model._meta.concrete_fields if f"{label}.{f.attname}" in data]
+    columns = []
+    for field in fields:
+        values = data[f"{label}.{field.attname}"].tolist()
+        null_key = f"{label}.{field.attname}.null"
+        if null_key in data:
+            values = [None if isnull else v for v, isnull in zip(values, data[null_key].tolist())]
+        columns.append([None if v is None else field.to_python(v) for v in values])
+    for i in range(n):
+        yield model(**{f.attname: col[i] for f, col in zip(fields, columns)})
+
+
+def _wipe(models):
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)}")
+
+
+def load(path, replace=False, drop_bookings=False, batch_size=1000):
+    """Carica lo snapshot in un'unica transazione; restituisce {modello: righe}."""
+    with np.load(path, allow_pickle=False) as data:
+        if "__format__" not in data or int(data["__format__"]) != FORMAT_VERSION:
+            raise SnapshotError("formato dello snapshot non riconosciuto")
+
+        counts = {}
+        with transaction.atomic():
+            if replace:
+                booked = [m.__name__ for m in BOOKINGS if m.objects.exists()]
+                if booked and not drop_bookings:
+                    raise SnapshotError(
+                        f"prenotazioni presenti: {', '.join(booked)} (usa --drop-bookings per cancellarle)"
+                    )
+                # figli prima dei genitori
+                _wipe([Tappa, *DERIVED, *BOOKINGS, *reversed(MODELS[:-1])])
+            else:
+                occupied = [m.__name__ for m in MODELS if m.objects.exists()]
+                if occupied:
+                    raise SnapshotError(f"tabelle non vuote: {', '.join(occupied)} (usa --replace)")
+
+            for model in MODELS:
+                objs = model.objects.bulk_create(_objects(model, data), batch_size=batch_size)
+                counts[model.__name__] = len(objs)
+
+            # gli id sono espliciti: riallinea le sequenze (PostgreSQL, Oracle)
+            sql = connection.ops.sequence_reset_sql(no_style(), MODELS)
+            if sql:
+                with connection.cursor() as cursor:
+                    for statement in sql:
+                        cursor.execute(statement)
+
+    # bulk_create non invia segnali: invalida a mano cache e indici in memoria
+    bump_catalog_version()
+    nearby.rebuild()
+    itinerari.refresh_rollup()
+    return counts
@@ -0,0 +1,120 @@
+"""Query spaziali sui Siti: filtro per viewport (bbox/zoom) su indice R*Tree."""
+import math
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from . import profiling
+
+# Tabella virtuale R*Tree creata dalla migrazione 0009 (solo SQLite),
+# tenuta allineata a heritage_sito tramite trigger.
+RTREE_TABLE = "heritage_sito_rtree"
+
+# Margine (in pixel) aggiunto al viewport: i marker a cavallo del bordo
+# restano visibili durante il pan.
+MARKER_PAD_PX = 32
+MAX_ZOOM = 22
+
+_rtree_cache = {}
+
+
+class BBoxError(ValueError):
+    pass
+
+
+def rtree_available(using="default") -> bool:
+    """True se il DB è SQLite e la tabella R*Tree esiste."""
+    if using not in _rtree_cache:
+        conn = connections[using]
+        ok = False
+        if conn.vendor == "sqlite":
+            with profiling.once(), conn.cursor() as cur:
+                ok = RTREE_TABLE in conn.introspection.table_names(cur)
+        _rtree_cache[using] = ok
+    return _rtree_cache[using]
+
+
+def parse_bbox(value):
+    """Converte 'minLon,minLat,maxLon,maxLat' in tupla di float (None se assente)."""
+    s = (value or "").strip()
+    if not s:
+        return None
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(p) for p in s.split(","))
+    except ValueError:
+        raise BBoxError("bbox deve essere 'minLon,minLat,maxLon,maxLat'")
+    if not all(math.isfinite(v) for v in (min_lon, min_lat, max_lon, max_lat)):
+        raise BBoxError("bbox contiene valori non finiti")
+    if min_lat > max_lat:
+        raise BBoxError("bbox: minLat maggiore di maxLat")
+    # Leaflet può restituire longitudini oltre ±180 dopo più giri del mondo
+    if max_lon - min_lon >= 360:
+        min_lon, max_lon = -180.0, 180.0
+    else:
+        min_lon = _wrap_lon(min_lon)
+        max_lon = _wrap_lon(max_lon)
+    return (min_lon, max(-90.0, min_lat), max_lon, min(90.0, max_lat))
+
+
+def parse_zoom(value):
+    """Zoom della mappa (0..MAX_ZOOM) o None."""
+    try:
+        return max(0, min(int(value), MAX_ZOOM))
+    except (TypeError, ValueError):
+        return None
+
+
+def pad_bbox(bbox, zoom):
+    """Allarga il bbox di MARKER_PAD_PX pixel al livello di zoom indicato."""
+    if bbox is None or zoom is None:
+        return bbox
+    pad = MARKER_PAD_PX * 360.0 / (256 * 2 ** zoom)
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon <= max_lon and (max_lon - min_lon) + 2 * pad >= 360:
+        min_lon, max_lon = -180.0, 180.0
+    else:
+        min_lon = _wrap_lon(min_lon - pad)
+        max_lon = _wrap_lon(max_lon + pad)
+    return (min_lon, max(-90.0, min_lat - pad), max_lon, min(90.0, max_lat + pad))
+
+
+def _wrap_lon(lon):
+    if -180.0 <= lon <= 180.0:
+        return lon
+    return ((lon + 180.0) % 360.0) - 180.0
+
+
+def _lon_ranges(bbox):
+    """Uno o due intervalli di longitudine (bbox che attraversa l'antimeridiano)."""
+    min_lon, _, max_lon, _ = bbox
+    if min_lon <= max_lon:
+        return [(min_lon, max_lon)]
+    return [(min_lon, 180.0), (-180.0, max_lon)]
+
+
+def filter_bbox(qs, bbox, using="default"):
+    """Restringe il queryset ai Siti dentro il bbox (range lookup sull'indice)."""
+    if bbox is None:
+        return qs
+    _, min_lat, _, max_lat = bbox
+    ranges = _lon_ranges(bbox)
+
+    exact = Q()
+    for lo, hi in ranges:
+        exact |= Q(longitudine__gte=lo, longitudine__lte=hi)
+    exact &= Q(latitudine__gte=min_lat, latitudine__lte=max_lat)
+
+    if not rtree_available(using):
+        # fallback: indice composto (latitudine, longitudine)
+        return qs.filter(exact)
+
+    where = " OR ".join(["(max_lon >= %s AND min_lon <= %s)"] * len(ranges))
+    params = [v for r in ranges for v in r] + [min_lat, max_lat]
+    candidates = RawSQL(
+        f"SELECT id FROM {RTREE_TABLE} WHERE ({where}) AND max_lat >= %s AND min_lat <= %s",
+        params,
+    )
+    # L'R*Tree memorizza float a 32 bit arrotondati verso l'esterno:
+    # il filtro esatto scarta i pochi candidati appena fuori dal bordo.
+    return qs.filter(id__in=candidates).filter(exact)
@@ -0,0 +1,115 @@
+"""Indice di autocompletamento in memoria (trie dei prefissi).
+
+Indicizza nomi dei siti, città e regioni a partire dall'inizio del testo e
+da ogni inizio di parola ("lag" trova "Venice and its Lagoon"). Ogni nodo
+conserva i migliori risultati del proprio sotto-albero, quindi una query è
+una discesa di len(prefisso) nodi, senza database.
+"""
+import threading
+
+from .search import normalize
+from .versioning import catalog_version
+
+MAX_DEPTH = 16  # oltre questa profondità i nodi tengono tutte le voci
+TOP_K = 10
+
+# peso per tipo di voce: a parità di prefisso i siti vengono prima
+KIND_WEIGHT = {"sito": 0, "citta": 1, "regione": 2}
+
+
+class _Node:
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children = {}
+        self.top = []  # [(score, id voce)] ordinati, al massimo TOP_K (illimitati a MAX_DEPTH)
+
+
+class SuggestIndex:
+    def __init__(self, entries):
+        """entries: lista di (label, kind, site_id o None)."""
+        self.entries = entries
+        self.root = _Node()
+        for eid, (label, kind, _) in enumerate(entries):
+            text = normalize(label)
+            base = (KIND_WEIGHT.get(kind, 9), len(text))
+            for start in self._word_starts(text):
+                # le corrispondenze a inizio testo valgono più di quelle interne
+                self._insert(text[start:start + MAX_DEPTH], (start > 0, *base, eid), eid)
+
+    @staticmethod
+    def _word_starts(text):
+        return [i for i, c in enumerate(text) if c.isalnum() and (i == 0 or not text[i - 1].isalnum())]
+
+    def _insert(self, key, score, eid):
+        node = self.root
+        for depth, ch in enumerate(key, start=1):
+            node = node.children.setdefault(ch, _Node())
+            self._offer(node, score, eid, bounded=depth < MAX_DEPTH)
+
+    @staticmethod
+    def _offer(node, score, eid, bounded):
+        top = node.top
+        for i, (s, e) in enumerate(top):
+            if e == eid:
+                if score < s:
+                    top[i] = (score, eid)
+                    top.sort()
+                return
+        if bounded and len(top) >= TOP_K and score >= top[-1][0]:
+            return
+        top.append((score, eid))
+        top.sort()
+        if bounded and len(top) > TOP_K:
+            top.pop()
+
+    def query(self, prefix, k=8):
+        text = normalize(prefix).strip()
+        if not text:
+            return []
+        node = self.root
+        for ch in text[:MAX_DEPTH]:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        out = []
+        for _, eid in node.top:
+            label, kind, site_id = self.entries[eid]
+            # oltre MAX_DEPTH serve un controllo sul testo completo
+            if len(text) > MAX_DEPTH and text not in normalize(label):
+                continue
+            out.append({"label": label, "kind": kind, "id": site_id})
+            if len(out) >= k:
+                break
+        return out
+
+
+_lock = threading.Lock()
+_index = None
+_version = None
+
+
+def _load_entries():
+    from .models import Sito
+
+    entries, cities, regions = [], set(), set()
+    for pk, nome, citta, regione in Sito.objects.order_by("id").values_list("id", "nome", "citta", "regione"):
+        entries.append((nome, "sito", pk))
+        if citta:
+            cities.add(citta)
+        if regione:
+            regions.add(regione)
+    entries += [(c, "citta", None) for c in sorted(cities)]
+    entries += [(r, "regione", None) for r in sorted(regions)]
+    return entries
+
+
+def get_index():
+    """Indice costruito al primo utilizzo e ricostruito quando il dataset cambia."""
+    global _index, _version
+    version = catalog_version()
+    with _lock:
+        if _index is None or _version != version:
+            _index = SuggestIndex(_load_entries())
+            _version = version
+        return _index
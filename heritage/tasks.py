@@ -0,0 +1,40 @@
+"""Lavori registrati nella coda (heritage.jobs); importato da apps.ready."""
+from django.conf import settings
+from django.core.mail import send_mail
+from django.core.management import call_command
+
+from . import nearby
+from .jobs import task
+
+
+@task("booking.conferma", max_tentativi=5)
+def conferma_prenotazione(booking_id):
+    from .models import Booking
+
+    booking = Booking.objects.select_related("itinerario").filter(pk=booking_id).first()
+    if booking is None:  # cancellata prima dell'invio
+        return
+    send_mail(
+        f"Conferma prenotazione: {booking.itinerario.nome}",
+        (
+            f"Ciao {booking.nome},\n\n"
+            f"la tua prenotazione per «{booking.itinerario.nome}» il {booking.data:%d/%m/%Y} "
+            f"per {booking.numero_persone} persone è confermata.\n"
+        ),
+        getattr(settings, "DEFAULT_FROM_EMAIL", None),
+        [booking.email],
+    )
+
+
+@task("nearby.rebuild")
+def ricalcola_vicini():
+    nearby.rebuild()
+
+
+@task("comando", max_tentativi=1)
+def esegui_comando(nome, args=()):
+    """Un comando di gestione pesante (es. import) eseguito dal worker invece che in primo piano.
+
+    Le modifiche incrementano la versione nel DB: i processi web ricostruiscono i propri indici.
+    """
+    call_command(nome, *args)
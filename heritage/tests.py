@@ -1,4 +1,17 @@
-from django.test import TestCase
+import asyncio
+import json
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.core.handlers.asgi import ASGIHandler
+from django.test import TestCase, TransactionTestCase, override_settings
+from heritage import clusters
+from heritage.features import stream_collection
+from heritage.profiling import QueryBudgetExceeded, QueryBudgetMixin
+from heritage.suggest import SuggestIndex
 from heritage.models import Categoria, Accessibilita, Sito
 
 class APITests(TestCase):
@@ -20,10 +33,1343 @@ class APITests(TestCase):
         self.assertTrue(data["features"])
         self.assertIn("count",data)
 
-    def test_accessibility_any_mode(client, db, sito_factory, acc_factory):
-     a1 = acc_factory(sedia_a_rotelle=True, ausili_visivi=None, supporto_uditivo=None)
-     s1 = sito_factory(accessibilita=a1)
-     res = client.get("/api/sites.geojson?wheelchair=1&acc_mode=any")
-     assert res.status_code == 200
-     data = res.json()
-     assert data["count"] >= 1
+    def test_accessibility_any_mode(self):
+        acc = Accessibilita.objects.create(sedia_a_rotelle=True, ausili_visivi=None, supporto_uditivo=None)
+        Sito.objects.create(nome="Solo sedia", regione="Lazio", citta="Roma", accessibilita=acc, unesco_id="TEST2")
+        res = self.client.get("/api/sites.geojson?wheelchair=1&acc_mode=any")
+        self.assertEqual(res.status_code, 200)
+        self.assertGreaterEqual(res.json()["count"], 2)
+
+
+class ViewportTests(TestCase):
+    def setUp(self):
+        self.roma = Sito.objects.create(
+            nome="Roma", regione="Lazio", citta="Roma",
+            latitudine=41.9, longitudine=12.49, unesco_id="VP1",
+        )
+        Sito.objects.create(
+            nome="Milano", regione="Lombardia", citta="Milano",
+            latitudine=45.46, longitudine=9.17, unesco_id="VP2",
+        )
+
+    def test_bbox_returns_only_visible_sites(self):
+        r = self.client.get("/api/sites.geojson", {"bbox": "12,41,13,42", "zoom": "8"})
+        self.assertEqual(r.status_code, 200)
+        names = [f["properties"]["name"] for f in r.json()["features"]]
+        self.assertEqual(names, ["Roma"])
+
+    def test_bbox_follows_coordinate_updates(self):
+        Sito.objects.filter(pk=self.roma.pk).update(latitudine=45.4, longitudine=9.2)
+        r = self.client.get("/api/sites.geojson", {"bbox": "9,45,10,46"})
+        self.assertEqual(r.json()["count"], 2)
+
+    def test_invalid_bbox(self):
+        r = self.client.get("/api/sites.geojson", {"bbox": "12,41,13"})
+        self.assertEqual(r.status_code, 400)
+
+
+class CatalogVersionTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        Sito.objects.create(nome="Colosseo", latitudine=41.89, longitudine=12.49, unesco_id="V1")
+
+    def test_bump_from_another_process_is_seen(self):
+        from django.core.cache import cache
+        from django.db.models import F
+
+        from heritage import versioning
+        from heritage.models import CatalogVersion
+
+        etag = self.client.get("/api/sites.geojson")["ETag"]
+        # come un comando di import in un altro processo: niente segnali, solo il contatore nel DB
+        Sito.objects.update(nome="Anfiteatro Flavio")
+        CatalogVersion.objects.update(valore=F("valore") + 1)
+        cache.delete(versioning.CACHE_KEY)  # chiave scaduta (TTL) o aggiornata dall'altro processo
+        resp = self.client.get("/api/sites.geojson", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Anfiteatro Flavio", resp.content.decode())
+
+    def test_read_from_cache_not_from_db(self):
+        from django.core.cache import cache
+
+        from heritage import versioning
+
+        cache.delete(versioning.CACHE_KEY)
+        _, first = self.profiled_get("/api/sites.geojson")
+        _, second = self.profiled_get("/api/sites.geojson")
+        reads = [sql for sql, _, _ in first.once + first.queries + second.once + second.queries
+                 if "heritage_catalogversion" in sql]
+        self.assertEqual(len(reads), 1)
+
+    def test_cache_updated_on_commit(self):
+        from django.core.cache import cache
+
+        from heritage import versioning
+
+        with self.captureOnCommitCallbacks(execute=True):
+            _, new = versioning.bump_catalog_version()
+            self.assertNotEqual(cache.get(versioning.CACHE_KEY), new)
+        self.assertEqual(cache.get(versioning.CACHE_KEY), new)
+
+    def test_batch_bumps_once(self):
+        from heritage.versioning import batch, bump_catalog_version, catalog_version
+
+        before = catalog_version()
+        with batch():
+            old, new = bump_catalog_version()
+            self.assertEqual(bump_catalog_version(), (new, new))
+        self.assertEqual((old, catalog_version()), (before, new))
+
+
+class ClusterTests(TestCase):
+    def setUp(self):
+        clusters.pyramid.invalidate()
+        for i, (lat, lng) in enumerate([(41.90, 12.49), (41.91, 12.50), (45.46, 9.17)]):
+            Sito.objects.create(
+                nome=f"Sito {i}", regione="R", citta="C",
+                latitudine=lat, longitudine=lng, unesco_id=f"CL{i}",
+            )
+
+    def test_clusters_per_zoom(self):
+        r = self.client.get("/api/sites/clusters", {"zoom": "5"})
+        self.assertEqual(r.status_code, 200)
+        counts = sorted(f["properties"].get("point_count", 1) for f in r.json()["features"])
+        self.assertEqual(counts, [1, 2])
+
+        r = self.client.get("/api/sites/clusters", {"zoom": "16"})
+        self.assertEqual(len(r.json()["features"]), 3)
+
+    def test_pyramid_updated_on_save(self):
+        self.client.get("/api/sites/clusters", {"zoom": "5"})
+        s = Sito.objects.get(unesco_id="CL2")
+        s.latitudine, s.longitudine = 41.905, 12.495
+        s.save()
+        r = self.client.get("/api/sites/clusters", {"zoom": "5", "bbox": "12,41,13,42"})
+        self.assertEqual([f["properties"]["point_count"] for f in r.json()["features"]], [3])
+
+    def test_zoom_required(self):
+        self.assertEqual(self.client.get("/api/sites/clusters").status_code, 400)
+
+    def test_query_rebuilds_after_concurrent_invalidation(self):
+        clusters.get_pyramid()
+        clusters.pyramid.invalidate()  # come un segnale arrivato da un altro thread
+        self.assertIsNone(clusters.pyramid.query(5))
+        self.assertEqual(len(clusters.query(16)), 3)
+
+
+@override_settings(HERITAGE_CATALOG_ENGINE="numpy")
+class CatalogEngineTests(TestCase):
+    def setUp(self):
+        cult = Categoria.objects.create(nome="Culturale")
+        nat = Categoria.objects.create(nome="Naturale")
+        rows = [
+            ("Colosseo", "Roma", "Lazio", cult, (True, None, False)),
+            ("Dolomiti", "Belluno", "Veneto", nat, (False, True, None)),
+            ("Pompei", "Napoli", "Campania", cult, None),
+        ]
+        for i, (nome, citta, regione, cat, acc) in enumerate(rows):
+            a = None
+            if acc:
+                a = Accessibilita.objects.create(
+                    sedia_a_rotelle=acc[0], ausili_visivi=acc[1], supporto_uditivo=acc[2]
+                )
+            Sito.objects.create(
+                nome=nome, citta=citta, regione=regione, categoria=cat, accessibilita=a,
+                latitudine=41 + i, longitudine=12 + i, unesco_id=f"CE{i}",
+            )
+
+    def names(self, **params):
+        r = self.client.get("/api/sites.geojson", params)
+        self.assertEqual(r.status_code, 200)
+        return sorted(f["properties"]["name"] for f in r.json()["features"])
+
+    def test_matches_orm_filters(self):
+        cases = [
+            {"q": "rom"},
+            {"categoria": "cultural"},
+            {"regione": "veneto"},
+            {"wheelchair": "1", "ausili_visivi": "1"},
+            {"wheelchair": "1", "ausili_visivi": "1", "acc_mode": "all"},
+            {"supporto_uditivo": "0"},
+            {"has_acc_data": "1"},
+            {"bbox": "11.5,40.5,13.5,42.5"},
+        ]
+        for params in cases:
+            with self.settings(HERITAGE_CATALOG_ENGINE="orm"):
+                expected = self.names(**params)
+            self.assertEqual(self.names(**params), expected, params)
+
+    def test_invalidated_on_save(self):
+        self.names(q="pompei")
+        s = Sito.objects.get(unesco_id="CE2")
+        s.nome = "Ercolano"
+        s.save()
+        self.assertEqual(self.names(q="ercolano"), ["Ercolano"])
+
+
+class ETagTests(TestCase):
+    def setUp(self):
+        self.sito = Sito.objects.create(
+            nome="Assisi", regione="Umbria", citta="Assisi",
+            latitudine=43.07, longitudine=12.61, unesco_id="ET1",
+        )
+
+    def test_not_modified_until_site_changes(self):
+        r = self.client.get("/api/sites.geojson")
+        etag = r["ETag"]
+        self.assertEqual(r.json()["features"][0]["properties"]["name"], "Assisi")
+
+        r = self.client.get("/api/sites.geojson", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+
+        self.sito.nome = "Assisi e Basilica"
+        self.sito.save()
+        r = self.client.get("/api/sites.geojson", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()["features"][0]["properties"]["name"], "Assisi e Basilica")
+
+    def test_accessibility_change_refreshes_cached_feature(self):
+        acc = Accessibilita.objects.create(sedia_a_rotelle=False)
+        self.sito.accessibilita = acc
+        self.sito.save()
+        self.client.get("/api/sites.geojson")
+        acc.sedia_a_rotelle = True
+        acc.save()
+        props = self.client.get("/api/sites.geojson").json()["features"][0]["properties"]
+        self.assertIs(props["acc"]["sedia_a_rotelle"], True)
+        self.assertIs(props["acc"]["any_true"], True)
+
+
+class ExportTests(TestCase):
+    def test_streamed_export_has_all_features_and_bbox(self):
+        for i in range(5):
+            Sito.objects.create(
+                nome=f"Export {i}", regione="R", citta="C",
+                latitudine=40 + i, longitudine=10 + i, unesco_id=f"EX{i}",
+            )
+        Sito.objects.create(nome="Senza coordinate", regione="R", citta="C", unesco_id="EXN")
+        r = self.client.get("/api/sites/export.geojson")
+        self.assertTrue(r.streaming)
+        data = json.loads(b"".join(r.streaming_content))
+        self.assertEqual(data["count"], 5)
+        self.assertEqual(len(data["features"]), 5)
+        self.assertEqual(data["bbox"], [10, 40, 14, 44])
+
+    def test_stream_flushes_in_chunks(self):
+        rows = [
+            Sito(id=i, nome=f"S{i}", regione="", citta="", latitudine=1.0, longitudine=2.0, unesco_id=str(i))
+            for i in range(7)
+        ]
+        chunks = list(stream_collection(rows, flush_every=3))
+        data = json.loads(b"".join(chunks))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual([f["properties"]["id"] for f in data["features"]], list(range(7)))
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        for i, nome in enumerate(["Delta", "Alfa", "Echo", "Charlie", "Bravo"]):
+            Sito.objects.create(
+                nome=nome, regione="R", citta="C",
+                latitudine=40 + i, longitudine=10 + i, unesco_id=f"CP{i}",
+            )
+
+    def walk(self, **params):
+        names, cursor, pages = [], None, 0
+        while True:
+            q = dict(params, limit=2)
+            if cursor:
+                q["cursor"] = cursor
+            data = self.client.get("/api/sites.geojson", q).json()
+            names += [f["properties"]["name"] for f in data["features"]]
+            pages += 1
+            cursor = data["next"]
+            if not cursor:
+                return names, data, pages
+
+    def test_walks_all_pages_by_sort_key(self):
+        names, last, pages = self.walk(sort="nome")
+        self.assertEqual(names, ["Alfa", "Bravo", "Charlie", "Delta", "Echo"])
+        self.assertEqual(pages, 3)
+
+        prev = self.client.get("/api/sites.geojson", {"sort": "nome", "limit": 2, "cursor": last["prev"]}).json()
+        self.assertEqual([f["properties"]["name"] for f in prev["features"]], ["Charlie", "Delta"])
+
+        names, _, _ = self.walk(sort="-nome")
+        self.assertEqual(names, ["Echo", "Delta", "Charlie", "Bravo", "Alfa"])
+
+    def test_walks_by_id_with_catalog_engine(self):
+        expected, _, _ = self.walk()
+        with self.settings(HERITAGE_CATALOG_ENGINE="numpy"):
+            names, last, _ = self.walk()
+        self.assertEqual(names, expected)
+        self.assertIsNotNone(last["prev"])
+
+    def test_count_modes(self):
+        r = self.client.get("/api/sites.geojson", {"count": "none"}).json()
+        self.assertIsNone(r["count"])
+        r = self.client.get("/api/sites.geojson", {"count": "estimate"}).json()
+        self.assertEqual(r["count"], 5)
+
+    def test_cursor_must_match_sort(self):
+        data = self.client.get("/api/sites.geojson", {"sort": "nome", "limit": 2}).json()
+        r = self.client.get("/api/sites.geojson", {"sort": "citta", "cursor": data["next"]})
+        self.assertEqual(r.status_code, 400)
+
+
+class FullTextSearchTests(TestCase):
+    def setUp(self):
+        rows = [
+            ("The Sassi and the Park of the Rupestrian Churches of Matera", "Matera", "Cave dwellings."),
+            ("Historic Centre of Florence", "Province of Firenze", "Symbol of the Renaissance."),
+            ("Val d'Orcia", "Siena", "Landscape with Renaissance churches and farms."),
+            ("Città di Verona", "Verona", "Roman amphitheatre."),
+        ]
+        for i, (nome, citta, descr) in enumerate(rows):
+            Sito.objects.create(
+                nome=nome, citta=citta, regione="Europe", descrizione=descr,
+                latitudine=40 + i, longitudine=10 + i, unesco_id=f"FT{i}",
+            )
+
+    def names(self, **params):
+        r = self.client.get("/api/sites.geojson", params)
+        self.assertEqual(r.status_code, 200)
+        return [f["properties"]["name"] for f in r.json()["features"]]
+
+    def test_italian_query_matches_english_names_ranked_by_index(self):
+        self.assertEqual(self.names(q="chiese"), [
+            "The Sassi and the Park of the Rupestrian Churches of Matera",
+            "Val d'Orcia",
+        ])
+        self.assertEqual(self.names(q="firenze"), ["Historic Centre of Florence"])
+        self.assertEqual(self.names(q="citta"), ["Città di Verona"])
+
+    def test_description_is_searchable_and_index_follows_updates(self):
+        self.assertEqual(self.names(q="amphitheatre"), ["Città di Verona"])
+        Sito.objects.filter(unesco_id="FT3").update(descrizione="Arena.")
+        self.assertEqual(self.names(q="amphitheatre"), [])
+
+    def test_rank_cursor(self):
+        data = self.client.get("/api/sites.geojson", {"q": "renaissance", "limit": 1}).json()
+        page2 = self.client.get("/api/sites.geojson", {"q": "renaissance", "limit": 1, "cursor": data["next"]}).json()
+        names = [f["properties"]["name"] for f in data["features"] + page2["features"]]
+        self.assertCountEqual(names, ["Historic Centre of Florence", "Val d'Orcia"])
+        self.assertIsNone(page2["next"])
+
+    def test_queries_without_indexable_terms_fall_back_to_icontains(self):
+        # parole di una lettera o solo punteggiatura: nessun termine FTS, ordinamento per id
+        self.assertEqual(len(self.names(q="a")), 4)
+        self.assertEqual(self.names(q="à"), ["Città di Verona"])
+        self.assertEqual(self.names(q="'"), ["Val d'Orcia"])
+        self.assertEqual(self.names(q="x y"), [])
+        for q in ("a", "'"):
+            r = self.client.get("/api/async/sites.geojson", {"q": q})
+            self.assertEqual(r.status_code, 200, q)
+
+
+class SuggestTests(TestCase):
+    def test_prefix_and_word_start_matches(self):
+        index = SuggestIndex([
+            ("Venice and its Lagoon", "sito", 1),
+            ("Historic Centre of Verona", "sito", 2),
+            ("Veneto", "regione", None),
+            ("Città di Verona", "sito", 3),
+        ])
+        self.assertEqual([s["label"] for s in index.query("ven")], ["Venice and its Lagoon", "Veneto"])
+        self.assertEqual([s["id"] for s in index.query("lag")], [1])
+        self.assertEqual([s["id"] for s in index.query("citta")], [3])
+        # a parità di posizione vince l'etichetta più corta
+        self.assertEqual([s["id"] for s in index.query("ver", k=1)], [3])
+
+    def test_endpoint_refreshes_after_save(self):
+        Sito.objects.create(nome="Mount Etna", regione="Sicily", citta="Catania", unesco_id="SG1")
+        data = self.client.get("/api/sites/suggest", {"q": "etn"}).json()
+        self.assertEqual([s["label"] for s in data["suggestions"]], ["Mount Etna"])
+        Sito.objects.create(nome="Etruscan Necropolises", regione="Lazio", citta="Cerveteri", unesco_id="SG2")
+        data = self.client.get("/api/sites/suggest", {"q": "et"}).json()
+        self.assertEqual([s["label"] for s in data["suggestions"]], ["Etruscan Necropolises", "Mount Etna"])
+
+
+SAMPLE_CSV = Path(settings.BASE_DIR) / "unesco_italia_access_complete.csv"
+
+
+class ImportSitesTests(TestCase):
+    def run_import(self, *args):
+        out = StringIO()
+        call_command("import_sites", str(SAMPLE_CSV), *args, stdout=out)
+        return out.getvalue()
+
+    def test_bulk_import_is_idempotent(self):
+        # 9 query per l'import + 2 per la versione + 9 per la tabella dei vicini + 1 per il riepilogo itinerari
+        with self.assertNumQueries(21):
+            out = self.run_import()
+        self.assertIn("Creati: 60", out)
+        self.assertEqual(Sito.objects.count(), 60)
+        self.assertEqual(Sito.objects.get(unesco_id="394").nome, "Venice and its Lagoon")
+
+        out = self.run_import()
+        self.assertIn("Creati: 0 | Aggiornati: 0 | Invariati: 60", out)
+
+    def test_failed_batch_still_refreshes_committed_batches(self):
+        from heritage import nearby
+        from heritage.management.commands import import_sites
+        from heritage.versioning import catalog_version
+
+        build = import_sites.Command.build_sito
+        calls = []
+
+        def fail_on_second_batch(cmd, rec, values):
+            calls.append(rec["unesco_id"])
+            if len(calls) > 20:
+                raise RuntimeError("disco pieno")
+            return build(cmd, rec, values)
+
+        before = catalog_version()
+        with mock.patch.object(import_sites.Command, "build_sito", fail_on_second_batch), \
+                mock.patch.object(nearby, "rebuild") as rebuild:
+            with self.assertRaises(RuntimeError):
+                self.run_import("--batch-size", "20", "--workers", "1")
+        self.assertEqual(Sito.objects.count(), 20)
+        self.assertGreater(catalog_version(), before)
+        rebuild.assert_called_once_with()
+
+    def test_dry_run_reports_diff_without_writing(self):
+        self.run_import()
+        Sito.objects.filter(unesco_id="394").update(nome="Venezia")
+        out = self.run_import("--dry-run")
+        self.assertIn("~ 394: Venice and its Lagoon", out)
+        self.assertIn("Da creare: 0 | Da aggiornare: 1 | Invariati: 59", out)
+        self.assertEqual(Sito.objects.get(unesco_id="394").nome, "Venezia")
+
+
+class IngestPipelineTests(TestCase):
+    def test_chunks_split_on_record_boundaries(self):
+        import csv
+        from heritage.ingest import parse_range, split_ranges
+
+        header, ranges = split_ranges(SAMPLE_CSV, chunk_bytes=2048)
+        self.assertGreater(len(ranges), 1)
+        self.assertEqual(header[0], "unesco_id")
+        ids = []
+        for start, end in ranges:
+            records, _, _ = parse_range((str(SAMPLE_CSV), start, end, header, lambda row: row["unesco_id"]))
+            ids += records
+        with open(SAMPLE_CSV, newline="", encoding="utf-8") as f:
+            self.assertEqual(ids, [row["unesco_id"] for row in csv.DictReader(f)])
+
+    def test_parallel_parse_matches_serial(self):
+        from heritage.ingest import Pipeline, normalize_site_row
+
+        def collect(workers):
+            out = []
+            stats = Pipeline(
+                str(SAMPLE_CSV), normalize_site_row, workers=workers, chunk_bytes=4096, batch_size=7
+            ).run(out.extend)
+            return out, stats
+
+        serial, stats = collect(1)
+        parallel, _ = collect(2)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(stats.rows, 60)
+        self.assertEqual(stats.batches, 9)
+
+    def test_import_access_updates_in_batches(self):
+        call_command("import_sites", str(SAMPLE_CSV), stdout=StringIO())
+        Sito.objects.filter(unesco_id="394").update(accessibilita=None)
+        out = StringIO()
+        call_command("import_access", str(SAMPLE_CSV), "--batch-size", "25", stdout=out)
+        self.assertIn("Create: 1 | Aggiornate: 0 | Invariate: 59", out.getvalue())
+        self.assertIsNotNone(Sito.objects.get(unesco_id="394").accessibilita)
+
+    def test_legacy_rows_out_of_range_are_rejected_before_the_db(self):
+        from heritage.ingest import Reject, normalize_legacy_row
+
+        self.assertIsNone(normalize_legacy_row({"unesco_id": "1", "lat": "", "long": ""})["latitudine"])
+        for lat, lng in (("95", "9"), ("45", "-181")):
+            with self.assertRaisesMessage(Reject, "coord fuori intervallo"):
+                normalize_legacy_row({"unesco_id": "1", "lat": lat, "long": lng})
+
+
+class DeltaImportTests(TestCase):
+    def setUp(self):
+        import tempfile
+
+        call_command("import_sites", str(SAMPLE_CSV), stdout=StringIO())
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "access.csv"
+        self.path.write_bytes(SAMPLE_CSV.read_bytes())
+
+    def run_import(self, *args):
+        out = StringIO()
+        call_command("import_access", str(self.path), *args, stdout=out)
+        return out.getvalue()
+
+    def test_unchanged_file_is_skipped(self):
+        self.run_import()
+        with self.assertNumQueries(1):
+            out = self.run_import()
+        self.assertIn("File invariato", out)
+
+    def test_only_changed_rows_are_applied(self):
+        import csv
+
+        self.run_import()
+        with open(self.path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        row = next(r for r in rows if r["unesco_id"] == "394")
+        row["wheelchair"] = "0" if row["wheelchair"] == "1" else "1"
+        with open(self.path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+        out = self.run_import()
+        self.assertIn("Aggiornate: 1 | Invariate: 59", out)
+        acc = Sito.objects.get(unesco_id="394").accessibilita
+        self.assertEqual(acc.sedia_a_rotelle, row["wheelchair"] == "1")
+
+
+class MappedCSVTests(TestCase):
+    def write_csv(self, text):
+        import tempfile
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "od.csv"
+        path.write_bytes(text.encode("utf-8"))
+        return path
+
+    def test_projection_and_filter(self):
+        from heritage.csvmap import MappedCSV
+
+        path = self.write_csv(
+            "id;site;states_name_en;lat\r\n"
+            '1;"Roma; centro\r\nstorico";Italy;41,9\r\n'
+            "2;Paris;France;48.8\r\n"
+            "3;Vaticano;Italy,Holy See;41.9\r\n"
+        )
+        with MappedCSV(path, delimiter=";") as f:
+            self.assertEqual(
+                list(f.rows(["site", "id"], where={"states_name_en": "Italy"})),
+                [("Roma; centro\r\nstorico", "1")],
+            )
+            italia = f.rows(["id"], where={"states_name_en": lambda v: "Italy" in v.split(",")}, prefilter=b"Italy")
+            self.assertEqual([r[0] for r in italia], ["1", "3"])
+
+            rec = f.records(["id", "lat"], dtypes={"id": int, "lat": float})
+            self.assertEqual(rec.id.tolist(), [1, 2, 3])
+            self.assertAlmostEqual(float(rec.lat[0]), 41.9)
+
+
+class SnapshotTests(TestCase):
+    def test_dump_and_load_roundtrip(self):
+        import tempfile
+        from heritage.models import Itinerario, Tappa
+
+        call_command("import_sites", str(SAMPLE_CSV), stdout=StringIO())
+        Sito.objects.filter(unesco_id="394").update(latitudine=None, longitudine=None)
+        it = Itinerario.objects.create(nome="Nord")
+        Tappa.objects.create(itinerario=it, sito=Sito.objects.get(unesco_id="394"), ordine=1)
+        before = list(Sito.objects.order_by("id").values())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / "catalog.npz")
+            call_command("dump_catalog", path, stdout=StringIO())
+            with self.assertRaisesMessage(CommandError, "tabelle non vuote"):
+                call_command("load_catalog", path, stdout=StringIO())
+            out = StringIO()
+            call_command("load_catalog", path, "--replace", stdout=out)
+
+        self.assertIn("Sito: 60", out.getvalue())
+        self.assertEqual(list(Sito.objects.order_by("id").values()), before)
+        self.assertEqual(Tappa.objects.get().sito.unesco_id, "394")
+        self.assertEqual(Itinerario.objects.create(nome="Sud").pk, it.pk + 1)
+
+    def test_replace_keeps_bookings_unless_asked_and_skips_signals(self):
+        import datetime
+        import tempfile
+
+        from heritage import nearby
+        from heritage.models import Booking, Itinerario, Tappa
+
+        call_command("import_sites", str(SAMPLE_CSV), stdout=StringIO())
+        it = Itinerario.objects.create(nome="Nord")
+        Tappa.objects.create(itinerario=it, sito=Sito.objects.first(), ordine=1)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / "catalog.npz")
+            call_command("dump_catalog", path, stdout=StringIO())
+            Booking.objects.create(itinerario=it, nome="Ada", email="ada@example.com",
+                                   data=datetime.date.today(), numero_persone=2)
+            with self.assertRaisesMessage(CommandError, "prenotazioni presenti: PostiPrenotati, Booking"):
+                call_command("load_catalog", path, "--replace", stdout=StringIO())
+            self.assertEqual(Booking.objects.count(), 1)
+
+            with mock.patch.object(nearby, "update_for") as update_for, \
+                    mock.patch("heritage.itinerari.refresh_rollup") as refresh_rollup:
+                call_command("load_catalog", path, "--replace", "--drop-bookings", stdout=StringIO())
+        update_for.assert_not_called()
+        refresh_rollup.assert_called_once_with()
+        self.assertEqual((Booking.objects.count(), Sito.objects.count(), Tappa.objects.count()), (0, 60, 1))
+
+
+class NormalizeCategoriesTests(TestCase):
+    def make_sites(self, labels):
+        for i, label in enumerate(labels):
+            cat = Categoria.objects.create(nome=label)
+            Sito.objects.create(nome=f"S{i}", regione="R", citta="C", categoria=cat, unesco_id=f"N{i}")
+
+    def run_command(self, *args):
+        out = StringIO()
+        call_command("normalize_categories", *args, stdout=out)
+        return out.getvalue()
+
+    def test_constant_queries_and_reassignment(self):
+        self.make_sites(["cultural", "Natural", "Mixed"] + [f"cultura {i}" for i in range(10)])
+        # costante: non dipende dal numero di categorie (un solo incremento di versione)
+        with self.assertNumQueries(10):
+            out = self.run_command()
+        self.assertIn("Riassegnati: 13 | Categorie eliminate: 13", out)
+        self.assertIn('Categorie non riconosciute: "Mixed"', out)
+        self.assertEqual(set(Categoria.objects.values_list("nome", flat=True)), {"Culturale", "Naturale"})
+        self.assertEqual(Sito.objects.filter(categoria__nome="Naturale").count(), 1)
+
+    def test_dry_run_and_keep_unknown(self):
+        self.make_sites(["natura", "Mixed"])
+        out = self.run_command("--dry-run")
+        self.assertIn('"natura" -> "Naturale" (1 siti)', out)
+        self.assertEqual(Categoria.objects.count(), 2)
+
+        self.run_command("--unknown", "keep")
+        self.assertEqual(set(Categoria.objects.values_list("nome", flat=True)), {"Culturale", "Naturale", "Mixed"})
+
+
+class RoutingTests(TestCase):
+    def test_solve_finds_straight_line_order(self):
+        from heritage.routing import haversine_matrix, solve
+
+        lat = [45.0, 41.0, 44.0, 42.0, 43.0]
+        dist = haversine_matrix(lat, [12.0] * 5)
+        self.assertIn(solve(dist), ([1, 3, 4, 2, 0], [0, 2, 4, 3, 1]))
+        self.assertEqual(solve(dist, start=4)[0], 4)
+
+    def test_reorder_rewrites_ordine_atomically(self):
+        from heritage.models import Itinerario, Tappa
+        from heritage.routing import reorder_itinerario
+
+        itin = Itinerario.objects.create(nome="Zig-zag")
+        for ordine, lat in enumerate([45.0, 41.0, 44.0, 42.0, 43.0], start=1):
+            s = Sito.objects.create(nome=f"L{lat}", regione="R", citta="C", latitudine=lat,
+                                    longitudine=12.0, unesco_id=f"R{ordine}")
+            Tappa.objects.create(itinerario=itin, sito=s, ordine=ordine)
+
+        before, after = reorder_itinerario(itin, fix_start=True)
+        self.assertLess(after, before)
+        lats = [t.sito.latitudine for t in itin.tappe.select_related("sito")]
+        self.assertEqual(lats, [45.0, 44.0, 43.0, 42.0, 41.0])
+        self.assertEqual(list(itin.tappe.values_list("ordine", flat=True)), [1, 2, 3, 4, 5])
+
+
+class NearbyTests(TestCase):
+    def setUp(self):
+        from heritage import nearby
+
+        call_command("import_sites", str(SAMPLE_CSV), stdout=StringIO())
+        self.nearby = nearby
+        self.venezia = Sito.objects.get(unesco_id="394")
+
+    def brute_force(self, sito, k):
+        from heritage.routing import haversine_matrix
+
+        others = list(Sito.objects.exclude(pk=sito.pk).exclude(latitudine=None).values_list("id", "latitudine", "longitudine"))
+        d = haversine_matrix([sito.latitudine] + [o[1] for o in others], [sito.longitudine] + [o[2] for o in others])[0, 1:]
+        return [others[i][0] for i in d.argsort()[:k]]
+
+    def test_endpoint_reads_precomputed_neighbours(self):
+        r = self.client.get(f"/api/sites/{self.venezia.pk}/nearby", {"k": 3})
+        self.assertEqual(r.status_code, 200)
+        data = r.json()
+        self.assertEqual([s["id"] for s in data["results"]], self.brute_force(self.venezia, 3))
+        distances = [s["distance_km"] for s in data["results"]]
+        self.assertEqual(distances, sorted(distances))
+
+        r = self.client.get(f"/api/sites/{self.venezia.pk}/nearby", {"radius_km": distances[0]})
+        self.assertEqual(r.json()["count"], 1)
+        self.assertEqual(self.client.get(f"/api/sites/{self.venezia.pk}/nearby", {"k": "x"}).status_code, 400)
+
+    def test_incremental_update_on_coordinate_change(self):
+        from heritage.models import SitoVicino
+
+        roma = Sito.objects.get(unesco_id="91")
+        roma.latitudine, roma.longitudine = self.venezia.latitudine + 0.01, self.venezia.longitudine
+        roma.save()
+        self.assertEqual(self.venezia.vicini.first().vicino_id, roma.pk)
+        self.assertEqual([v.vicino_id for v in roma.vicini.all()[:5]], self.brute_force(roma, 5))
+
+        roma.delete()
+        self.assertFalse(SitoVicino.objects.filter(vicino_id=roma.pk).exists())
+        self.assertEqual(self.venezia.vicini.count(), self.nearby.K_MAX)
+
+    def test_save_with_deferred_coordinates_is_not_a_move(self):
+        sito = Sito.objects.only("nome").get(pk=self.venezia.pk)
+        sito.nome = "Venezia e la sua laguna"
+        with mock.patch.object(self.nearby, "update_for") as update_for:
+            sito.save()
+        update_for.assert_not_called()
+
+        sito = Sito.objects.defer("latitudine", "longitudine").get(pk=self.venezia.pk)
+        sito.latitudine = self.venezia.latitudine + 1
+        with mock.patch.object(self.nearby, "update_for") as update_for:
+            sito.save()
+        update_for.assert_called_once_with([sito.pk])
+
+    def test_kdtree_matches_matrix(self):
+        import numpy as np
+
+        rng = np.random.default_rng(7)
+        lat, lon = rng.uniform(-60, 60, 400), rng.uniform(-180, 180, 400)
+        rows = [0, 17, 399]
+        expected = self.nearby.knn(lat, lon, rows, k=8)
+        with mock.patch.object(self.nearby, "MATRIX_LIMIT", 10):
+            got = self.nearby.knn(lat, lon, rows, k=8)
+        for (ei, ed), (gi, gd) in zip(expected, got):
+            self.assertEqual(ei.tolist(), gi.tolist())
+            np.testing.assert_allclose(ed, gd, rtol=1e-6)
+
+
+class ItinerarioGeoJSONTests(TestCase):
+    def setUp(self):
+        from heritage.models import Itinerario, Tappa
+
+        self.itin = Itinerario.objects.create(nome="Adriatico")
+        acc = Accessibilita.objects.create(sedia_a_rotelle=True, ausili_visivi=False)
+        for ordine, lat in enumerate([45.0, 44.0, 43.0], start=1):
+            s = Sito.objects.create(nome=f"T{ordine}", regione="R", citta="C", latitudine=lat, longitudine=12.0,
+                                    accessibilita=acc if ordine == 1 else None, unesco_id=f"G{ordine}")
+            Tappa.objects.create(itinerario=self.itin, sito=s, ordine=ordine)
+        self.url = f"/api/itinerario/{self.itin.pk}.geojson"
+
+    def test_route_legs_and_accessibility(self):
+        data = self.client.get(self.url).json()
+        points = [f for f in data["features"] if f["geometry"]["type"] == "Point"]
+        route = next(f for f in data["features"] if f["geometry"]["type"] == "LineString")
+        self.assertEqual(len(route["geometry"]["coordinates"]), 3)
+        self.assertEqual(len(route["properties"]["legs_km"]), 2)
+        self.assertAlmostEqual(route["properties"]["legs_km"][0], 111.2, delta=0.2)
+        self.assertAlmostEqual(data["properties"]["total_km"], sum(route["properties"]["legs_km"]), places=2)
+        self.assertIsNone(points[0]["properties"]["leg_km"])
+        self.assertTrue(points[0]["properties"]["accessibilita"]["sedia_a_rotelle"])
+        self.assertIsNone(points[1]["properties"]["accessibilita"])
+
+    def test_payload_cached_and_invalidated_by_tappa_changes(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        self.itin.tappe.get(ordine=3).delete()
+        data = self.client.get(self.url).json()
+        self.assertEqual(data["properties"]["stops"], 2)
+
+    def test_payload_invalidated_by_itinerario_changes(self):
+        self.client.get(self.url)
+        self.itin.nome = "Costa adriatica"
+        self.itin.save()
+        self.assertEqual(self.client.get(self.url).json()["properties"]["name"], "Costa adriatica")
+
+
+class ItinerarioRollupTests(TestCase):
+    def setUp(self):
+        from heritage.models import Itinerario, Tappa
+
+        self.itin = Itinerario.objects.create(nome="Adriatico")
+        self.acc = Accessibilita.objects.create(sedia_a_rotelle=True, supporto_uditivo=False)
+        self.siti = []
+        for ordine, lat in enumerate([45.0, 44.0, 43.0, 42.0], start=1):
+            s = Sito.objects.create(nome=f"R{ordine}", regione="R", citta="C", latitudine=lat, longitudine=12.0,
+                                    accessibilita=self.acc if ordine <= 2 else None, unesco_id=f"R{ordine}")
+            Tappa.objects.create(itinerario=self.itin, sito=s, ordine=ordine)
+            self.siti.append(s)
+
+    def test_rollup_maintained_by_signals(self):
+        self.itin.refresh_from_db()
+        self.assertEqual(self.itin.n_tappe, 4)
+        self.assertEqual(self.itin.n_sedia_a_rotelle, 2)
+        self.assertEqual(self.itin.perc_sedia_a_rotelle, 50)
+        self.assertFalse(self.itin.has_uditivo)
+        self.assertEqual(self.itin.bbox, (12.0, 42.0, 12.0, 45.0))
+        self.assertAlmostEqual(self.itin.lunghezza_km, 333.6, delta=0.5)
+
+        self.acc.supporto_uditivo = True
+        self.acc.save()
+        self.itin.tappe.get(ordine=4).delete()
+        self.itin.refresh_from_db()
+        self.assertEqual((self.itin.n_tappe, self.itin.n_supporto_uditivo), (3, 2))
+        self.assertEqual(self.itin.max_lat - self.itin.min_lat, 2.0)
+
+    def test_rebuild_command_restores_rollup(self):
+        from heritage.models import Itinerario
+
+        Itinerario.objects.update(n_tappe=0, n_sedia_a_rotelle=0, lunghezza_km=0)
+        call_command("rebuild_itinerari_rollup", stdout=StringIO())
+        self.itin.refresh_from_db()
+        self.assertEqual((self.itin.n_tappe, self.itin.n_sedia_a_rotelle), (4, 2))
+
+    def test_list_view_is_a_single_query(self):
+        from heritage.models import Itinerario
+
+        for i in range(5):
+            Itinerario.objects.create(nome=f"Vuoto {i}")
+        self.client.get("/itinerari/")
+        # count per la paginazione + pagina; nessuna subquery per itinerario
+        with self.assertNumQueries(2):
+            resp = self.client.get("/itinerari/")
+        self.assertContains(resp, "4 tappe")
+
+
+class ProfilingTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        from heritage.models import Itinerario, Tappa
+
+        cat = Categoria.objects.create(nome="Culturale")
+        acc = Accessibilita.objects.create(sedia_a_rotelle=True)
+        self.itin = Itinerario.objects.create(nome="Nord")
+        for i in range(10):
+            s = Sito.objects.create(nome=f"P{i}", regione="R", citta="C", latitudine=45.0 + i / 10, longitudine=9.0,
+                                    categoria=cat, accessibilita=acc, unesco_id=f"P{i}")
+            Tappa.objects.create(itinerario=self.itin, sito=s, ordine=i + 1)
+
+    def test_views_within_budget(self):
+        for url in ["/api/sites.geojson", "/itinerari/", f"/itinerari/{self.itin.pk}/",
+                    f"/api/itinerario/{self.itin.pk}.geojson"]:
+            resp, profile = self.profiled_get(url)
+            self.assertEqual(resp.status_code, 200, url)
+            self.assertEqual(profile.duplicates, 0, url)
+
+    def test_server_timing_and_sections(self):
+        resp, profile = self.profiled_get("/api/sites.geojson")
+        self.assertIn("db;dur=", resp["Server-Timing"])
+        self.assertIn("serialize;dur=", resp["Server-Timing"])
+        self.assertEqual(profile.view, "sites_geojson")
+        self.assertGreater(profile.count, 0)
+
+    def test_schema_introspection_is_outside_the_budget(self):
+        from heritage import search, spatial
+
+        with mock.patch.dict(search._backend_cache, clear=True), mock.patch.dict(spatial._rtree_cache, clear=True):
+            resp, profile = self.profiled_get("/api/sites.geojson", data={"bbox": "8,45,10,46", "q": "P1"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len([sql for sql, _, _ in profile.once if "sqlite_master" in sql]), 2)
+        self.assertLessEqual(profile.count, 3)
+
+    def test_budget_exceeded_fails(self):
+        with override_settings(HERITAGE_QUERY_BUDGETS={"itinerari_list": 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.profiled_get("/itinerari/")
+
+    @override_settings(HERITAGE_PROFILING=True, HERITAGE_PROFILING_LOG=True)
+    def test_json_log_line(self):
+        with self.assertLogs("heritage.profiling", "INFO") as logs:
+            self.client.get("/itinerari/")
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line["view"], "itinerari_list")
+        self.assertIn("sql_ms", line)
+
+
+class BenchmarkTests(TestCase):
+    def test_run_size_and_compare(self):
+        from heritage import benchmark
+
+        from django.core.cache import cache
+
+        cache.set("altra-app:chiave", 1)
+        result = benchmark.run_size(40, repeat=2)
+        self.assertEqual(cache.get("altra-app:chiave"), 1)
+        self.assertEqual(Sito.objects.count(), 40)
+        self.assertLessEqual({"import_sites_s", "import_access_s"}, set(result["imports"]))
+        for name, m in result["endpoints"].items():
+            self.assertEqual(m["status"], 200, name)
+            self.assertLessEqual(m["p50_ms"], m["max_ms"])
+        self.assertEqual(result["endpoints"]["itinerario_geojson"]["queries"], 1)
+
+        report = {"results": [result]}
+        rows = benchmark.compare(report, report)
+        self.assertTrue(rows)
+        self.assertTrue(all(delta == 0 for *_, delta in rows))
+
+
+class ConcurrencyBenchmarkTests(TransactionTestCase):
+    # le richieste concorrenti usano connessioni proprie: i dati devono essere committati
+    def test_wsgi_and_asgi_bursts(self):
+        from heritage import benchmark
+        from heritage.models import Itinerario
+
+        Sito.objects.create(nome="Uno", latitudine=45.0, longitudine=9.0, unesco_id="C1")
+        itin = Itinerario.objects.create(nome="Solo")
+        with override_settings(DEBUG=False, HERITAGE_PROFILING=False):
+            status, body = asyncio.run(benchmark.asgi_get(ASGIHandler(), "/api/async/itinerari"))
+            result = benchmark.measure_concurrency(itin.pk, [2], repeat=3)
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["count"], 1)
+        m = result["itinerari_api:c2"]
+        self.assertEqual(m["requests"], 8)
+        self.assertGreater(m["wsgi"]["rps"], 0)
+        self.assertEqual((m["wsgi"]["errors"], m["asgi"]["errors"]), (0, 0))
+        self.assertGreater(m["asgi"]["rps"], 0)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cult = Categoria.objects.create(nome="Culturale")
+        nat = Categoria.objects.create(nome="Naturale")
+        combos = [(True, True, None), (True, False, False), (False, None, True), (None, None, None), (True, None, True)]
+        for i, (wc, av, su) in enumerate(combos * 3):
+            acc = Accessibilita.objects.create(sedia_a_rotelle=wc, ausili_visivi=av, supporto_uditivo=su)
+            Sito.objects.create(nome=f"F{i}", regione=["Lazio", "Toscana"][i % 2], citta="C",
+                                latitudine=41.0 + i / 10, longitudine=12.0, unesco_id=f"F{i}",
+                                categoria=cult if i % 3 else nat, accessibilita=acc)
+
+    def facets(self, **params):
+        return self.client.get("/api/sites/facets", params).json()
+
+    def geojson_count(self, **params):
+        return self.client.get("/api/sites.geojson", {**params, "limit": 500}).json()["count"]
+
+    def test_counts_match_sites_api(self):
+        data = self.facets()
+        self.assertEqual(data["count"], 15)
+        self.assertEqual(data["facets"]["categoria"], {"Culturale": 10, "Naturale": 5})
+        self.assertEqual(data["facets"]["wheelchair"], {"1": 9, "0": 3, "null": 3})
+        # il conteggio di un valore = risultati che si otterrebbero scegliendolo
+        for mode in ("any", "all"):
+            data = self.facets(ausili_visivi="1", categoria="Culturale", acc_mode=mode)
+            self.assertEqual(data["count"], self.geojson_count(ausili_visivi="1", categoria="Culturale", acc_mode=mode))
+            for value in ("1", "0"):
+                expected = self.geojson_count(ausili_visivi="1", wheelchair=value, categoria="Culturale", acc_mode=mode)
+                self.assertEqual(data["facets"]["wheelchair"][value], expected, (mode, value))
+            self.assertEqual(data["facets"]["categoria"]["Naturale"],
+                             self.geojson_count(ausili_visivi="1", categoria="Naturale", acc_mode=mode))
+
+    def test_has_acc_data_and_regione(self):
+        data = self.facets(has_acc_data="1", regione="Lazio")
+        self.assertEqual(data["count"], self.geojson_count(has_acc_data="1", regione="Lazio"))
+        self.assertEqual(sum(data["facets"]["regione"].values()), 12)
+
+    def test_site_save_updates_index_in_place(self):
+        from heritage import facets
+
+        self.facets()
+        acc = Accessibilita.objects.create(sedia_a_rotelle=False)
+        facets.get_index()
+        sito = Sito.objects.create(nome="Nuovo", regione="Umbria", citta="C", unesco_id="F99", accessibilita=acc)
+        with self.assertNumQueries(0):
+            index = facets.get_index()
+        data = index.counts({})
+        self.assertEqual(data["facets"]["regione"]["Umbria"], 1)
+        self.assertEqual(data["facets"]["wheelchair"]["0"], 4)
+
+        sito.delete()
+        with self.assertNumQueries(0):
+            data = facets.get_index().counts({})
+        self.assertEqual((data["count"], data["facets"]["regione"]["Umbria"]), (15, 0))
+
+
+def _decode_pb(buf):
+    """Decoder protobuf minimale per i test MVT: {campo: [valori]}."""
+    out, i = {}, 0
+
+    def varint():
+        nonlocal i
+        shift = n = 0
+        while True:
+            b = buf[i]
+            i += 1
+            n |= (b & 0x7F) << shift
+            shift += 7
+            if not b & 0x80:
+                return n
+
+    while i < len(buf):
+        key = varint()
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            val = varint()
+        elif wire == 2:
+            size = varint()
+            val, i = buf[i:i + size], i + size
+        elif wire == 1:
+            val, i = buf[i:i + 8], i + 8
+        out.setdefault(field, []).append(val)
+    return out
+
+
+def _decode_packed(buf):
+    vals, n, shift = [], 0, 0
+    for b in buf:
+        n |= (b & 0x7F) << shift
+        shift += 7
+        if not b & 0x80:
+            vals.append(n)
+            n = shift = 0
+    return vals
+
+
+class VectorTileTests(TestCase):
+    def setUp(self):
+        cat = Categoria.objects.create(nome="Culturale")
+        acc = Accessibilita.objects.create(sedia_a_rotelle=True, ausili_visivi=False)
+        self.roma = Sito.objects.create(nome="Roma", regione="Lazio", citta="Roma", latitudine=41.9, longitudine=12.5,
+                                        categoria=cat, accessibilita=acc, unesco_id="V1")
+        self.torino = Sito.objects.create(nome="Torino", regione="Piemonte", citta="Torino", latitudine=45.07,
+                                          longitudine=7.68, unesco_id="V2")
+
+    def layer(self, url):
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Content-Type"], "application/vnd.mapbox-vector-tile")
+        if not resp.content:
+            return None
+        return _decode_pb(_decode_pb(resp.content)[3][0])
+
+    def test_tile_encodes_points_and_properties(self):
+        layer = self.layer("/api/tiles/sites/0/0/0.pbf")
+        self.assertEqual(layer[1], [b"sites"])
+        self.assertEqual(layer[5], [4096])
+        features = [_decode_pb(f) for f in layer[2]]
+        self.assertEqual(sorted(f[1][0] for f in features), [self.roma.pk, self.torino.pk])
+
+        keys = [k.decode() for k in layer[3]]
+        values = [_decode_pb(v) for v in layer[4]]
+        roma = next(f for f in features if f[1][0] == self.roma.pk)
+        tags = _decode_packed(roma[2][0])
+        props = {keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])}
+        self.assertEqual(props["name"][1], [b"Roma"])
+        self.assertEqual(props["wheelchair"][7], [1])
+        self.assertEqual(props["ausili_visivi"][7], [0])
+        self.assertNotIn("supporto_uditivo", props)
+        # MoveTo(1) + coordinate zigzag: x = (12.5 + 180) / 360 * 4096
+        cmd, zx, _ = _decode_packed(roma[4][0])
+        self.assertEqual(cmd, 9)
+        self.assertEqual(zx // 2, round((12.5 + 180) / 360 * 4096))
+
+    def test_empty_and_invalid_tiles(self):
+        self.assertIsNone(self.layer("/api/tiles/sites/5/0/0.pbf"))
+        self.assertEqual(self.client.get("/api/tiles/sites/3/9/0.pbf").status_code, 400)
+
+    def test_edit_invalidates_only_its_tiles(self):
+        # z=6: Roma e Torino in tessere diverse
+        roma_url, torino_url = "/api/tiles/sites/6/34/23.pbf", "/api/tiles/sites/6/33/22.pbf"
+        self.assertIsNotNone(self.layer(roma_url))
+        self.assertIsNotNone(self.layer(torino_url))
+        etag = self.client.get(roma_url)["ETag"]
+        self.assertEqual(self.client.get(roma_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.roma.nome = "Roma Capitale"
+        self.roma.save()
+        with self.assertNumQueries(0):
+            self.client.get(torino_url)
+        resp = self.client.get(roma_url)
+        self.assertNotEqual(resp["ETag"], etag)
+        self.assertIn(b"Roma Capitale", resp.content)
+
+    def test_bulk_changes_start_new_generation(self):
+        from heritage.versioning import bump_catalog_version
+
+        self.client.get("/api/tiles/sites/0/0/0.pbf")
+        Sito.objects.filter(pk=self.torino.pk).update(nome="Augusta Taurinorum")
+        bump_catalog_version()
+        self.assertIn(b"Augusta Taurinorum", self.client.get("/api/tiles/sites/0/0/0.pbf").content)
+
+
+class CapacityTests(TestCase):
+    def setUp(self):
+        import datetime
+
+        from heritage.models import Itinerario
+
+        self.itin = Itinerario.objects.create(nome="Capienza", capienza_giornaliera=5)
+        self.day = datetime.date.today() + datetime.timedelta(days=10)
+        self.url = f"/itinerari/{self.itin.pk}/prenota/"
+
+    def book(self, n, day=None):
+        return self.client.post(self.url, {
+            "nome": "Ada", "email": "ada@example.com", "data": (day or self.day).isoformat(), "numero_persone": n,
+        })
+
+    def posti(self):
+        from heritage.models import PostiPrenotati
+
+        return PostiPrenotati.objects.get(itinerario=self.itin, data=self.day).prenotati
+
+    def test_booking_respects_capacity(self):
+        from heritage.models import Booking
+
+        self.assertEqual(self.book(3).status_code, 302)
+        resp = self.book(3)
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, "ne restano 2")
+        self.assertEqual(self.book(2).status_code, 302)
+        self.assertEqual(self.posti(), 5)
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_reserve_is_a_single_conditional_update(self):
+        from heritage import capacity
+
+        capacity.reserve(self.itin, self.day, 1)
+        with self.assertNumQueries(1):
+            capacity.reserve(self.itin, self.day, 1)
+        with self.assertRaises(capacity.CapacityError):
+            capacity.reserve(self.itin, self.day, 4)
+        self.assertEqual(self.posti(), 2)
+
+    def test_delete_and_admin_edits_adjust_counter(self):
+        from heritage.models import Booking
+
+        self.book(2)
+        booking = Booking.objects.get()
+        booking.numero_persone = 4
+        booking.save()
+        self.assertEqual(self.posti(), 4)
+        booking.delete()
+        self.assertEqual(self.posti(), 0)
+        Booking.objects.create(itinerario=self.itin, nome="B", email="b@example.com", data=self.day, numero_persone=1)
+        self.assertEqual(self.posti(), 1)
+
+    def test_capacity_change_applies_to_existing_counters(self):
+        from heritage import capacity
+        from heritage.models import PostiPrenotati
+
+        capacity.reserve(self.itin, self.day, 4)
+        self.itin.capienza_giornaliera = 8
+        self.itin.save()
+        capacity.reserve(self.itin, self.day, 4)
+        self.assertEqual(self.posti(), 8)
+
+        self.itin.capienza_giornaliera = 3
+        self.itin.save()
+        self.assertEqual(PostiPrenotati.objects.get(itinerario=self.itin, data=self.day).disponibili, 0)
+        with self.assertRaises(capacity.CapacityError):
+            capacity.reserve(self.itin, self.day, 1)
+
+    def test_availability_reads_only_counters(self):
+        import datetime
+
+        self.book(4)
+        end = self.day + datetime.timedelta(days=2)
+        with self.assertNumQueries(2):
+            resp = self.client.get(f"/api/itinerari/{self.itin.pk}/availability",
+                                   {"from": self.day.isoformat(), "to": end.isoformat()})
+        days = resp.json()["days"]
+        self.assertEqual(len(days), 3)
+        self.assertEqual(days[0], {"data": self.day.isoformat(), "capienza": 5, "prenotati": 4, "disponibili": 1})
+        self.assertEqual(days[1]["disponibili"], 5)
+        bad = self.client.get(f"/api/itinerari/{self.itin.pk}/availability", {"from": "domani"})
+        self.assertEqual(bad.status_code, 400)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        from heritage import jobs
+
+        self.calls = []
+        self.tasks = dict(jobs.TASKS)
+        jobs.task("test.registra")(lambda valore: self.calls.append(valore))
+        jobs.task("test.rotto", max_tentativi=2)(lambda: 1 / 0)
+
+    def tearDown(self):
+        from heritage import jobs
+
+        jobs.TASKS.clear()
+        jobs.TASKS.update(self.tasks)
+
+    def test_priority_schedule_and_dedup(self):
+        import datetime
+
+        from django.utils import timezone
+        from heritage import jobs
+
+        jobs.enqueue("test.registra", valore="bassa")
+        jobs.enqueue("test.registra", priorita=5, valore="alta")
+        jobs.enqueue("test.registra", valore="dopo", run_at=timezone.now() + datetime.timedelta(hours=1))
+        first = jobs.enqueue("test.registra", dedup_key="k", valore="unico")
+        self.assertEqual(jobs.enqueue("test.registra", dedup_key="k", valore="doppio").pk, first.pk)
+
+        self.assertEqual(jobs.run_pending(), (3, 0))
+        self.assertEqual(self.calls, ["alta", "bassa", "unico"])
+        # concluso il primo, la stessa chiave può essere riaccodata
+        self.assertNotEqual(jobs.enqueue("test.registra", dedup_key="k", valore="di nuovo").pk, first.pk)
+
+    def test_retry_with_backoff_then_failed(self):
+        from django.utils import timezone
+        from heritage import jobs
+        from heritage.models import Job
+
+        job = jobs.enqueue("test.rotto")
+        self.assertEqual(jobs.run_pending(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.stato, job.tentativi), (Job.PENDING, 1))
+        self.assertGreater(job.scheduled_at, timezone.now())
+        self.assertIn("ZeroDivisionError", job.ultimo_errore)
+
+        Job.objects.filter(pk=job.pk).update(scheduled_at=timezone.now())
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.stato, job.tentativi), (Job.FAILED, 2))
+
+    def test_claim_is_exclusive(self):
+        from heritage import jobs
+
+        job = jobs.enqueue("test.registra", valore=1)
+        self.assertTrue(jobs.claim_job(job.pk, "a"))
+        self.assertFalse(jobs.claim_job(job.pk, "b"))
+        self.assertEqual(jobs.claim("c"), [])
+
+    def test_stale_jobs_requeued_only_with_attempts_left(self):
+        import datetime
+
+        from django.utils import timezone
+        from heritage import jobs
+        from heritage.models import Job
+
+        old = timezone.now() - datetime.timedelta(seconds=jobs.STALE_AFTER + 60)
+        orfano = jobs.enqueue("test.rotto")
+        esaurito = jobs.enqueue("test.registra", valore=1)
+        vivo = jobs.enqueue("test.registra", valore=2)
+        for job in (orfano, esaurito, vivo):
+            jobs.claim_job(job.pk, "morto")
+        Job.objects.filter(pk__in=[orfano.pk, esaurito.pk]).update(locked_at=old)
+        Job.objects.filter(pk=esaurito.pk).update(max_tentativi=1)
+
+        self.assertEqual(jobs.requeue_stale(), 1)
+        stati = dict(Job.objects.values_list("pk", "stato"))
+        self.assertEqual(
+            (stati[orfano.pk], stati[esaurito.pk], stati[vivo.pk]), (Job.PENDING, Job.FAILED, Job.RUNNING)
+        )
+
+    def test_heartbeat_keeps_running_job_fresh(self):
+        import datetime
+
+        from django.utils import timezone
+        from heritage import jobs
+        from heritage.models import Job
+
+        job = jobs.enqueue("test.registra", valore=1)
+        jobs.claim_job(job.pk, "w")
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - datetime.timedelta(hours=1))
+        heartbeat = jobs.Heartbeat(job.pk)
+        with mock.patch.object(heartbeat.stopped, "wait", side_effect=[False, True]), \
+                mock.patch.object(jobs.connection, "close"):
+            heartbeat.run()
+        self.assertEqual(jobs.requeue_stale(), 0)
+        self.assertEqual(Job.objects.get(pk=job.pk).stato, Job.RUNNING)
+
+    def test_booking_enqueues_confirmation_email(self):
+        import datetime
+
+        from django.core import mail
+        from heritage.models import Itinerario, Job
+
+        itin = Itinerario.objects.create(nome="Posta")
+        day = datetime.date.today() + datetime.timedelta(days=3)
+        self.client.post(f"/itinerari/{itin.pk}/prenota/", {
+            "nome": "Ada", "email": "ada@example.com", "data": day.isoformat(), "numero_persone": 2,
+        })
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Job.objects.get().nome, "booking.conferma")
+
+        out = StringIO()
+        call_command("run_workers", "--once", "--workers", "1", stdout=out)
+        self.assertIn("Lavori completati: 1", out.getvalue())
+        self.assertEqual(mail.outbox[0].to, ["ada@example.com"])
+        self.assertIn("Posta", mail.outbox[0].subject)
+
+    @override_settings(HERITAGE_JOBS_EAGER=True)
+    def test_eager_mode_runs_inline(self):
+        from heritage import jobs
+
+        self.assertEqual(jobs.enqueue("test.registra", valore="subito").stato, "done")
+        self.assertEqual(self.calls, ["subito"])
+
+
+@override_settings(HERITAGE_PROFILING=True, HERITAGE_QUERY_BUDGET_STRICT=True)
+class AsyncViewTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        from heritage.models import Itinerario, Tappa
+
+        cat = Categoria.objects.create(nome="Culturale")
+        acc = Accessibilita.objects.create(sedia_a_rotelle=True)
+        self.itin = Itinerario.objects.create(nome="Nord")
+        for i in range(6):
+            s = Sito.objects.create(nome=f"Villa {i}", regione="Lombardia", citta="Milano", latitudine=45.0 + i / 10,
+                                    longitudine=9.0, categoria=cat, accessibilita=acc, unesco_id=f"A{i}")
+            Tappa.objects.create(itinerario=self.itin, sito=s, ordine=i + 1)
+        Itinerario.objects.create(nome="Sud")
+
+    async def _both(self, path, params=None):
+        from asgiref.sync import sync_to_async
+
+        sync = await sync_to_async(self.client.get)(f"/api/{path}", params or {})
+        asyn = await self.async_client.get(f"/api/async/{path}", params or {})
+        self.assertEqual(sync.status_code, asyn.status_code, path)
+        return sync, asyn
+
+    async def test_same_payload_as_sync(self):
+        cases = [
+            ("sites.geojson", {"limit": 2}),
+            ("sites.geojson", {"limit": 2, "sort": "-nome", "count": "estimate"}),
+            ("sites.geojson", {"bbox": "8,45.15,10,46", "wheelchair": "1"}),
+            (f"itinerario/{self.itin.pk}.geojson", None),
+            ("itinerari", {"limit": 1, "offset": 1}),
+        ]
+        for path, params in cases:
+            sync, asyn = await self._both(path, params)
+            self.assertEqual(sync.json(), asyn.json(), (path, params))
+
+    @override_settings(HERITAGE_CATALOG_ENGINE="numpy")
+    async def test_same_payload_with_catalog(self):
+        sync, asyn = await self._both("sites.geojson", {"limit": 4, "regione": "Lombardia"})
+        self.assertEqual(sync.json(), asyn.json())
+        self.assertEqual(asyn.json()["count"], 6)
+
+    async def test_cursor_pages_and_etag(self):
+        first = await self.async_client.get("/api/async/sites.geojson", {"limit": 4})
+        data = first.json()
+        self.assertEqual(len(data["features"]), 4)
+        rest = await self.async_client.get("/api/async/sites.geojson", {"limit": 4, "cursor": data["next"]})
+        self.assertEqual(len(rest.json()["features"]), 2)
+
+        sync, _ = await self._both("sites.geojson", {"limit": 4})
+        self.assertEqual(first["ETag"], sync["ETag"])
+        cached = await self.async_client.get("/api/async/sites.geojson", {"limit": 4},
+                                             headers={"if-none-match": first["ETag"]})
+        self.assertEqual(cached.status_code, 304)
+
+    async def test_features_encoded_off_the_event_loop(self):
+        import threading
+
+        from heritage import features
+
+        threads = []
+
+        def spy(obj):
+            threads.append(threading.current_thread().name)
+            return encode(obj)
+
+        encode = features.encode
+        features.feature_cache.clear()
+        with mock.patch.object(features, "encode", spy):
+            resp = await self.async_client.get("/api/async/sites.geojson", {"limit": 3})
+        self.assertEqual(len(resp.json()["features"]), 3)
+        self.assertTrue(threads)
+        self.assertTrue(all(name.startswith("heritage-serialize") for name in threads), threads)
+
+    async def test_errors(self):
+        bad = await self.async_client.get("/api/async/sites.geojson", {"bbox": "1,2,3"})
+        self.assertEqual(bad.status_code, 400)
+        missing = await self.async_client.get("/api/async/itinerario/999999.geojson")
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_profiling_under_asgi(self):
+        for url in ["/api/async/sites.geojson", f"/api/async/itinerario/{self.itin.pk}.geojson",
+                    "/api/async/itinerari"]:
+            resp, profile = await self.aprofiled_get(url)
+            self.assertEqual(resp.status_code, 200, url)
+            self.assertGreater(profile.count, 0, url)
+            self.assertIn("serialize;dur=", resp["Server-Timing"])
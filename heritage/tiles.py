@@ -0,0 +1,229 @@
+"""Vector tile (Mapbox Vector Tile 2.1) dei Siti, codificati in Python/NumPy.
+
+Ogni tessera ``z/x/y`` contiene il layer ``sites`` con un punto per sito e
+le proprietà usate dalla mappa (nome, categoria, flag di accessibilità).
+L'encoder protobuf è scritto a mano: servono solo Tile/Layer/Feature/Value
+e la geometria POINT, quindi niente GDAL né librerie protobuf.
+
+Le tessere codificate stanno nella cache di Django. La chiave contiene una
+"generazione" che resta valida finché la versione del dataset cambia solo
+per salvataggi di singoli Sito: in quel caso i segnali eliminano le sole
+tessere che contengono la posizione vecchia e nuova del sito
+(``invalidate_point`` + ``advance``). Ogni altra modifica (import, categorie,
+accessibilità) fa partire una nuova generazione.
+"""
+import hashlib
+import math
+import struct
+
+import numpy as np
+from django.core.cache import cache
+
+from .clusters import _mercator
+from .versioning import catalog_version
+
+LAYER = "sites"
+EXTENT = 4096
+BUFFER = 64            # unità di tessera oltre il bordo (marker a cavallo delle tessere)
+MAX_TILE_ZOOM = 16
+CACHE_TTL = 7 * 24 * 3600
+STATE_KEY = "heritage:tiles:state"  # (versione del dataset, generazione)
+
+# tipi di geometria MVT
+POINT = 1
+
+
+class TileError(ValueError):
+    pass
+
+
+# --- protobuf -----------------------------------------------------------------
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _key(field, wire):
+    return _varint((field << 3) | wire)
+
+
+def _bytes_field(field, data):
+    return _key(field, 2) + _varint(len(data)) + data
+
+
+def _varint_field(field, n):
+    return _key(field, 0) + _varint(n)
+
+
+def _packed(field, values):
+    return _bytes_field(field, b"".join(_varint(v) for v in values))
+
+
+def _value(v):
+    """Messaggio Value: string (1), double (3), sint (6), bool (7)."""
+    if isinstance(v, bool):
+        return _varint_field(7, int(v))
+    if isinstance(v, int):
+        return _varint_field(6, _zigzag(v))
+    if isinstance(v, float):
+        return _key(3, 1) + struct.pack("<d", v)
+    return _bytes_field(1, str(v).encode("utf-8"))
+
+
+def encode_layer(name, features, extent=EXTENT):
+    """features: (id, x, y, props) con x/y già in coordinate di tessera."""
+    keys, values = {}, {}
+    body = [_varint_field(15, 2), _bytes_field(1, name.encode("utf-8"))]
+    for fid, x, y, props in features:
+        tags = []
+        for k, v in props.items():
+            if v is None:
+                continue
+            tags.append(keys.setdefault(k, len(keys)))
+            tags.append(values.setdefault((type(v).__name__, v), len(values)))
+        geometry = [(1 & 0x7) | (1 << 3), _zigzag(int(x)), _zigzag(int(y))]  # MoveTo(1)
+        feature = _varint_field(1, fid) + (_packed(2, tags) if tags else b"") + _varint_field(3, POINT)
+        body.append(_bytes_field(2, feature + _packed(4, geometry)))
+    body += [_bytes_field(3, k.encode("utf-8")) for k in keys]
+    body += [_bytes_field(4, _value(v)) for _, v in values]
+    body.append(_varint_field(5, extent))
+    return b"".join(body)
+
+
+def encode_tile(layers):
+    return b"".join(_bytes_field(3, encode_layer(name, feats)) for name, feats in layers)
+
+
+# --- geometria delle tessere --------------------------------------------------
+
+def tile_bounds(z, x, y, buffer=0.0):
+    """(min_lon, min_lat, max_lon, max_lat) della tessera, allargata di `buffer` (frazione)."""
+    n = 2 ** z
+
+    def lon(px):
+        return px / n * 360.0 - 180.0
+
+    def lat(py):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * py / n))))
+
+    return (
+        max(-180.0, lon(x - buffer)), max(-85.05112878, lat(y + 1 + buffer)),
+        min(180.0, lon(x + 1 + buffer)), min(85.05112878, lat(y - buffer)),
+    )
+
+
+def mercator(lon, lat):
+    """Versione NumPy di clusters._mercator (coordinate normalizzate in [0, 1))."""
+    lat = np.radians(np.clip(np.asarray(lat, dtype=np.float64), -85.05112878, 85.05112878))
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0
+    s = np.sin(lat)
+    return x, 0.5 - np.log((1 + s) / (1 - s)) / (4 * np.pi)
+
+
+def check_tile(z, x, y):
+    if not 0 <= z <= MAX_TILE_ZOOM:
+        raise TileError(f"zoom fuori intervallo (0..{MAX_TILE_ZOOM})")
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise TileError("coordinate della tessera fuori intervallo")
+
+
+def build_tile(z, x, y):
+    """Tessera codificata (bytes, eventualmente vuota) letta dal DB."""
+    from .models import Sito
+    from .spatial import filter_bbox
+
+    check_tile(z, x, y)
+    pad = BUFFER / EXTENT
+    qs = filter_bbox(
+        Sito.objects.filter(latitudine__isnull=False, longitudine__isnull=False), tile_bounds(z, x, y, pad)
+    )
+    rows = list(qs.order_by("id").values_list(
+        "id", "longitudine", "latitudine", "nome", "categoria__nome",
+        "accessibilita__sedia_a_rotelle", "accessibilita__ausili_visivi", "accessibilita__supporto_uditivo",
+    ))
+    if not rows:
+        return b""
+    mx, my = mercator([r[1] for r in rows], [r[2] for r in rows])
+    n = 2 ** z
+    tx = np.rint((mx * n - x) * EXTENT).astype(np.int64).tolist()
+    ty = np.rint((my * n - y) * EXTENT).astype(np.int64).tolist()
+    features = [
+        (r[0], px, py, {
+            "name": r[3], "category": r[4],
+            "wheelchair": r[5], "ausili_visivi": r[6], "supporto_uditivo": r[7],
+        })
+        for r, px, py in zip(rows, tx, ty)
+    ]
+    return encode_tile([(LAYER, features)])
+
+
+# --- cache e invalidazione ----------------------------------------------------
+
+def _generation():
+    """Generazione corrente della cache delle tessere (nuova se il dataset è cambiato altrove)."""
+    version = catalog_version()
+    state = cache.get(STATE_KEY)
+    if state is None or state[0] != version:
+        state = (version, (state[1] + 1) if state else 0)
+        cache.set(STATE_KEY, state, timeout=None)
+    return state[1]
+
+
+def tile_key(z, x, y, gen):
+    return f"heritage:tile:{gen}:{z}:{x}:{y}"
+
+
+def get_tile(z, x, y):
+    """(bytes, etag) della tessera, dalla cache o codificata al momento."""
+    check_tile(z, x, y)
+    key = tile_key(z, x, y, _generation())
+    hit = cache.get(key)
+    if hit is None:
+        body = build_tile(z, x, y)
+        hit = (body, hashlib.blake2b(body, digest_size=8).hexdigest())
+        cache.set(key, hit, CACHE_TTL)
+    return hit
+
+
+def tiles_for_point(lon, lat, max_zoom=MAX_TILE_ZOOM):
+    """Tutte le tessere (z, x, y) che disegnano il punto, compreso il margine BUFFER."""
+    if lon is None or lat is None:
+        return set()
+    mx, my = _mercator(lon, lat)
+    pad = BUFFER / EXTENT
+    out = set()
+    for z in range(max_zoom + 1):
+        n = 2 ** z
+        for fx in {mx * n - pad, mx * n, mx * n + pad}:
+            for fy in {my * n - pad, my * n, my * n + pad}:
+                tx, ty = int(fx), int(fy)
+                if 0 <= fx and 0 <= fy and tx < n and ty < n:
+                    out.add((z, tx, ty))
+    return out
+
+
+def invalidate_point(lon, lat):
+    """Elimina dalla cache le tessere che contengono il punto (generazione corrente)."""
+    state = cache.get(STATE_KEY)
+    if state is None:
+        return
+    cache.delete_many([tile_key(z, x, y, state[1]) for z, x, y in tiles_for_point(lon, lat)])
+
+
+def advance(old, new):
+    """Dopo un'invalidazione per tessera: la generazione resta valida per la nuova versione."""
+    state = cache.get(STATE_KEY)
+    if state is not None and state[0] == old:
+        cache.set(STATE_KEY, (new, state[1]), timeout=None)
@@ -0,0 +1,177 @@
+"""Versione del dataset dei Siti, condivisa tra i processi tramite il database.
+
+Ogni modifica a Sito/Categoria/Accessibilita incrementa il contatore (l'unica
+riga di ``CatalogVersion``): gli indici in memoria lo confrontano con la
+propria versione per capire se sono stale, e la API lo usa come base per gli
+ETag. Stando nel DB, gli incrementi fatti dai comandi di import, dai worker
+della coda o da un altro processo web sono visti da tutti i processi.
+
+Le letture non toccano il DB: il valore sta nella cache (chiave
+``CACHE_KEY``, durata ``HERITAGE_CATALOG_VERSION_TTL`` secondi) e durante una
+richiesta è letto una volta sola (``CatalogVersionMiddleware``). Il DB si
+legge quando la chiave scade; dopo ogni incremento la chiave è aggiornata al
+commit. Con una cache condivisa (Redis, Memcached) gli altri processi vedono
+subito il nuovo valore, con la LocMemCache al più dopo il TTL.
+
+Le modifiche di massa che inviano un segnale per oggetto si racchiudono in
+``batch()``: una sola transazione e un solo incremento.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+ROW_ID = 1
+CACHE_KEY = "heritage:catalog-version"
+DEFAULT_TTL = 5
+
+# valore letto nella richiesta corrente ({} finché non serve)
+_request = ContextVar("heritage_catalog_version", default=None)
+# versione già assegnata dentro batch()
+_batch = ContextVar("heritage_catalog_batch", default=None)
+
+# ultima versione assegnata da questo processo: la cache la riceve solo al
+# commit, ma gli indici locali sono già passati al nuovo valore
+_last = 0
+_last_lock = threading.Lock()
+
+
+def _seed():
+    # Valori legati all'istante: dopo un rollback, o se la riga viene persa,
+    # la nuova serie non riusa versioni già emesse.
+    return time.time_ns() // 1000
+
+
+def _ttl():
+    return getattr(settings, "HERITAGE_CATALOG_VERSION_TTL", DEFAULT_TTL)
+
+
+def _remember(v):
+    global _last
+    with _last_lock:
+        _last = max(_last, v)
+    return _last
+
+
+def _create():
+    from .models import CatalogVersion
+
+    try:
+        with transaction.atomic():
+            return CatalogVersion.objects.create(pk=ROW_ID, valore=_seed()).valore
+    except IntegrityError:
+        # creata nel frattempo da un altro processo
+        return CatalogVersion.objects.get(pk=ROW_ID).valore
+
+
+def _read():
+    from .models import CatalogVersion
+    from .profiling import once
+
+    # una lettura ogni TTL, non una per richiesta: fuori dal budget di query
+    with once():
+        v = CatalogVersion.objects.filter(pk=ROW_ID).values_list("valore", flat=True).first()
+        return _create() if v is None else v
+
+
+def _current():
+    v = cache.get(CACHE_KEY)
+    if v is None:
+        v = _read()
+        cache.set(CACHE_KEY, v, _ttl())
+    return _remember(v)
+
+
+def catalog_version() -> int:
+    memo = _request.get()
+    if memo is None:
+        return _current()
+    if "v" not in memo:
+        memo["v"] = _current()
+    return memo["v"]
+
+
+async def acatalog_version() -> int:
+    """Come catalog_version, con la cache e l'ORM async (per le viste async)."""
+    memo = _request.get()
+    if memo is not None and "v" in memo:
+        return memo["v"]
+    v = await cache.aget(CACHE_KEY)
+    if v is None:
+        v = await sync_to_async(_read)()
+        await cache.aset(CACHE_KEY, v, _ttl())
+    v = _remember(v)
+    if memo is not None:
+        memo["v"] = v
+    return v
+
+
+def bump_catalog_version():
+    """Incrementa la versione; restituisce la coppia (vecchia, nuova)."""
+    from .models import CatalogVersion
+
+    pending = _batch.get()
+    if pending:
+        # già incrementata in questo batch: gli indici restano sulla stessa versione
+        return pending["new"], pending["new"]
+    # UPDATE condizionale sul valore letto: se un altro processo è passato
+    # nel frattempo si rilegge, senza bloccare la riga in anticipo
+    while True:
+        old = CatalogVersion.objects.filter(pk=ROW_ID).values_list("valore", flat=True).first()
+        if old is None:
+            old = _create()
+        new = max(old + 1, _seed())
+        if CatalogVersion.objects.filter(pk=ROW_ID, valore=old).update(valore=new):
+            break
+    _remember(new)
+    # gli altri processi vedono il nuovo valore solo con i dati già committati
+    transaction.on_commit(lambda: cache.set(CACHE_KEY, new, _ttl()))
+    if pending is not None:
+        pending["new"] = new
+    memo = _request.get()
+    if memo is not None:
+        memo["v"] = new
+    return old, new
+
+
+@contextmanager
+def batch():
+    """Modifiche in blocco in una transazione, con un solo incremento della versione."""
+    token = _batch.set({})
+    try:
+        with transaction.atomic():
+            yield
+    finally:
+        _batch.reset(token)
+
+
+class CatalogVersionMiddleware:
+    """Una sola lettura della versione per richiesta, anche con più indici e cache consultati."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _request.set({})
+        try:
+            return self.get_response(request)
+        finally:
+            _request.reset(token)
+
+    async def __acall__(self, request):
+        token = _request.set({})
+        try:
+            return await self.get_response(request)
+        finally:
+            _request.reset(token)
@@ -1,17 +1,28 @@
+import datetime
+import hashlib
 from functools import reduce
 from operator import or_ as OR
 
-from django.db.models import Q, OuterRef, Exists
-from django.http import JsonResponse
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.views.generic import ListView
 from django.views.generic.edit import CreateView
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
 from django.urls import reverse_lazy
+from django.utils import timezone
 
-from .models import Sito, Categoria, Itinerario, PrenotazioneItinerario, Booking, Tappa
+from . import capacity, catalog, clusters, facets, itinerari, jobs, profiling, search, suggest, tiles
+from .models import Sito, SitoVicino, Categoria, Itinerario, PrenotazioneItinerario, Booking
+from .nearby import K_MAX
 from .forms import BookingForm
+from .features import current_version, feature_cache, render_collection, stream_collection
+from .pagination import CursorError, decode_cursor, keyset_array, keyset_page, parse_sort
+from .spatial import BBoxError, filter_bbox, pad_bbox, parse_bbox, parse_zoom
 
 
 def home(request):
@@ -38,61 +49,70 @@ def _qs_base():
     return Sito.objects.select_related("categoria", "accessibilita").all()
 
 
+CAT_MAP = {
+    "cultural": "Culturale",
+    "culturale": "Culturale",
+    "natural": "Naturale",
+    "naturale": "Naturale",
+}
+
+
+def _filter_params(request):
+    """Estrae e normalizza i parametri di filtro della API siti."""
+    mode = (request.GET.get("acc_mode") or "any").strip().lower()
+    if mode not in ("any", "all"):
+        mode = "any"
+    categoria = (request.GET.get("categoria") or "").strip()
+    return {
+        "q": (request.GET.get("q") or "").strip(),
+        "categoria": CAT_MAP.get(categoria.lower(), categoria),
+        "regione": (request.GET.get("regione") or "").strip(),
+        "citta": (request.GET.get("citta") or "").strip(),
+        "sedia_a_rotelle": to_bool_param(request.GET.get("wheelchair")),
+        "ausili_visivi": to_bool_param(request.GET.get("ausili_visivi")),
+        "supporto_uditivo": to_bool_param(request.GET.get("supporto_uditivo")),
+        "acc_mode": mode,
+        "has_acc_data": (request.GET.get("has_acc_data") or "").strip().lower() in ("1", "true", "yes", "y"),
+    }
+
+
 def _apply_text_filters(qs, request):
     """Applica filtri per testo/categoria/regione/città."""
-    q = (request.GET.get("q") or "").strip()
-    if q:
-        qs = qs.filter(Q(nome__icontains=q) | Q(citta__icontains=q) | Q(regione__icontains=q))
-
-    cat_map = {
-        "cultural": "Culturale",
-        "culturale": "Culturale",
-        "natural": "Naturale",
-        "naturale": "Naturale",
-    }
-    categoria = (request.GET.get("categoria") or "").strip()
-    if categoria:
-        normalized = cat_map.get(categoria.lower(), categoria)
-        qs = qs.filter(categoria__nome__iexact=normalized)
+    p = _filter_params(request)
+    if p["q"]:
+        # full-text sull'indice (annota search_rank), icontains se non disponibile
+        qs, _ = search.apply_search(qs, p["q"])
 
-    regione = (request.GET.get("regione") or "").strip()
-    if regione:
-        qs = qs.filter(regione__iexact=regione)
+    if p["categoria"]:
+        qs = qs.filter(categoria__nome__iexact=p["categoria"])
 
-    citta = (request.GET.get("citta") or "").strip()
-    if citta:
-        qs = qs.filter(citta__iexact=citta)
+    if p["regione"]:
+        qs = qs.filter(regione__iexact=p["regione"])
+
+    if p["citta"]:
+        qs = qs.filter(citta__iexact=p["citta"])
 
     return qs
 
 
 def _apply_access_filters(qs, request):
     """Applica filtri di accessibilità (any/all) e 'solo con dati disponibili'."""
-    wc = to_bool_param(request.GET.get("wheelchair"))
-    av = to_bool_param(request.GET.get("ausili_visivi"))
-    su = to_bool_param(request.GET.get("supporto_uditivo"))
-    mode = (request.GET.get("acc_mode") or "any").strip().lower()
-    if mode not in ("any", "all"):
-        mode = "any"
-
-    has_data = (request.GET.get("has_acc_data") or "").strip().lower() in ("1", "true", "yes", "y")
+    p = _filter_params(request)
 
-    filters = []
-    if wc is not None:
-        filters.append(Q(accessibilita__sedia_a_rotelle=wc))
-    if av is not None:
-        filters.append(Q(accessibilita__ausili_visivi=av))
-    if su is not None:
-        filters.append(Q(accessibilita__supporto_uditivo=su))
+    filters = [
+        Q(**{f"accessibilita__{field}": p[field]})
+        for field in ("sedia_a_rotelle", "ausili_visivi", "supporto_uditivo")
+        if p[field] is not None
+    ]
 
     if filters:
-        if mode == "all":
+        if p["acc_mode"] == "all":
             for f in filters:
                 qs = qs.filter(f)
         else:
             qs = qs.filter(reduce(OR, filters))
 
-    if has_data:
+    if p["has_acc_data"]:
         qs = qs.exclude(
             accessibilita__sedia_a_rotelle__isnull=True,
             accessibilita__ausili_visivi__isnull=True,
@@ -101,6 +121,13 @@ def _apply_access_filters(qs, request):
     return qs
 
 
+def _apply_viewport_filter(qs, request):
+    """Applica il filtro per viewport (bbox=minLon,minLat,maxLon,maxLat e zoom opzionale)."""
+    bbox = parse_bbox(request.GET.get("bbox"))
+    zoom = parse_zoom(request.GET.get("zoom"))
+    return filter_bbox(qs, pad_bbox(bbox, zoom))
+
+
 def _paginate(request):
     """Estrae limit/offset in modo safe."""
     try:
@@ -114,62 +141,192 @@ def _paginate(request):
     return limit, offset
 
 
-def _serialize_geojson(rows, total):
-    """Serializza i siti come FeatureCollection GeoJSON, con bbox."""
-    features = [
-        {
-            "type": "Feature",
-            "geometry": {"type": "Point", "coordinates": [s.longitudine, s.latitudine]},
-            "properties": {
-                "id": s.id,
-                "unesco_id": s.unesco_id,
-                "name": s.nome,
-                "city": s.citta,
-                "region": s.regione,
-                "category": (s.categoria.nome if s.categoria_id else None),
-                "acc": {
-                    "sedia_a_rotelle": (s.accessibilita.sedia_a_rotelle if s.accessibilita else None),
-                    "ausili_visivi": (s.accessibilita.ausili_visivi if s.accessibilita else None),
-                    "supporto_uditivo": (s.accessibilita.supporto_uditivo if s.accessibilita else None),
-                    "has_data": bool(
-                        s.accessibilita
-                        and (
-                            s.accessibilita.sedia_a_rotelle is not None
-                            or s.accessibilita.ausili_visivi is not None
-                            or s.accessibilita.supporto_uditivo is not None
-                        )
-                    ),
-                    "any_true": bool(
-                        s.accessibilita
-                        and (
-                            s.accessibilita.sedia_a_rotelle is True
-                            or s.accessibilita.ausili_visivi is True
-                            or s.accessibilita.supporto_uditivo is True
-                        )
-                    ),
-                },
-            },
-        }
-        for s in rows
-        if s.latitudine is not None and s.longitudine is not None  # coord valide
-    ]
+COUNT_MODES = ("exact", "estimate", "none")
+COUNT_CACHE_TTL = 300
 
-    payload = {"type": "FeatureCollection", "features": features, "count": total}
-    if features:
-        lons = [f["geometry"]["coordinates"][0] for f in features]
-        lats = [f["geometry"]["coordinates"][1] for f in features]
-        payload["bbox"] = [min(lons), min(lats), max(lons), max(lats)]
-    return payload
 
+def _count_mode(request):
+    mode = (request.GET.get("count") or "exact").strip().lower()
+    return mode if mode in COUNT_MODES else "exact"
 
 
+def _filter_signature(request):
+    """Firma dei soli parametri di filtro (esclusi paginazione e ordinamento)."""
+    ignored = {"limit", "offset", "cursor", "sort", "count"}
+    items = sorted((k, v) for k, v in request.GET.lists() if k not in ignored)
+    return hashlib.sha1(repr(items).encode("utf-8")).hexdigest()
+
+
+def _count(qs, request, mode):
+    if mode == "none":
+        return None
+    if mode == "estimate":
+        key = f"heritage:count:{current_version()}:{_filter_signature(request)}"
+        return cache.get_or_set(key, qs.count, COUNT_CACHE_TTL)
+    return qs.count()
+
+
+def _page_ids(request, limit, offset):
+    """Id della pagina richiesta, totale e cursori next/prev (catalogo in memoria o SQL)."""
+    params = _filter_params(request)
+    # con una ricerca testuale l'ordinamento predefinito è la rilevanza
+    default_sort = "rank" if params["q"] and search.ranks(params["q"]) else "id"
+    sort = parse_sort(request.GET.get("sort") or default_sort)
+    cursor = decode_cursor(request.GET.get("cursor"), sort)
+    mode = _count_mode(request)
+
+    if catalog.enabled() and sort[0] == "id":
+        params["bbox"] = pad_bbox(parse_bbox(request.GET.get("bbox")), parse_zoom(request.GET.get("zoom")))
+        if params["q"] and search.backend():
+            params["q_ids"] = search.matching_ids(params["q"])
+        ids = catalog.get_catalog().filter_ids(params)
+        page, nxt, prv = keyset_array(ids, sort, cursor, limit, offset)
+        return page, (None if mode == "none" else len(ids)), nxt, prv
+
+    qs = _sites_queryset(request, sort)
+    page, nxt, prv = keyset_page(qs, sort, cursor, limit, offset)
+    return page, _count(qs, request, mode), nxt, prv
+
+
+def _sites_queryset(request, sort):
+    """Siti filtrati per la paginazione SQL (senza select_related: servono solo gli id)."""
+    qs = _apply_access_filters(_apply_text_filters(Sito.objects.all(), request), request)
+    qs = _apply_viewport_filter(qs, request)
+    if sort[0] == "search_rank" and "search_rank" not in qs.query.annotations:
+        raise CursorError("sort=rank richiede una ricerca q")
+    return qs
+
+
+def _query_digest(request):
+    query = sorted(request.GET.lists())
+    return hashlib.sha1(repr(query).encode("utf-8")).hexdigest()[:16]
+
+
+def _sites_etag(request, *args, **kwargs):
+    """ETag forte: versione del dataset + firma dei parametri della richiesta."""
+    return f"{current_version()}-{_query_digest(request)}"
+
+
+@cache_control(public=True, no_cache=True)
+@condition(etag_func=_sites_etag)
 def sites_geojson(request):
     """Alias principale usato dai template."""
-    qs = _apply_access_filters(_apply_text_filters(_qs_base(), request), request)
     limit, offset = _paginate(request)
-    total = qs.count()
-    rows = qs[offset : offset + limit]
-    return JsonResponse(_serialize_geojson(rows, total), json_dumps_params={"ensure_ascii": False})
+    try:
+        ids, total, nxt, prv = _page_ids(request, limit, offset)
+    except (BBoxError, CursorError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    with profiling.section("serialize"):
+        body = render_collection(feature_cache.get_many(ids), total, {"next": nxt, "prev": prv})
+    return HttpResponse(body, content_type="application/json")
+
+
+@cache_control(public=True, no_cache=True)
+@condition(etag_func=_sites_etag)
+def sites_facets(request):
+    """Conteggi per categoria, regione e valore di accessibilità sotto i filtri correnti (bitmap in memoria)."""
+    params = _filter_params(request)
+    try:
+        params["bbox"] = pad_bbox(parse_bbox(request.GET.get("bbox")), parse_zoom(request.GET.get("zoom")))
+    except BBoxError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if params["q"]:
+        params["q_ids"] = search.matching_ids(params["q"])
+    return JsonResponse(facets.get_index().counts(params), json_dumps_params={"ensure_ascii": False})
+
+
+def _tile_etag(request, z, x, y):
+    try:
+        return tiles.get_tile(z, x, y)[1]
+    except tiles.TileError:
+        return None
+
+
+@cache_control(public=True, no_cache=True)
+@condition(etag_func=_tile_etag)
+def sites_tile(request, z: int, x: int, y: int):
+    """Vector tile (MVT) dei siti; il browser riusa le tessere invariate tramite ETag."""
+    try:
+        with profiling.section("serialize"):
+            body, _ = tiles.get_tile(z, x, y)
+    except tiles.TileError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return HttpResponse(body, content_type="application/vnd.mapbox-vector-tile")
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+@condition(etag_func=_sites_etag)
+def sites_export(request):
+    """Export completo (senza limit) in streaming: memoria costante anche sull'intero catalogo."""
+    qs = _apply_access_filters(_apply_text_filters(_qs_base(), request), request)
+    try:
+        qs = _apply_viewport_filter(qs, request)
+    except BBoxError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    rows = qs.order_by("id").iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    return StreamingHttpResponse(stream_collection(rows), content_type="application/geo+json")
+
+
+def sites_clusters(request):
+    """Cluster dei siti per livello di zoom, letti dalla piramide precalcolata."""
+    zoom = parse_zoom(request.GET.get("zoom"))
+    if zoom is None:
+        return JsonResponse({"error": "parametro zoom obbligatorio"}, status=400)
+    try:
+        bbox = parse_bbox(request.GET.get("bbox"))
+    except BBoxError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    features = clusters.query(zoom, bbox)
+    return JsonResponse(
+        {"type": "FeatureCollection", "features": features, "zoom": zoom},
+        json_dumps_params={"ensure_ascii": False},
+    )
+
+
+def sites_suggest(request):
+    """Suggerimenti per la casella di ricerca, dall'indice dei prefissi in memoria."""
+    q = (request.GET.get("q") or "").strip()
+    try:
+        k = max(1, min(int(request.GET.get("k", 8)), 20))
+    except ValueError:
+        k = 8
+    return JsonResponse(
+        {"q": q, "suggestions": suggest.get_index().query(q, k)},
+        json_dumps_params={"ensure_ascii": False},
+    )
+
+
+def sites_nearby(request, pk: int):
+    """Siti più vicini a `pk`, letti dalla tabella kNN precalcolata (nessun calcolo di distanze)."""
+    sito = get_object_or_404(Sito.objects.only("id", "nome"), pk=pk)
+    try:
+        k = max(1, min(int(request.GET.get("k", 5)), K_MAX))
+        radius = request.GET.get("radius_km")
+        radius = float(radius) if radius not in (None, "") else None
+    except ValueError:
+        return JsonResponse({"error": "k e radius_km devono essere numerici"}, status=400)
+
+    qs = SitoVicino.objects.filter(sito=sito).select_related("vicino")
+    if radius is not None:
+        qs = qs.filter(distanza_km__lte=radius)
+    results = [
+        {
+            "id": v.vicino_id,
+            "name": v.vicino.nome,
+            "city": v.vicino.citta,
+            "region": v.vicino.regione,
+            "lat": v.vicino.latitudine,
+            "lon": v.vicino.longitudine,
+            "distance_km": round(v.distanza_km, 3),
+        }
+        for v in qs.order_by("rango")[:k]
+    ]
+    return JsonResponse(
+        {"site": sito.id, "name": sito.nome, "count": len(results), "results": results},
+        json_dumps_params={"ensure_ascii": False},
+    )
 
 
 def siti_geojson(request):
@@ -178,28 +335,40 @@ def siti_geojson(request):
 
 
 def itinerario_geojson(request, pk: int):
-    itin = get_object_or_404(Itinerario.objects.prefetch_related("tappe__sito"), pk=pk)
-    features = []
-    for tappa in itin.tappe.all():
-        sito = tappa.sito
-        if sito.latitudine is not None and sito.longitudine is not None:
-
-            features.append(
-                {
-                    "type": "Feature",
-                    "geometry": {"type": "Point", "coordinates": [sito.longitudine, sito.latitudine]},
-                    "properties": {
-                        "id": sito.id,
-                        "name": sito.nome,
-                        "city": sito.citta,
-                        "region": sito.regione,
-                        "order": tappa.ordine,
-                        "category": (sito.categoria.nome if sito.categoria else None),
-                    },
-                }
-            )
-    return JsonResponse({"type": "FeatureCollection", "features": features}, json_dumps_params={"ensure_ascii": False})
+    """Tappe, tracciato, distanze e accessibilità dell'itinerario (payload in cache)."""
+    itin = get_object_or_404(Itinerario, pk=pk)
+    with profiling.section("serialize"):
+        body = itinerari.geojson_bytes(itin)
+    return HttpResponse(body, content_type="application/json")
+
+
 
+def itinerario_availability(request, pk: int):
+    """Calendario dei posti liberi (solo dalla tabella dei contatori, mai da Booking)."""
+    itin = get_object_or_404(Itinerario.objects.only("id", "capienza_giornaliera"), pk=pk)
+    try:
+        start = datetime.date.fromisoformat(request.GET["from"]) if request.GET.get("from") else timezone.localdate()
+        end = datetime.date.fromisoformat(request.GET["to"]) if request.GET.get("to") else start + datetime.timedelta(days=30)
+    except ValueError:
+        return JsonResponse({"error": "from e to devono essere date ISO (AAAA-MM-GG)"}, status=400)
+    if end < start or (end - start).days >= capacity.MAX_GIORNI:
+        return JsonResponse({"error": f"intervallo non valido (massimo {capacity.MAX_GIORNI} giorni)"}, status=400)
+    return JsonResponse({
+        "itinerario": itin.pk,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "days": capacity.availability(itin, start, end),
+    })
+
+
+def itinerari_api(request):
+    """Lista JSON paginata degli itinerari con il riepilogo di accessibilità (nessuna join)."""
+    limit, offset = _paginate(request)
+    qs = itinerari.list_queryset()
+    rows = list(qs[offset : offset + limit])
+    with profiling.section("serialize"):
+        body = itinerari.render_list(rows, qs.count(), limit, offset)
+    return HttpResponse(body, content_type="application/json")
 
 
 class ItinerarioListView(ListView):
@@ -209,30 +378,8 @@ class ItinerarioListView(ListView):
     paginate_by = 12
 
     def get_queryset(self):
-        qs = Itinerario.objects.all().order_by("nome")
-
-        wc_subq = Tappa.objects.filter(
-            itinerario=OuterRef("pk"),
-            sito__accessibilita__sedia_a_rotelle=True
-        )
-        visivi_subq = Tappa.objects.filter(
-            itinerario=OuterRef("pk"),
-            sito__accessibilita__ausili_visivi=True
-        )
-        uditivo_subq = Tappa.objects.filter(
-            itinerario=OuterRef("pk"),
-            sito__accessibilita__supporto_uditivo=True
-        )
-
-        qs = qs.annotate(
-            has_wheelchair=Exists(wc_subq),
-            has_visivi=Exists(visivi_subq),
-            has_uditivo=Exists(uditivo_subq),
-        ).prefetch_related(
-            "tappe__sito__accessibilita"  
-        )
-
-        return qs
+        # copertura accessibilità già materializzata su Itinerario (itinerari.refresh_rollup)
+        return Itinerario.objects.order_by("nome")
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
@@ -252,7 +399,24 @@ def itinerario_dettaglio(request, pk: int):
     is_prenotato = False
     if request.user.is_authenticated:
         is_prenotato = PrenotazioneItinerario.objects.filter(user=request.user, itinerario=itin).exists()
-    return render(request, "heritage/itinerario_dettaglio.html", {"itinerario": itin, "is_prenotato": is_prenotato})
+    return render(
+        request,
+        "heritage/itinerario_dettaglio.html",
+        {"itinerario": itin, "is_prenotato": is_prenotato, "siti_vicini": _siti_vicini(itin)},
+    )
+
+
+def _siti_vicini(itin, limit=6):
+    """Siti fuori dall'itinerario più vicini a una qualsiasi tappa (dalla tabella kNN)."""
+    tappe = [t.sito_id for t in itin.tappe.all()]
+    best = {}
+    rows = (
+        SitoVicino.objects.filter(sito_id__in=tappe).exclude(vicino_id__in=tappe)
+        .select_related("vicino", "sito").order_by("distanza_km")[: limit * 4]
+    )
+    for v in rows:
+        best.setdefault(v.vicino_id, v)
+    return list(best.values())[:limit]
 
 
 
@@ -276,9 +440,27 @@ class BookingCreateView(CreateView):
         self.itinerario = get_object_or_404(Itinerario, pk=kwargs["pk"])
         return super().dispatch(request, *args, **kwargs)
 
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx["itinerario"] = self.itinerario
+        return ctx
+
     def form_valid(self, form):
-        form.instance.itinerario = self.itinerario
-        return super().form_valid(form)
+        booking = form.instance
+        booking.itinerario = self.itinerario
+        with transaction.atomic():
+            try:
+                capacity.reserve(self.itinerario, booking.data, booking.numero_persone)
+            except capacity.CapacityError as e:
+                form.add_error("numero_persone", str(e))
+                return self.form_invalid(form)
+            # posti già occupati: il segnale post_save non li conta di nuovo
+            booking._posti_db = (self.itinerario.pk, booking.data, booking.numero_persone)
+            response = super().form_valid(form)
+            # email di conferma inviata da run_workers: la risposta non la aspetta
+            jobs.enqueue("booking.conferma", priorita=10, dedup_key=f"booking:{booking.pk}:conferma",
+                         booking_id=booking.pk)
+            return response
 
     def get_success_url(self):
         return reverse_lazy("itinerari_list")
\ No newline at end of file
@@ -1,80 +1,98 @@
 import os
+import sys
 import django
-import csv
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'unesco_it.settings')
 django.setup()
 
+from django.db import DatabaseError, transaction
+
+from heritage import itinerari, nearby
+from heritage.ingest import Pipeline, normalize_legacy_row
 from heritage.models import Sito, Categoria, Accessibilita
+from heritage.versioning import bump_catalog_version
+
+ACC_FIELDS = ['sedia_a_rotelle', 'ausili_visivi', 'supporto_uditivo', 'note']
+SITO_FIELDS = [
+    'nome', 'descrizione', 'regione', 'citta', 'latitudine', 'longitudine', 'anno_iscrizione',
+]
+
+categorie = dict(Categoria.objects.values_list('nome', 'id'))
+errori = []  # unesco_id delle righe rifiutate dal DB
 
 
+def categoria_id(nome):
+    if nome and nome not in categorie:
+        categorie[nome] = Categoria.objects.get_or_create(nome=nome)[0].id
+    return categorie.get(nome)
 
-csv_file = 'siti_unesco.csv' 
 
-with open(csv_file, 'r', encoding='utf-8') as f:
-    reader = csv.DictReader(f)
-    
-    for i, row in enumerate(reader, 1):
+def write(batch):
+    """Un lotto; se il DB lo rifiuta si riprova riga per riga, saltando (e segnalando) quelle in errore."""
+    try:
+        with transaction.atomic():
+            write_records(batch)
+        return
+    except DatabaseError:
+        pass
+    for rec in batch:
+        # le categorie create nel savepoint annullato non esistono più
+        categorie.clear()
+        categorie.update(Categoria.objects.values_list('nome', 'id'))
         try:
-            unesco_id = row.get('unesco_id', '').strip()
-            
-            if Sito.objects.filter(unesco_id=unesco_id).exists():
-                print(f"⏭️  [{i}] {unesco_id} - Già presente, aggiorno accessibilità...")
-                sito = Sito.objects.get(unesco_id=unesco_id)
-            else:
-                print(f"➕ [{i}] Creo nuovo sito: {row.get('nome', '').strip()}")
-                
-                categoria_nome = row.get('categoria', '').strip()
-                categoria = None
-                if categoria_nome:
-                    categoria, _ = Categoria.objects.get_or_create(nome=categoria_nome)
-                
-                lat = row.get('lat', '').strip()
-                long = row.get('long', '').strip()
-                
-                sito = Sito.objects.create(
-                    nome=row.get('nome', '').strip(),
-                    descrizione=row.get('descrizione', '').strip(),
-                    regione=row.get('regione', '').strip(),
-                    citta=row.get('citta', '').strip(),
-                    latitudine=float(lat) if lat else None,
-                    longitudine=float(long) if long else None,
-                    categoria=categoria,
-                    anno_iscrizione=int(row.get('anno', '')) if row.get('anno', '').strip() else None,
-                    unesco_id=unesco_id
-                )
-            
-            def str_to_bool(s):
-                if s == '1':
-                    return True
-                elif s == '0':
-                    return False
-                return None
-            
-            wheelchair = str_to_bool(row.get('wheelchair', '').strip())
-            ausili_visivi = str_to_bool(row.get('ausili_visivi', '').strip())
-            supporto_uditivo = str_to_bool(row.get('supporto_uditivo', '').strip())
-            
-            if sito.accessibilita:
-                sito.accessibilita.sedia_a_rotelle = wheelchair
-                sito.accessibilita.ausili_visivi = ausili_visivi
-                sito.accessibilita.supporto_uditivo = supporto_uditivo
-                sito.accessibilita.note = row.get('note', '').strip()
-                sito.accessibilita.save()
-            else:
-                acc = Accessibilita.objects.create(
-                    sedia_a_rotelle=wheelchair,
-                    ausili_visivi=ausili_visivi,
-                    supporto_uditivo=supporto_uditivo,
-                    note=row.get('note', '').strip()
-                )
-                sito.accessibilita = acc
-                sito.save()
-            
-            print(f"   ✓ Accessibilità: 🪑={wheelchair} 👁️={ausili_visivi} 🔊={supporto_uditivo}")
-        
-        except Exception as e:
-            print(f"✗ Errore riga {i} ({row.get('nome', 'Unknown')}): {e}")
-
-print(f"\n✅ Importazione completata!")
-print(f"Total siti in DB: {Sito.objects.count()}")
\ No newline at end of file
+            with transaction.atomic():
+                write_records([rec])
+        except DatabaseError as e:
+            errori.append(rec['unesco_id'])
+            print(f"✗ Errore riga {rec['unesco_id']} ({rec['nome'] or 'Unknown'}): {e}")
+
+
+def write_records(batch):
+    """Crea i siti mancanti e aggiorna/crea la loro accessibilità."""
+    records = {r['unesco_id']: r for r in batch}
+    siti = {
+        s.unesco_id: s
+        for s in Sito.objects.filter(unesco_id__in=records).select_related('accessibilita')
+    }
+
+    nuovi = [
+        Sito(unesco_id=uid, categoria_id=categoria_id(rec['categoria']), **{k: rec[k] for k in SITO_FIELDS})
+        for uid, rec in records.items() if uid not in siti
+    ]
+    Sito.objects.bulk_create(nuovi)
+    siti.update((s.unesco_id, s) for s in nuovi)
+    print(f"➕ {len(nuovi)} nuovi siti | ⏭️  {len(records) - len(nuovi)} già presenti, aggiorno accessibilità...")
+
+    da_aggiornare, da_creare = [], []
+    for uid, rec in records.items():
+        sito = siti[uid]
+        vals = {k: rec[k] for k in ACC_FIELDS}
+        if sito.accessibilita:
+            for k, v in vals.items():
+                setattr(sito.accessibilita, k, v)
+            da_aggiornare.append(sito.accessibilita)
+        else:
+            sito.accessibilita = Accessibilita(**vals)
+            da_creare.append(sito)
+
+    Accessibilita.objects.bulk_update(da_aggiornare, ACC_FIELDS)
+    Accessibilita.objects.bulk_create([s.accessibilita for s in da_creare])
+    Sito.objects.bulk_update(da_creare, ['accessibilita'])
+
+
+if __name__ == '__main__':
+    csv_file = sys.argv[1] if len(sys.argv) > 1 else 'siti_unesco.csv'
+    try:
+        stats = Pipeline(csv_file, normalize_legacy_row).run(write)
+    finally:
+        # gli insert in blocco non inviano segnali: invalida a mano cache e indici,
+        # anche se un lotto fallisce (i lotti precedenti sono già committati)
+        bump_catalog_version()
+        nearby.rebuild()
+        itinerari.refresh_rollup()
+
+    print(f"\n✅ Importazione completata!")
+    print(stats.summary())
+    if errori:
+        print(f"⚠️  Righe non importate per errori del DB: {len(errori)}")
+    print(f"Total siti in DB: {Sito.objects.count()}")
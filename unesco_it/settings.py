@@ -39,6 +39,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "heritage.profiling.ProfilingMiddleware",
+    "heritage.versioning.CatalogVersionMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -108,3 +110,28 @@ STATIC_URL = "static/"
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Motore dei filtri della API siti: "orm" (query SQL) oppure "numpy"
+# (catalogo colonnare in memoria, vedi heritage/catalog.py)
+HERITAGE_CATALOG_ENGINE = "orm"
+
+# Profilo SQL per richiesta (header Server-Timing), vedi heritage/profiling.py
+HERITAGE_PROFILING = DEBUG
+HERITAGE_PROFILING_LOG = False
+# budget di query per vista in aggiunta/sostituzione di profiling.QUERY_BUDGETS
+HERITAGE_QUERY_BUDGETS = {}
+HERITAGE_QUERY_BUDGET_STRICT = False
+
+# Secondi per cui la versione del dataset resta in cache prima di rileggerla
+# dal DB (heritage/versioning.py); con una cache condivisa gli incrementi
+# sono visibili subito, con la LocMemCache al più dopo questo intervallo
+HERITAGE_CATALOG_VERSION_TTL = 5
+
+# Coda lavori (heritage/jobs.py): True esegue subito nel processo che accoda
+HERITAGE_JOBS_EAGER = False
+
+# Viste async (heritage/async_views.py): thread per la serializzazione JSON (None = min(4, CPU))
+HERITAGE_ASYNC_SERIALIZE_WORKERS = None
+
+EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
+DEFAULT_FROM_EMAIL = "prenotazioni@unesco-italia.local"
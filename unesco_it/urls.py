@@ -1,12 +1,25 @@
 from django.contrib import admin
 from django.urls import path, include
-from heritage.views import home, siti_geojson, itinerario_geojson, ItinerarioListView, itinerario_dettaglio, toggle_prenotazione
-from heritage.views import BookingCreateView
+from heritage.views import home, siti_geojson, sites_clusters, sites_export, sites_facets, sites_nearby, sites_suggest, sites_tile, itinerario_availability, itinerario_geojson, ItinerarioListView, itinerario_dettaglio, toggle_prenotazione
+from heritage.views import BookingCreateView, itinerari_api
+from heritage import async_views
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", home, name="home"),
     path("api/sites.geojson", siti_geojson, name="sites_geojson"),
+    path("api/sites/clusters", sites_clusters, name="sites_clusters"),
+    path("api/sites/export.geojson", sites_export, name="sites_export"),
+    path("api/sites/facets", sites_facets, name="sites_facets"),
+    path("api/sites/suggest", sites_suggest, name="sites_suggest"),
+    path("api/tiles/sites/<int:z>/<int:x>/<int:y>.pbf", sites_tile, name="sites_tile"),
+    path("api/sites/<int:pk>/nearby", sites_nearby, name="sites_nearby"),
     path("api/itinerario/<int:pk>.geojson", itinerario_geojson, name="itinerario_geojson"),
+    path("api/itinerari/<int:pk>/availability", itinerario_availability, name="itinerario_availability"),
+    path("api/itinerari", itinerari_api, name="itinerari_api"),
+    # stesse API in versione async (deploy ASGI)
+    path("api/async/sites.geojson", async_views.sites_geojson, name="async_sites_geojson"),
+    path("api/async/itinerario/<int:pk>.geojson", async_views.itinerario_geojson, name="async_itinerario_geojson"),
+    path("api/async/itinerari", async_views.itinerari_api, name="async_itinerari_api"),
     path("itinerari/", ItinerarioListView.as_view(), name="itinerari_list"),
     path("itinerari/<int:pk>/", itinerario_dettaglio, name="itinerario_dettaglio"),
     path("itinerari/<int:pk>/toggle-prenota/", toggle_prenotazione, name="toggle_prenotazione"),